@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# run_benchmarks.py
+#
+# Time each stage of the pipeline on synthetic genome-scale data and write the
+# results as JSON, so runs on different commits can be compared.
+#
+# python benchmarks/run_benchmarks.py --genes 20000 --sites 2000000 -o bench_results.json
+# python benchmarks/run_benchmarks.py --compare old.json bench_results.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import write_synthetic_gtf, write_synthetic_site_proba
+from interogate.parse_gtf import parse_gff_gft, iter_gff_gft
+from interogate.return_dict import (generate_transcript_coordinates, query_transcript_exon,
+                                    COORDINATE_FEATURE_TYPES)
+from interogate.index_cache import save_index, load_index
+from interogate.parse_m6a_site_proba import identify_methylated_sites
+from interogate.annotate import annotate_methylated_sites
+from interogate.summary_stats import summarize_methylation_sites
+from interogate.stream import AnnotatedSiteWriter, stream_annotate
+from interogate.metagene import metagene_positions, metagene_bin_counts
+from interogate.instrument import RunReport, max_rss_mb
+
+
+def git_commit():
+    """The current git commit of the repository, if there is one."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Generate the synthetic data, run every stage and return the report."""
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="m6a_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    gtf_path = os.path.join(work_dir, "synthetic.gff3")
+    site_path = os.path.join(work_dir, "synthetic.site_proba.csv")
+    report = RunReport()
+
+    try:
+        with report.stage("generate_synthetic_gtf"):
+            transcript_lengths = write_synthetic_gtf(gtf_path, n_genes=args.genes, seed=args.seed)
+        with report.stage("generate_synthetic_site_proba", rows_in=args.sites):
+            write_synthetic_site_proba(site_path, transcript_lengths, n_rows=args.sites,
+                                       seed=args.seed + 1)
+
+        with report.stage("parse_gff_gft") as stage:
+            features = parse_gff_gft(gtf_path)
+            stage.rows_out = len(features)
+        del features
+
+        with report.stage("generate_transcript_coordinates") as stage:
+            transcript_dict, transcript_exon_counts, gene_exon_counts, \
+                last_exon_for_transcript = generate_transcript_coordinates(
+                    iter_gff_gft(gtf_path, feature_types=COORDINATE_FEATURE_TYPES))
+            stage.rows_out = len(transcript_dict.exon_starts)
+
+        index_path = os.path.join(work_dir, "synthetic.gff3.m6aidx")
+        with report.stage("save_index"):
+            save_index(index_path, gtf_path, transcript_dict, transcript_exon_counts, gene_exon_counts)
+        with report.stage("load_index"):
+            load_index(index_path)
+
+        with report.stage("identify_methylated_sites") as stage:
+            sites = identify_methylated_sites(site_path, args.threshold)
+            stage.rows_out = len(sites)
+
+        sample = sites.head(args.query_sample)
+        sample_ids = sample['transcript_id'].astype(str).tolist()
+        sample_positions = sample['transcript_position'].tolist()
+        with report.stage("query_transcript_exon", rows_in=len(sample)):
+            for transcript_id, position in zip(sample_ids, sample_positions):
+                query_transcript_exon(transcript_dict, transcript_id, position)
+
+        with report.stage("annotate_methylated_sites", rows_in=len(sites)):
+            results_df = annotate_methylated_sites(sites, transcript_dict, gene_exon_counts)
+
+        with report.stage("summarize_methylation_sites", rows_in=len(results_df)):
+            summarize_methylation_sites(results_df, os.path.join(work_dir, "summary.tab"))
+        with report.stage("metagene", rows_in=len(results_df)) as stage:
+            stage.rows_out = int(metagene_bin_counts(metagene_positions(results_df, transcript_dict)).sum())
+        del results_df, sites
+
+        with report.stage("stream_annotate") as stage:
+            with AnnotatedSiteWriter(os.path.join(work_dir, "stream_annotated.tab")) as writer:
+                counts, stage.rows_out = stream_annotate(site_path, transcript_dict, gene_exon_counts,
+                                                         writer, args.threshold, args.batch_size)
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'parameters': {'genes': args.genes, 'sites': args.sites, 'threshold': args.threshold,
+                       'query_sample': args.query_sample, 'batch_size': args.batch_size,
+                       'seed': args.seed},
+        'transcripts': len(transcript_lengths),
+        'stages': report.stages,
+        'peak_rss_mb': round(max_rss_mb(), 1),
+    }
+
+
+def compare(old_file, new_file):
+    """Print the time and memory of each stage of two reports side by side."""
+    with open(old_file) as handle:
+        old = {stage['stage']: stage for stage in json.load(handle)['stages']}
+    with open(new_file) as handle:
+        new = {stage['stage']: stage for stage in json.load(handle)['stages']}
+    print(f"{'stage':<40} {'old s':>9} {'new s':>9} {'ratio':>7} {'old MB':>9} {'new MB':>9}")
+    for name, stage in new.items():
+        if name not in old:
+            continue
+        ratio = stage['seconds'] / old[name]['seconds'] if old[name]['seconds'] else float('nan')
+        print(f"{name:<40} {old[name]['seconds']:>9.3f} {stage['seconds']:>9.3f} {ratio:>7.2f} "
+              f"{old[name]['peak_rss_mb']:>9.1f} {stage['peak_rss_mb']:>9.1f}")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="benchmark the m6anet interogater " +
+                                     "on synthetic genome-scale data")
+    parser.add_argument("--genes", type=int, default=20000,
+                        help="number of synthetic genes (1-3 transcripts each)")
+    parser.add_argument("--sites", type=int, default=2000000,
+                        help="number of rows in the synthetic site_proba file")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="probability threshold for identify_methylated_sites")
+    parser.add_argument("--query-sample", dest='query_sample', type=int, default=200000,
+                        help="number of sites timed with the per-site query_transcript_exon")
+    parser.add_argument("--batch-size", dest='batch_size', type=int, default=1000000,
+                        help="CSV rows per batch for the stream_annotate stage")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--work-dir", dest='work_dir', default=None,
+                        help="directory for the synthetic files. Default is a temporary directory")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the temporary synthetic files")
+    parser.add_argument("-o", "--out", default="bench_results.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--compare", nargs=2, metavar=('OLD', 'NEW'), default=None,
+                        help="compare two result files instead of running")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run(args)
+    with open(args.out, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Benchmark results saved to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
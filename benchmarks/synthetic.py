@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# synthetic.py
+#
+# Generate genome-scale synthetic GFF3 annotations and m6anet site_proba files
+# for benchmarking. Files follow the layout of Araport11 and m6anet output.
+
+import numpy as np
+import pandas as pd
+
+CHROMOSOMES = ['1', '2', '3', '4', '5']
+DRACH = [d + r + 'AC' + h for d in 'AGT' for r in 'AG' for h in 'ACT']
+
+
+def write_synthetic_gtf(file_path, n_genes=10000, max_transcripts_per_gene=3,
+                        min_exons=1, max_exons=15, seed=0):
+    """
+    Write a synthetic GFF3 annotation with multi-exon transcripts on both strands.
+
+    Each gene gets gene, mRNA, exon, five_prime_UTR, CDS and three_prime_UTR
+    records. Exons are numbered per gene as in Araport11 (exon 1 at the 5' end, so
+    the highest coordinate on the minus strand) and alternative transcripts skip
+    internal exons.
+
+    Parameters:
+    file_path (str): Path of the GFF3 file to write.
+    n_genes (int): Number of genes.
+    max_transcripts_per_gene (int): Each gene has 1 to this many transcripts.
+    min_exons (int): Fewest exons per gene.
+    max_exons (int): Most exons per gene.
+    seed (int): Random seed.
+
+    Returns:
+    dict: Maps each transcript ID to its length in nucleotides.
+    """
+    rng = np.random.default_rng(seed)
+    transcript_lengths = {}
+    position = {chrom: 1000 for chrom in CHROMOSOMES}
+    attributes = "Note=synthetic gene"
+
+    with open(file_path, 'w') as out:
+        out.write("##gff-version 3\n#synthetic annotation for benchmarking\n")
+        for gene_number in range(1, n_genes + 1):
+            chrom = CHROMOSOMES[gene_number % len(CHROMOSOMES)]
+            strand = '+' if rng.random() < 0.5 else '-'
+            gene_id = f"SYN{gene_number:06d}"
+
+            # Gene-level exons in ascending genomic order
+            n_exons = int(rng.integers(min_exons, max_exons + 1))
+            exon_lengths = rng.integers(50, 600, n_exons)
+            intron_lengths = rng.integers(80, 1500, n_exons)
+            starts = position[chrom] + np.concatenate([[0], np.cumsum(exon_lengths + intron_lengths)[:-1]])
+            ends = starts + exon_lengths - 1
+            position[chrom] = int(ends[-1]) + int(rng.integers(500, 5000))
+            if strand == '+':
+                exon_numbers = np.arange(1, n_exons + 1)
+            else:
+                exon_numbers = np.arange(n_exons, 0, -1)
+
+            out.write(f"{chrom}\tsynthetic\tgene\t{starts[0]}\t{ends[-1]}\t.\t{strand}\t.\t"
+                      f"ID={gene_id};Name={gene_id};{attributes}\n")
+
+            n_transcripts = int(rng.integers(1, max_transcripts_per_gene + 1))
+            for transcript_number in range(1, n_transcripts + 1):
+                transcript_id = f"{gene_id}.{transcript_number}"
+                keep = np.ones(n_exons, dtype=bool)
+                if transcript_number > 1 and n_exons > 2:
+                    keep[rng.integers(1, n_exons - 1)] = False
+                t_starts, t_ends, t_numbers = starts[keep], ends[keep], exon_numbers[keep]
+                transcript_lengths[transcript_id] = int((t_ends - t_starts + 1).sum())
+
+                out.write(f"{chrom}\tsynthetic\tmRNA\t{t_starts[0]}\t{t_ends[-1]}\t.\t{strand}\t.\t"
+                          f"ID={transcript_id};Parent={gene_id};Name={transcript_id}\n")
+                for start, end, number in zip(t_starts, t_ends, t_numbers):
+                    out.write(f"{chrom}\tsynthetic\texon\t{start}\t{end}\t.\t{strand}\t.\t"
+                              f"ID={gene_id}:exon:{number};Parent={transcript_id};"
+                              f"Name={gene_id}:exon:{number};{attributes}\n")
+
+                # CDS from inside the lowest exon to inside the highest exon
+                cds_start = int(t_starts[0]) + int(rng.integers(0, (t_ends[0] - t_starts[0]) // 2 + 1))
+                cds_end = int(t_ends[-1]) - int(rng.integers(0, (t_ends[-1] - t_starts[-1]) // 2 + 1))
+                if cds_end <= cds_start:
+                    continue
+                low_utr = 'five_prime_UTR' if strand == '+' else 'three_prime_UTR'
+                high_utr = 'three_prime_UTR' if strand == '+' else 'five_prime_UTR'
+                for start, end in zip(t_starts, t_ends):
+                    pieces = [(low_utr, start, min(end, cds_start - 1)),
+                              ('CDS', max(start, cds_start), min(end, cds_end)),
+                              (high_utr, max(start, cds_end + 1), end)]
+                    for feature, piece_start, piece_end in pieces:
+                        if piece_start <= piece_end:
+                            out.write(f"{chrom}\tsynthetic\t{feature}\t{piece_start}\t{piece_end}\t.\t"
+                                      f"{strand}\t.\tParent={transcript_id}\n")
+    return transcript_lengths
+
+
+def write_synthetic_site_proba(file_path, transcript_lengths, n_rows=1000000,
+                               missing_fraction=0.02, seed=1):
+    """
+    Write a synthetic m6anet data.site_proba.csv.
+
+    Sites are drawn uniformly over the transcripts and their lengths, sorted by
+    transcript and position as m6anet writes them. A small fraction of rows use
+    transcripts that are not in the annotation, and some positions run past the
+    end of the transcript, so both UTR code paths are exercised.
+
+    Parameters:
+    file_path (str): Path of the CSV file to write.
+    transcript_lengths (dict): Maps each transcript ID to its length.
+    n_rows (int): Number of sites to write.
+    missing_fraction (float): Fraction of sites on unannotated transcripts.
+    seed (int): Random seed.
+    """
+    rng = np.random.default_rng(seed)
+    transcript_ids = np.array(list(transcript_lengths), dtype=object)
+    lengths = np.array(list(transcript_lengths.values()), dtype=np.int64)
+
+    picks = rng.integers(0, len(transcript_ids), n_rows)
+    positions = (rng.random(n_rows) * (lengths[picks] * 1.05)).astype(np.int64) + 1
+    ids = transcript_ids[picks]
+    missing = rng.random(n_rows) < missing_fraction
+    ids[missing] = np.array([f"UNANNOTATED{number:06d}.1" for number in picks[missing]], dtype=object)
+
+    n_reads = rng.poisson(60, n_rows) + 20
+    probability = rng.beta(0.6, 2.0, n_rows)
+    mod_ratio = np.clip(probability * rng.uniform(0.5, 1.0, n_rows), 0, 1)
+    kmers = np.array(DRACH, dtype=object)[rng.integers(0, len(DRACH), n_rows)]
+
+    sites = pd.DataFrame({
+        'transcript_id': ids,
+        'transcript_position': positions,
+        'n_reads': n_reads,
+        'probability_modified': probability,
+        'kmer': kmers,
+        'mod_ratio': mod_ratio
+    }).sort_values(['transcript_id', 'transcript_position'], kind='stable')
+    sites.to_csv(file_path, index=False)
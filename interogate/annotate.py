@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# annotate.py
+
+import numpy as np
+import pandas as pd
+from interogate.exon_index import REGION_LABELS
+
+# Distances in nt along the transcript, written after the region column
+DISTANCE_COLUMNS = ['distance_upstream_junction', 'distance_downstream_junction',
+                    'distance_stop_codon']
+
+
+def _fill_missing(values, found, fill):
+    """
+    Combine per-site values with a fill value for the sites that were not found.
+
+    The column types match what pandas infers from the old list of result dicts:
+    plain integers when every site was found, otherwise a mixed object column
+    (or float with NaN when the fill value is None).
+    """
+    if found.all():
+        return values
+    if fill is None:
+        column = values.astype(float)
+        column[~found] = np.nan
+        return column
+    column = values.astype(object)
+    column[~found] = fill
+    return column
+
+
+def _annotate_arrays(transcript_ids, positions, transcript_dict, gene_exon_counts):
+    """
+    Look up every site and return the raw annotation arrays.
+
+    Returns:
+    dict: exon_number, total_exons_in_transcript, total_exons_in_gene (int64),
+          found, gene_known and is_last_exon (bool), region (int8 index into
+          REGION_LABELS) and the junction and stop codon distances (float64,
+          NaN where undefined), one value per site.
+    """
+    # Transcript IDs are resolved once per distinct transcript (cheap for the
+    # categorical IDs from identify_methylated_sites), then spread to the sites
+    codes, uniques = pd.factorize(transcript_ids)
+    uniques = np.asarray(uniques, dtype=object)
+    rows = transcript_dict.rows_for(uniques)
+    gene_counts = np.array([gene_exon_counts.get(str(transcript_id).split('.')[0], -1)
+                            for transcript_id in uniques], dtype=np.int64)
+    last_exons = np.where(rows >= 0, transcript_dict.last_exons[np.clip(rows, 0, None)], -1)
+
+    site_rows = rows[codes]
+    site_gene_counts = gene_counts[codes]
+    site_last_exons = last_exons[codes]
+
+    slots = transcript_dict.find_exon_slots_by_row(site_rows, positions)
+    exon_numbers, total_exons, found = transcript_dict.find_exons_by_row(site_rows, positions, slots)
+    exon_numbers = exon_numbers.astype(np.int64)
+    upstream, downstream = transcript_dict.junction_distances_by_row(site_rows, positions, slots)
+    return {
+        'exon_number': exon_numbers,
+        'total_exons_in_transcript': total_exons.astype(np.int64),
+        'total_exons_in_gene': site_gene_counts,
+        'found': found,
+        'gene_known': found & (site_gene_counts >= 0),
+        'is_last_exon': found & (exon_numbers == site_last_exons),
+        'region': transcript_dict.find_regions_by_row(site_rows, positions),
+        'distance_upstream_junction': upstream,
+        'distance_downstream_junction': downstream,
+        'distance_stop_codon': transcript_dict.stop_codon_distances_by_row(site_rows, positions, found)
+    }
+
+
+def _annotation_frame(transcript_ids, positions, arrays):
+    """Build the annotate_methylated_sites DataFrame from raw annotation arrays."""
+    found = arrays['found']
+    return pd.DataFrame({
+        'transcript_id': transcript_ids.to_numpy(dtype=object),
+        'position': positions,
+        'exon_number': _fill_missing(arrays['exon_number'], found, 'UTR'),
+        'total_exons_in_transcript': _fill_missing(arrays['total_exons_in_transcript'], found, None),
+        'total_exons_in_gene': _fill_missing(arrays['total_exons_in_gene'],
+                                             arrays['gene_known'], 'Unknown'),
+        'is_last_exon': arrays['is_last_exon'],
+        'region': np.asarray(REGION_LABELS, dtype=object)[arrays['region']],
+        **{column: arrays[column] for column in DISTANCE_COLUMNS}
+    })
+
+
+def annotate_methylated_sites(methylated_sites, transcript_dict, gene_exon_counts):
+    """
+    Annotate every methylated site with its exon in one vectorized pass.
+
+    Parameters:
+    methylated_sites (DataFrame): Sites with 'transcript_id' and 'transcript_position' columns.
+    transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+    gene_exon_counts (dict): Maps each gene ID to its number of unique exons.
+
+    Returns:
+    DataFrame: One row per site with transcript_id, position, exon_number ('UTR' when
+               the site is in no exon), total_exons_in_transcript, total_exons_in_gene,
+               is_last_exon, region (five_prime_UTR, CDS, three_prime_UTR,
+               intron_retained or unannotated) and, in nt along the transcript,
+               distance_upstream_junction and distance_downstream_junction to the
+               nearest exon junction 5' and 3' of the site and distance_stop_codon,
+               negative 5' of the end of the CDS (NaN where undefined).
+    """
+    transcript_ids = methylated_sites['transcript_id']
+    positions = methylated_sites['transcript_position'].to_numpy()
+    arrays = _annotate_arrays(transcript_ids, positions, transcript_dict, gene_exon_counts)
+    return _annotation_frame(transcript_ids, positions, arrays)
+
+
+class SiteAnnotationLookup:
+    """
+    Annotation of the distinct (transcript_id, transcript_position) sites of many samples.
+
+    Replicates share most of their sites, so each distinct site is looked up in
+    the exon index once and every sample is annotated by joining its sites to
+    this table. The cost of the lookup grows with the number of distinct sites,
+    not with sites times samples.
+    """
+
+    def __init__(self, transcript_ids, stride, keys, arrays):
+        self.transcript_ids = pd.Index(transcript_ids)
+        self.stride = stride
+        self.keys = keys
+        self.arrays = arrays
+
+    @classmethod
+    def from_samples(cls, site_frames, transcript_dict, gene_exon_counts):
+        """
+        Collect the distinct sites of every sample and annotate them once.
+
+        Parameters:
+        site_frames (list): DataFrames with 'transcript_id' and 'transcript_position' columns.
+        transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+        gene_exon_counts (dict): Maps each gene ID to its number of unique exons.
+
+        Returns:
+        SiteAnnotationLookup: The annotation of every distinct site.
+        """
+        site_frames = list(site_frames)
+        transcript_ids = pd.Index(sorted({str(transcript_id) for frame in site_frames
+                                          for transcript_id in pd.unique(frame['transcript_id'])}),
+                                  dtype=object)
+        max_position = max([int(frame['transcript_position'].max()) for frame in site_frames
+                            if len(frame)] or [0])
+        lookup = cls(transcript_ids, max_position + 1, np.array([], dtype=np.int64), {})
+
+        # Each site is keyed as transcript code * stride + position
+        keys = np.unique(np.concatenate([lookup._keys(frame) for frame in site_frames]
+                                        + [np.array([], dtype=np.int64)]))
+        unique_ids = pd.Series(transcript_ids.to_numpy()[keys // lookup.stride], dtype=object)
+        unique_positions = keys % lookup.stride
+        lookup.keys = keys
+        lookup.arrays = _annotate_arrays(unique_ids, unique_positions, transcript_dict,
+                                         gene_exon_counts)
+        return lookup
+
+    def _keys(self, methylated_sites):
+        """The integer key of each site, -1 for transcripts not in the lookup."""
+        codes = self.transcript_ids.get_indexer(
+            np.asarray(methylated_sites['transcript_id'], dtype=object)).astype(np.int64)
+        positions = methylated_sites['transcript_position'].to_numpy(dtype=np.int64)
+        return np.where((codes >= 0) & (positions < self.stride) & (positions >= 0),
+                        codes * self.stride + positions, -1)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def annotate(self, methylated_sites):
+        """
+        Annotate one sample's sites from the lookup table.
+
+        Parameters:
+        methylated_sites (DataFrame): Sites with 'transcript_id' and 'transcript_position'
+                                      columns, all of which are in the lookup.
+
+        Returns:
+        DataFrame: The same rows and columns as annotate_methylated_sites.
+        """
+        transcript_ids = methylated_sites['transcript_id']
+        positions = methylated_sites['transcript_position'].to_numpy()
+        keys = self._keys(methylated_sites)
+        # The lookup holds one row per distinct site, sorted by key
+        index = np.clip(np.searchsorted(self.keys, keys), 0, max(len(self.keys) - 1, 0))
+        if len(keys) and (not len(self.keys) or not np.array_equal(self.keys[index], keys)):
+            raise KeyError("Sites missing from the site annotation lookup")
+        arrays = {name: values[index] for name, values in self.arrays.items()}
+        return _annotation_frame(transcript_ids, positions, arrays)
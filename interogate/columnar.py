@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+#
+# columnar.py
+
+import numpy as np
+import pandas as pd
+from interogate.annotate import DISTANCE_COLUMNS
+from interogate.exon_index import REGION_LABELS
+
+OUTPUT_FORMATS = ['tab', 'parquet', 'both']
+REGION_CATEGORIES = REGION_LABELS
+SUMMARY_COUNT_COLUMNS = ['total_sites', 'non_last_exon_sites', 'last_exon_sites', 'utr_sites']
+
+
+def require_parquet_engine():
+    """
+    Check that pyarrow is installed, so a run fails before any work is done.
+
+    Raises:
+    ImportError: If pyarrow cannot be imported.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError("--output-format parquet needs pyarrow: pip install pyarrow")
+
+
+def typed_annotation(results_df):
+    """
+    Convert the annotated sites to typed columns for columnar output.
+
+    The text output mixes integers and strings in exon_number ('UTR') and
+    total_exons_in_gene ('Unknown'). Here those become nullable integers, and the
+    region is a categorical column.
+
+    Parameters:
+    results_df (DataFrame): Output of annotate_methylated_sites.
+
+    Returns:
+    DataFrame: transcript_id (category), position (int32), region (category of
+               REGION_CATEGORIES), exon_number, total_exons_in_transcript and
+               total_exons_in_gene (nullable Int32), is_last_exon (bool) and the
+               DISTANCE_COLUMNS (nullable Int32).
+    """
+    is_utr = (results_df['exon_number'] == 'UTR').to_numpy()
+    gene_unknown = (results_df['total_exons_in_gene'] == 'Unknown').to_numpy()
+
+    def nullable(column, missing):
+        values = results_df[column].to_numpy()
+        if values.dtype == object:
+            values = np.where(missing, 0, values)
+        values = np.nan_to_num(values.astype(np.float64)).astype(np.int32)
+        return pd.arrays.IntegerArray(values, missing.copy())
+
+    transcript_missing = results_df['total_exons_in_transcript'].isna().to_numpy()
+    return pd.DataFrame({
+        'transcript_id': pd.Categorical(results_df['transcript_id']),
+        'position': results_df['position'].to_numpy().astype(np.int32),
+        'region': pd.Categorical(results_df['region'], categories=REGION_CATEGORIES),
+        'exon_number': nullable('exon_number', is_utr),
+        'total_exons_in_transcript': nullable('total_exons_in_transcript', transcript_missing),
+        'total_exons_in_gene': nullable('total_exons_in_gene', gene_unknown),
+        'is_last_exon': results_df['is_last_exon'].to_numpy().astype(bool),
+        **{column: nullable(column, results_df[column].isna().to_numpy())
+           for column in DISTANCE_COLUMNS}
+    })
+
+
+def write_annotation_parquet(results_df, output_file, compression='zstd'):
+    """
+    Write the annotated sites as a compressed, typed Parquet file.
+
+    Parameters:
+    results_df (DataFrame): Output of annotate_methylated_sites.
+    output_file (str): Path to the Parquet file.
+    compression (str): Parquet compression codec.
+    """
+    typed_annotation(results_df).to_parquet(output_file, index=False, compression=compression)
+    print(f"Results saved to {output_file}")
+
+
+def write_summary_parquet(summary, output_file, compression='zstd'):
+    """
+    Write the per-transcript summary as a Parquet file with integer counts.
+
+    Parameters:
+    summary (DataFrame): Output of summarize_methylation_sites.
+    output_file (str): Path to the Parquet file.
+    compression (str): Parquet compression codec.
+    """
+    summary = summary.reset_index(drop=True)
+    summary = summary.astype({column: np.int64 for column in SUMMARY_COUNT_COLUMNS})
+    summary['transcript_id'] = summary['transcript_id'].astype(str)
+    summary.to_parquet(output_file, index=False, compression=compression)
+    print(f"Summary saved to {output_file}")
+
+
+class ParquetBatchWriter:
+    """
+    Append batches of annotated sites to one Parquet file, a row group per batch.
+
+    Every batch is cast to the schema of the first, so per-batch differences in
+    categories or missing values do not change the column types.
+    """
+
+    def __init__(self, output_file, compression='zstd'):
+        self.output_file = output_file
+        self.compression = compression
+        self.schema = None
+        self.writer = None
+
+    def write(self, results_df):
+        """Convert a batch with typed_annotation and append it."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        typed = typed_annotation(results_df)
+        if self.writer is None:
+            table = pa.Table.from_pandas(typed, preserve_index=False)
+            # Fixed width dictionary indices, whatever the size of the first batch
+            fields = [field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+                      if pa.types.is_dictionary(field.type) else field
+                      for field in table.schema]
+            self.schema = pa.schema(fields, metadata=table.schema.metadata)
+            table = table.cast(self.schema)
+            self.writer = pq.ParquetWriter(self.output_file, self.schema,
+                                           compression=self.compression)
+        else:
+            table = pa.Table.from_pandas(typed, schema=self.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            print(f"Results saved to {self.output_file}")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+#
+# enrichment.py
+
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# Site categories, in the order of their codes
+CATEGORIES = ['non_last_exon', 'last_exon', 'UTR']
+# The categories the permutation test compares. No transcript position lies
+# outside every exon, so UTR (not in an exon) sites have no null and are left out
+TESTED_CATEGORIES = ['non_last_exon', 'last_exon']
+TESTED_COLUMNS = ['non_last_exon_sites', 'last_exon_sites']
+NULL_MODELS = ['uniform', 'drach']
+ENRICHMENT_COLUMNS = ['category', 'observed', 'expected', 'null_sd', 'fold_enrichment', 'z_score',
+                      'p_enriched', 'p_depleted', 'p_two_sided', 'permutations', 'null_model',
+                      'sites', 'excluded_sites']
+DEFAULT_PERMUTATIONS = 1000
+# Permutations per pool task. Fixed, so the draws do not depend on the number of workers
+PERMUTATION_CHUNK = 100
+# Upper bound on the number of draws held in memory at once
+BATCH_DRAWS = 4000000
+
+
+def classify_positions(transcript_dict, rows, positions):
+    """
+    Category code of each position, as annotate_methylated_sites would place a site there.
+
+    Parameters:
+    transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+    rows (array): Row of each position's transcript in the index.
+    positions (array): Transcript positions.
+
+    Returns:
+    array: int8 index into CATEGORIES of every position.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    slots = transcript_dict.find_exon_slots_by_row(rows, positions)
+    codes = np.full(len(rows), CATEGORIES.index('UTR'), dtype=np.int8)
+    found = slots >= 0
+    is_last = transcript_dict.exon_numbers[slots[found]] == transcript_dict.last_exons[rows[found]]
+    codes[found] = np.where(is_last, CATEGORIES.index('last_exon'), CATEGORIES.index('non_last_exon'))
+    return codes
+
+
+class CandidatePositions:
+    """
+    The positions null sites are drawn from, already classified, for a set of transcripts.
+
+    Transcript i owns codes[offsets[i]:offsets[i + 1]], the category code of
+    each of its candidate positions, so a null site is one random index into
+    that slice and its category is one array lookup.
+    """
+
+    def __init__(self, rows, offsets, codes):
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.codes = np.asarray(codes, dtype=np.int8)
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    def exonic(self):
+        """The candidates without the positions outside every exon."""
+        keep = self.codes != CATEGORIES.index('UTR')
+        kept_before = np.zeros(len(keep) + 1, dtype=np.int64)
+        kept_before[1:] = np.cumsum(keep)
+        return CandidatePositions(self.rows, kept_before[self.offsets], self.codes[keep])
+
+    @classmethod
+    def uniform(cls, transcript_dict, rows, block_positions=BATCH_DRAWS):
+        """
+        Every position from 1 to the end of each transcript.
+
+        Parameters:
+        transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+        rows (array): Sorted, distinct index rows of the transcripts.
+        block_positions (int): Number of positions classified at a time.
+
+        Returns:
+        CandidatePositions: The classified positions.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = transcript_dict.transcript_lengths()[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        codes = np.empty(offsets[-1], dtype=np.int8)
+
+        # Classify a block of transcripts at a time to bound the temporary arrays
+        start = 0
+        while start < len(rows):
+            stop = max(int(np.searchsorted(offsets, offsets[start] + block_positions, side='right')) - 1,
+                       start + 1)
+            block_lengths = lengths[start:stop]
+            block_rows = np.repeat(rows[start:stop], block_lengths)
+            positions = np.arange(offsets[start], offsets[stop]) \
+                - np.repeat(offsets[start:stop], block_lengths) + 1
+            codes[offsets[start]:offsets[stop]] = classify_positions(transcript_dict, block_rows,
+                                                                     positions)
+            start = stop
+        return cls(rows, offsets, codes)
+
+    @classmethod
+    def from_sites(cls, transcript_dict, rows, tested_sites):
+        """
+        The distinct tested sites of each transcript, e.g. every DRACH site m6anet scored.
+
+        Parameters:
+        transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+        rows (array): Sorted, distinct index rows of the transcripts.
+        tested_sites (DataFrame): transcript_id and transcript_position of the candidate sites.
+
+        Returns:
+        CandidatePositions: The classified sites.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        codes, uniques = pd.factorize(tested_sites['transcript_id'])
+        site_rows = transcript_dict.rows_for(np.asarray(uniques, dtype=object))[codes]
+        positions = tested_sites['transcript_position'].to_numpy(dtype=np.int64)
+        keep = np.isin(site_rows, rows)
+        stride = int(positions.max()) + 1 if len(positions) else 1
+        keys = np.unique(site_rows[keep] * stride + positions[keep])
+        site_rows, positions = keys // stride, keys % stride
+        offsets = np.searchsorted(site_rows, np.append(rows, np.iinfo(np.int64).max))
+        offsets[-1] = len(keys)
+        return cls(rows, offsets, classify_positions(transcript_dict, site_rows, positions))
+
+
+# Candidate positions and observed sites shared with the pool workers:
+# (site starts, site sizes, candidate codes)
+NULL_MODEL = None
+
+
+def set_null_model(site_starts, site_sizes, codes):
+    """Make the null model arrays available to null_category_counts (and the pool initializer)."""
+    global NULL_MODEL
+    NULL_MODEL = (site_starts, site_sizes, codes)
+
+
+def null_category_counts(task):
+    """
+    Draw null sites for a run of permutations and count their categories.
+
+    Every observed site is redrawn uniformly from its own transcript's candidate
+    positions. Permutations are drawn in batches, all sites at once, so there is
+    no Python loop per site.
+
+    Parameters:
+    task (tuple): (number of permutations, SeedSequence of the run).
+
+    Returns:
+    array: int64 counts of shape (permutations, len(TESTED_CATEGORIES)).
+    """
+    n_permutations, seed = task
+    site_starts, site_sizes, codes = NULL_MODEL
+    rng = np.random.default_rng(seed)
+    n_categories = len(TESTED_CATEGORIES)
+    counts = np.zeros((n_permutations, n_categories), dtype=np.int64)
+    batch = max(1, BATCH_DRAWS // max(len(site_starts), 1))
+    for first in range(0, n_permutations, batch):
+        size = min(batch, n_permutations - first)
+        # In place, to keep to one temporary array of each type per batch
+        draws = rng.random((size, len(site_starts)))
+        draws *= site_sizes
+        draws = draws.astype(np.int64)
+        draws += site_starts
+        draw_codes = codes.take(draws)
+        for code in range(n_categories):
+            counts[first:first + size, code] = np.count_nonzero(draw_codes == code, axis=1)
+    return counts
+
+
+def permutation_null(candidates, site_counts, n_permutations=DEFAULT_PERMUTATIONS, threads=1, seed=0):
+    """
+    Category counts of many random placements of the sites.
+
+    Parameters:
+    candidates (CandidatePositions): Where each transcript's sites can fall, all in exons.
+    site_counts (array): Number of observed sites on each of candidates.rows.
+    n_permutations (int): Number of random placements.
+    threads (int): Number of worker processes.
+    seed (int): Seed of the random draws. The result does not depend on threads.
+
+    Returns:
+    array: int64 counts of shape (n_permutations, len(TESTED_CATEGORIES)).
+    """
+    site_index = np.repeat(np.arange(len(candidates.rows)), site_counts)
+    site_starts = candidates.offsets[site_index]
+    site_sizes = candidates.sizes[site_index].astype(np.float64)
+    chunks = [min(PERMUTATION_CHUNK, n_permutations - first)
+              for first in range(0, n_permutations, PERMUTATION_CHUNK)]
+    tasks = list(zip(chunks, np.random.SeedSequence(seed).spawn(len(chunks))))
+    if not tasks:
+        return np.zeros((0, len(TESTED_CATEGORIES)), dtype=np.int64)
+
+    set_null_model(site_starts, site_sizes, candidates.codes)
+    if threads > 1 and len(tasks) > 1:
+        # Forked workers inherit the arrays; spawned ones receive them once each
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        with multiprocessing.get_context(method).Pool(
+                processes=min(threads, len(tasks)), initializer=set_null_model,
+                initargs=(site_starts, site_sizes, candidates.codes)) as pool:
+            return np.concatenate(pool.map(null_category_counts, tasks))
+    return np.concatenate([null_category_counts(task) for task in tasks])
+
+
+def enrichment_table(observed, null_counts, null_model, sites, excluded_sites=0):
+    """
+    Compare observed category counts with their permutation null.
+
+    p-values are empirical, (1 + permutations at least as extreme) / (1 + permutations).
+
+    Parameters:
+    observed (array): Observed site count of each category.
+    null_counts (array): Output of permutation_null.
+    null_model (str): Name of the null model, for the table.
+    sites (int): Number of sites tested.
+    excluded_sites (int): Number of sites left out of the test.
+
+    Returns:
+    DataFrame: One row per category with the ENRICHMENT_COLUMNS.
+    """
+    observed = np.asarray(observed, dtype=np.int64)
+    n_permutations = len(null_counts)
+    expected = null_counts.mean(axis=0) if n_permutations else np.full(len(observed), np.nan)
+    null_sd = null_counts.std(axis=0, ddof=1) if n_permutations > 1 else np.full(len(observed), np.nan)
+    p_enriched = (1 + (null_counts >= observed).sum(axis=0)) / (1 + n_permutations)
+    p_depleted = (1 + (null_counts <= observed).sum(axis=0)) / (1 + n_permutations)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fold_enrichment = observed / expected
+        z_score = (observed - expected) / null_sd
+    return pd.DataFrame({
+        'category': TESTED_CATEGORIES,
+        'observed': observed,
+        'expected': expected,
+        'null_sd': null_sd,
+        'fold_enrichment': fold_enrichment,
+        'z_score': z_score,
+        'p_enriched': p_enriched,
+        'p_depleted': p_depleted,
+        'p_two_sided': np.minimum(1.0, 2 * np.minimum(p_enriched, p_depleted)),
+        'permutations': n_permutations,
+        'null_model': null_model,
+        'sites': sites,
+        'excluded_sites': excluded_sites
+    }, columns=ENRICHMENT_COLUMNS)
+
+
+def permutation_enrichment(per_transcript, transcript_dict, null_model='uniform', tested_sites=None,
+                           n_permutations=DEFAULT_PERMUTATIONS, threads=1, seed=0):
+    """
+    Empirical test of the enrichment of sites in last exons against the other exons.
+
+    Each transcript keeps its number of exonic sites, so the null accounts for
+    which transcripts are expressed and how much of each one's length is in its
+    last exon. The sites are redrawn at random exonic positions of their own
+    transcript ('uniform') or at random exonic sites m6anet tested on it
+    ('drach'). Sites outside every exon (UTR), on transcripts missing from the
+    index or on transcripts with no candidate positions are left out of both the
+    observed and the null counts, and reported as excluded_sites.
+
+    Parameters:
+    per_transcript (DataFrame): Output of count_sites_per_transcript or
+                                SiteCountAccumulator.per_transcript.
+    transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+    null_model (str): One of NULL_MODELS.
+    tested_sites (DataFrame): transcript_id and transcript_position of every tested
+                              site, needed by the 'drach' model.
+    n_permutations (int): Number of random placements of the sites.
+    threads (int): Number of worker processes drawing permutations.
+    seed (int): Seed of the random draws.
+
+    Returns:
+    DataFrame: The enrichment_table of the sites.
+
+    Raises:
+    ValueError: For an unknown null model, or 'drach' without tested_sites.
+    """
+    if null_model not in NULL_MODELS:
+        raise ValueError(f"null_model must be one of {NULL_MODELS}")
+    if null_model == 'drach' and tested_sites is None:
+        raise ValueError("The 'drach' null model needs the tested sites")
+
+    per_transcript = per_transcript[per_transcript['transcript_id'] != 'Overall']
+    rows = transcript_dict.rows_for(per_transcript['transcript_id'].to_numpy(dtype=object))
+    known = rows >= 0
+    order = np.argsort(rows[known], kind='stable')
+    rows = rows[known][order]
+    observed_counts = per_transcript[TESTED_COLUMNS].to_numpy(dtype=np.int64)[known][order]
+
+    if null_model == 'uniform':
+        candidates = CandidatePositions.uniform(transcript_dict, rows)
+    else:
+        candidates = CandidatePositions.from_sites(transcript_dict, rows, tested_sites)
+    candidates = candidates.exonic()
+    # Transcripts with nowhere to draw from keep none of their sites in the test
+    observed_counts[candidates.sizes == 0] = 0
+    site_counts = observed_counts.sum(axis=1)
+    sites = int(site_counts.sum())
+
+    null_counts = permutation_null(candidates, site_counts, n_permutations, threads, seed)
+    return enrichment_table(observed_counts.sum(axis=0), null_counts, null_model, sites,
+                            int(per_transcript['total_sites'].sum()) - sites)
+
+
+def write_enrichment(enrichment_df, output_file):
+    """
+    Write the enrichment table as a TSV.
+
+    Parameters:
+    enrichment_df (DataFrame): Output of permutation_enrichment.
+    output_file (str): Path to the output file.
+    """
+    enrichment_df.to_csv(output_file, index=False, sep="\t")
+    print(f"Enrichment saved to {output_file}")
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+#
+# exon_index.py
+
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+
+# Region codes of the region segments; sites outside every segment are unannotated
+REGION_LABELS = ['unannotated', 'five_prime_UTR', 'CDS', 'three_prime_UTR', 'intron_retained']
+REGION_CODES = {label: code for code, label in enumerate(REGION_LABELS)}
+
+
+class TranscriptExonIndex(Mapping):
+    """
+    Compact exon index holding the transcript-space start and end of every exon.
+
+    Exons are kept in flat NumPy arrays, grouped by transcript and sorted by their
+    start position. ``exon_offsets[i]:exon_offsets[i + 1]`` is the slice of the exon
+    arrays belonging to ``transcript_ids[i]``. Memory grows with the number of exons,
+    not the number of nucleotides.
+
+    The index can be used in place of the old nested ``transcript_dict``:
+    ``index[transcript_id]`` returns a dict of exon number to a ``range`` of
+    transcript positions, so ``position in coordinates`` still works.
+
+    Region segments (5'UTR, CDS, 3'UTR and intron-retained stretches) are kept
+    the same way, in transcript positions, with ``region_offsets`` slicing the
+    segments of each transcript.
+    """
+
+    def __init__(self, transcript_ids, exon_offsets, exon_numbers, exon_starts, exon_ends,
+                 region_offsets=None, region_starts=None, region_ends=None, region_codes=None,
+                 strands=None):
+        """
+        Parameters:
+        transcript_ids (list): Transcript IDs, one per transcript.
+        exon_offsets (array): Offsets into the exon arrays, length len(transcript_ids) + 1.
+        exon_numbers (array): Exon number (from the exon ID) of every exon.
+        exon_starts (array): First transcript position (1-based) of every exon.
+        exon_ends (array): Last transcript position (inclusive) of every exon.
+        region_offsets (array): Offsets into the region arrays, like exon_offsets.
+                                None means no transcript has region segments.
+        region_starts (array): First transcript position of every region segment.
+        region_ends (array): Last transcript position (inclusive) of every region segment.
+        region_codes (array): Index into REGION_LABELS of every region segment.
+        strands (array): Strand of every transcript: 1, -1 or 0 when unknown.
+        """
+        self.transcript_ids = list(transcript_ids)
+        self.transcript_rows = {transcript_id: row for row, transcript_id in enumerate(self.transcript_ids)}
+        self.exon_offsets = np.asarray(exon_offsets, dtype=np.int64)
+        self.exon_numbers = np.asarray(exon_numbers, dtype=np.int32)
+        self.exon_starts = np.asarray(exon_starts, dtype=np.int64)
+        self.exon_ends = np.asarray(exon_ends, dtype=np.int64)
+
+        if region_offsets is None:
+            region_offsets = np.zeros(len(self.transcript_ids) + 1, dtype=np.int64)
+            region_starts = region_ends = region_codes = np.array([], dtype=np.int64)
+        self.region_offsets = np.asarray(region_offsets, dtype=np.int64)
+        self.region_starts = np.asarray(region_starts, dtype=np.int64)
+        self.region_ends = np.asarray(region_ends, dtype=np.int64)
+        self.region_codes = np.asarray(region_codes, dtype=np.int8)
+        if strands is None:
+            strands = np.zeros(len(self.transcript_ids), dtype=np.int8)
+        self.strands = np.asarray(strands, dtype=np.int8)
+
+        # Per transcript: number of distinct exons and the highest exon number
+        self.exon_counts = np.diff(self.exon_offsets).astype(np.int32)
+        self.last_exons = np.zeros(len(self.transcript_ids), dtype=np.int32)
+        non_empty = self.exon_counts > 0
+        if non_empty.any():
+            self.last_exons[non_empty] = np.maximum.reduceat(self.exon_numbers,
+                                                             self.exon_offsets[:-1][non_empty])
+
+        # Lookup structures built on first use and kept, so repeated small
+        # batches (e.g. in the annotation server) do not rebuild them
+        self._row_index = None
+        self._exon_keys = None
+        self._region_keys = None
+        self._region_extents = None
+
+    @classmethod
+    def from_exon_intervals(cls, exon_intervals, region_intervals=None, strands=None):
+        """
+        Build the index from per-transcript exon intervals.
+
+        Parameters:
+        exon_intervals (dict): Maps each transcript ID to a dict of exon number to a
+                               (start, end) tuple of transcript positions.
+        region_intervals (dict): Maps transcript IDs to lists of non-overlapping
+                                 (start, end, region code) segments, sorted by start.
+        strands (dict): Maps transcript IDs to their strand, '+' or '-'.
+
+        Returns:
+        TranscriptExonIndex: The finished index.
+        """
+        transcript_ids = list(exon_intervals)
+        exon_total = sum(len(exons) for exons in exon_intervals.values())
+        exon_offsets = np.zeros(len(transcript_ids) + 1, dtype=np.int64)
+        exon_numbers = np.empty(exon_total, dtype=np.int32)
+        exon_starts = np.empty(exon_total, dtype=np.int64)
+        exon_ends = np.empty(exon_total, dtype=np.int64)
+
+        cursor = 0
+        for row, transcript_id in enumerate(transcript_ids):
+            # Sort by start so each transcript slice can be binary searched
+            exons = sorted(exon_intervals[transcript_id].items(), key=lambda item: item[1][0])
+            for exon_number, (start, end) in exons:
+                exon_numbers[cursor] = exon_number
+                exon_starts[cursor] = start
+                exon_ends[cursor] = end
+                cursor += 1
+            exon_offsets[row + 1] = cursor
+
+        region_intervals = region_intervals or {}
+        strands = strands or {}
+        region_offsets = np.zeros(len(transcript_ids) + 1, dtype=np.int64)
+        segments = []
+        for row, transcript_id in enumerate(transcript_ids):
+            segments.extend(region_intervals.get(transcript_id, ()))
+            region_offsets[row + 1] = len(segments)
+        segments = np.array(segments, dtype=np.int64).reshape(-1, 3)
+        strand_codes = np.array([{'+': 1, '-': -1}.get(strands.get(transcript_id), 0)
+                                 for transcript_id in transcript_ids], dtype=np.int8)
+
+        return cls(transcript_ids, exon_offsets, exon_numbers, exon_starts, exon_ends,
+                   region_offsets, segments[:, 0], segments[:, 1], segments[:, 2], strand_codes)
+
+    def exon_slice(self, transcript_id):
+        """Return the (lo, hi) slice of the exon arrays for a transcript."""
+        row = self.transcript_rows[transcript_id]
+        return int(self.exon_offsets[row]), int(self.exon_offsets[row + 1])
+
+    def exon_count(self, transcript_id):
+        """Return the number of distinct exons for a transcript."""
+        return int(self.exon_counts[self.transcript_rows[transcript_id]])
+
+    def last_exon(self, transcript_id):
+        """Return the highest exon number for a transcript."""
+        return int(self.last_exons[self.transcript_rows[transcript_id]])
+
+    def find_exon(self, transcript_id, position):
+        """
+        Binary search the exon boundaries of a transcript for a position.
+
+        Parameters:
+        transcript_id (str): The ID of the transcript to query.
+        position (int): The nucleotide position to query.
+
+        Returns:
+        tuple: The exon number that the position belongs to and the total number of
+               exons for the transcript, or (None, None) if it is in no exon.
+        """
+        row = self.transcript_rows.get(transcript_id)
+        if row is None:
+            return None, None
+        lo, hi = self.exon_offsets[row], self.exon_offsets[row + 1]
+        # Last exon starting at or before the position, then check it reaches it
+        i = lo + np.searchsorted(self.exon_starts[lo:hi], position, side='right') - 1
+        if i < lo or position > self.exon_ends[i]:
+            return None, None
+        return int(self.exon_numbers[i]), int(self.exon_counts[row])
+
+    def find_exons(self, transcript_ids, positions):
+        """
+        Vectorized exon lookup for many (transcript ID, position) pairs at once.
+
+        Each exon is given the sort key ``row * stride + start``, which is already in
+        order because exons are grouped by transcript and sorted by start, so a single
+        searchsorted over all exons searches each transcript's own boundaries.
+
+        Parameters:
+        transcript_ids (array-like): Transcript ID of each site.
+        positions (array-like): Transcript position of each site.
+
+        Returns:
+        tuple: Arrays of the exon number (0 where the site is in no exon), the total
+               number of exons in the transcript (0 for unknown transcripts) and a
+               boolean mask of the sites found in an exon.
+        """
+        return self.find_exons_by_row(self.rows_for(transcript_ids), positions)
+
+    def rows_for(self, transcript_ids):
+        """Return the row of each transcript ID in the index, -1 if it is not there."""
+        if self._row_index is None:
+            self._row_index = pd.Index(self.transcript_ids)
+        return self._row_index.get_indexer(transcript_ids)
+
+    def exon_keys(self):
+        """
+        Sorted search keys of the exons, row * stride + start, built once.
+
+        Returns:
+        tuple: The row of each exon, the stride and the keys.
+        """
+        if self._exon_keys is None:
+            exon_rows = np.repeat(np.arange(len(self.transcript_ids), dtype=np.int64), self.exon_counts)
+            stride = int(self.exon_ends.max()) + 2
+            self._exon_keys = (exon_rows, stride, exon_rows * stride + self.exon_starts)
+        return self._exon_keys
+
+    def find_exon_slots_by_row(self, rows, positions):
+        """
+        Vectorized lookup of the exon containing each site, as a slot in the exon arrays.
+
+        Parameters:
+        rows (array): Row of each site's transcript in the index, -1 if unknown.
+        positions (array-like): Transcript position of each site.
+
+        Returns:
+        array: int64 index into exon_starts/exon_ends/exon_numbers of each site's
+               exon, -1 for sites that are in no exon.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        slots = np.full(len(rows), -1, dtype=np.int64)
+        if len(self.exon_starts) == 0:
+            return slots
+
+        exon_rows, stride, exon_keys = self.exon_keys()
+        site_keys = rows * stride + np.clip(positions, 0, stride - 1)
+
+        hits = np.searchsorted(exon_keys, site_keys, side='right') - 1
+        hits = np.clip(hits, 0, None)
+        found = (rows >= 0) & (exon_rows[hits] == rows) & (self.exon_starts[hits] <= positions) \
+            & (positions <= self.exon_ends[hits])
+        slots[found] = hits[found]
+        return slots
+
+    def find_exons_by_row(self, rows, positions, slots=None):
+        """
+        Vectorized exon lookup for sites given as index rows (see rows_for).
+
+        Parameters:
+        rows (array): Row of each site's transcript in the index, -1 if unknown.
+        positions (array-like): Transcript position of each site.
+        slots (array): Output of find_exon_slots_by_row, if already computed.
+
+        Returns:
+        tuple: The same three arrays as find_exons.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if slots is None:
+            slots = self.find_exon_slots_by_row(rows, positions)
+        exon_numbers = np.zeros(len(rows), dtype=np.int32)
+        total_exons = np.zeros(len(rows), dtype=np.int32)
+
+        known = rows >= 0
+        total_exons[known] = self.exon_counts[rows[known]]
+        found = slots >= 0
+        exon_numbers[found] = self.exon_numbers[slots[found]]
+        return exon_numbers, total_exons, found
+
+    def junction_distances_by_row(self, rows, positions, slots=None):
+        """
+        Distance in transcript space from each site to the nearest exon junction
+        on either side, read 5' to 3'.
+
+        A junction sits between the last position of one exon and the first of
+        the next, so a site next to a junction is 1 nt from it. The neighbouring
+        junctions of a site are the edges of the exons before and after its own
+        exon; on the minus strand transcript positions run 3' to 5', so the two
+        sides are swapped.
+
+        Parameters:
+        rows (array): Row of each site's transcript in the index, -1 if unknown.
+        positions (array-like): Transcript position of each site.
+        slots (array): Output of find_exon_slots_by_row, if already computed.
+
+        Returns:
+        tuple: (upstream, downstream) float64 arrays of distances in nt, NaN for
+               sites in no exon or with no junction on that side.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        if slots is None:
+            slots = self.find_exon_slots_by_row(rows, positions)
+        before = np.full(len(rows), np.nan)
+        after = np.full(len(rows), np.nan)
+        found = slots >= 0
+        if not found.any():
+            return before, after
+
+        site_slots, site_rows, site_positions = slots[found], rows[found], positions[found]
+        has_before = site_slots > self.exon_offsets[site_rows]
+        has_after = site_slots < self.exon_offsets[site_rows + 1] - 1
+        before[found] = np.where(has_before,
+                                 site_positions - self.exon_ends[np.maximum(site_slots - 1, 0)], np.nan)
+        after[found] = np.where(has_after, self.exon_ends[site_slots] - site_positions + 1, np.nan)
+
+        minus = self.strands[np.clip(rows, 0, None)] == -1
+        return np.where(minus, after, before), np.where(minus, before, after)
+
+    def stop_codon_distances_by_row(self, rows, positions, found):
+        """
+        Signed distance in transcript space from each site to the stop codon.
+
+        The stop codon is taken as the 3' end of the CDS. Sites 5' of it (in the
+        CDS or 5'UTR) get negative distances, sites in the 3'UTR positive ones and
+        a site on the last nucleotide of the CDS 0.
+
+        Parameters:
+        rows (array): Row of each site's transcript in the index, -1 if unknown.
+        positions (array-like): Transcript position of each site.
+        found (array): Whether each site is in an exon of its transcript.
+
+        Returns:
+        array: float64 distance of each site, NaN for sites in no exon or on a
+               transcript without a CDS.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        distances = np.full(len(rows), np.nan)
+        if len(self.region_codes) == 0:
+            return distances
+        starts, ends = self.region_extents()
+        cds = REGION_CODES['CDS']
+        site_rows = np.clip(rows, 0, None)
+        inside = np.asarray(found, dtype=bool) & (rows >= 0) & (ends[site_rows, cds] >= 0)
+        site_rows, site_positions = site_rows[inside], positions[inside]
+        distances[inside] = np.where(self.strands[site_rows] == -1,
+                                     starts[site_rows, cds] - site_positions,
+                                     site_positions - ends[site_rows, cds])
+        return distances
+
+    def find_regions_by_row(self, rows, positions):
+        """
+        Vectorized region lookup for sites given as index rows (see rows_for).
+
+        Parameters:
+        rows (array): Row of each site's transcript in the index, -1 if unknown.
+        positions (array-like): Transcript position of each site.
+
+        Returns:
+        array: int8 index into REGION_LABELS of each site; 0 (unannotated) for
+               sites in no region segment.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        codes = np.zeros(len(rows), dtype=np.int8)
+        if len(self.region_starts) == 0:
+            return codes
+
+        if self._region_keys is None:
+            region_rows = np.repeat(np.arange(len(self.transcript_ids), dtype=np.int64),
+                                    np.diff(self.region_offsets))
+            stride = int(self.region_ends.max()) + 2
+            self._region_keys = (region_rows, stride, region_rows * stride + self.region_starts)
+        region_rows, stride, region_keys = self._region_keys
+        site_keys = rows * stride + np.clip(positions, 0, stride - 1)
+
+        hits = np.clip(np.searchsorted(region_keys, site_keys, side='right') - 1, 0, None)
+        inside = (rows >= 0) & (region_rows[hits] == rows) & (self.region_starts[hits] <= positions) \
+            & (positions <= self.region_ends[hits])
+        codes[inside] = self.region_codes[hits[inside]]
+        return codes
+
+    def region_extents(self):
+        """
+        First and last transcript position of each region of every transcript.
+
+        A region's segments are contiguous in transcript space, so its extent runs
+        from the start of its first segment to the end of its last.
+
+        Returns:
+        tuple: (starts, ends) int64 arrays of shape (transcripts, len(REGION_LABELS)),
+               -1 where the transcript has no segment of that region.
+        """
+        if self._region_extents is None:
+            shape = (len(self.transcript_ids), len(REGION_LABELS))
+            region_rows = np.repeat(np.arange(shape[0], dtype=np.int64), np.diff(self.region_offsets))
+            codes = self.region_codes.astype(np.int64)
+            starts = np.full(shape, np.iinfo(np.int64).max, dtype=np.int64)
+            ends = np.full(shape, -1, dtype=np.int64)
+            np.minimum.at(starts, (region_rows, codes), self.region_starts)
+            np.maximum.at(ends, (region_rows, codes), self.region_ends)
+            starts[ends < 0] = -1
+            self._region_extents = (starts, ends)
+        return self._region_extents
+
+    def transcript_lengths(self):
+        """
+        Last transcript position covered by an exon or region of every transcript.
+
+        Returns:
+        array: int64 length of each transcript, 0 for one with no exon or region.
+        """
+        lengths = np.zeros(len(self.transcript_ids), dtype=np.int64)
+        exon_rows = np.repeat(np.arange(len(self.transcript_ids), dtype=np.int64), self.exon_counts)
+        np.maximum.at(lengths, exon_rows, self.exon_ends)
+        if len(self.region_codes):
+            lengths = np.maximum(lengths, self.region_extents()[1].max(axis=1))
+        return lengths
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the array-backed storage."""
+        return sum(array.nbytes for array in (self.exon_offsets, self.exon_numbers,
+                                              self.exon_starts, self.exon_ends,
+                                              self.exon_counts, self.last_exons,
+                                              self.region_offsets, self.region_starts,
+                                              self.region_ends, self.region_codes, self.strands))
+
+    def __getitem__(self, transcript_id):
+        lo, hi = self.exon_slice(transcript_id)
+        return {int(self.exon_numbers[i]): range(int(self.exon_starts[i]), int(self.exon_ends[i]) + 1)
+                for i in range(lo, hi)}
+
+    def __contains__(self, transcript_id):
+        return transcript_id in self.transcript_rows
+
+    def __iter__(self):
+        return iter(self.transcript_ids)
+
+    def __len__(self):
+        return len(self.transcript_ids)
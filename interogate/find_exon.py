@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
-import os
 from collections import defaultdict
+from interogate.exon_index import TranscriptExonIndex
 
 
 def generate_transcript_coordinates(features):
@@ -11,10 +11,10 @@ def generate_transcript_coordinates(features):
     features (list): A list of tuples, each containing the fields of a feature.
 
     Returns:
-    dict: A nested dictionary mapping each transcript ID to a dictionary of exons,
-          where each exon maps to a list of nucleotide positions.
+    TranscriptExonIndex: Index mapping each transcript ID to its exons, where each
+                         exon maps to the range of its nucleotide positions.
     """
-    transcript_dict = defaultdict(lambda: defaultdict(list))
+    exon_intervals = defaultdict(dict)
     exon_nucleotide_counters = defaultdict(int)  # To count the nucleotide positions within exons
     exon_counters = defaultdict(int)  # To count the number of exons per transcript
     
@@ -36,30 +36,8 @@ def generate_transcript_coordinates(features):
                 exon_counters[transcript_id] += 1  # Increment exon counter
                 exon_number = exon_counters[transcript_id]  # Current exon number
                 
-                for pos in range(start, end + 1):
-                    transcript_dict[transcript_id][exon_number].append(exon_nucleotide_counters[transcript_id] + 1)
-                    exon_nucleotide_counters[transcript_id] += 1
+                exon_start = exon_nucleotide_counters[transcript_id] + 1
+                exon_nucleotide_counters[transcript_id] += end - start + 1
+                exon_intervals[transcript_id][exon_number] = (exon_start, exon_nucleotide_counters[transcript_id])
     
-    return transcript_dict
-
-
-def query_transcript_exon(transcript_dict, transcript_id, position):
-    """
-    Query the exon and total number of exons for a given transcript ID and coordinate.
-
-    Parameters:
-    transcript_dict (dict): A nested dictionary mapping each transcript ID to a dictionary of exons,
-                            where each exon maps to a list of nucleotide positions.
-    transcript_id (str): The ID of the transcript to query.
-    position (int): The nucleotide position to query.
-
-    Returns:
-    tuple: The exon number that the coordinate belongs to and the total number of exons for the transcript.
-    """
-    if transcript_id in transcript_dict:
-        for exon_number, coordinates in transcript_dict[transcript_id].items():
-            if position in coordinates:
-                total_exons = len(transcript_dict[transcript_id])
-                return exon_number, total_exons
-    return None, None
-
+    return TranscriptExonIndex.from_exon_intervals(exon_intervals)
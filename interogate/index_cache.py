@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+#
+# index_cache.py
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import time
+from collections import defaultdict
+import numpy as np
+from interogate.exon_index import TranscriptExonIndex
+from interogate.parse_gtf import iter_gff_gft
+from interogate.return_dict import generate_transcript_coordinates, COORDINATE_FEATURE_TYPES
+
+# Bump when the arrays written by save_index change
+INDEX_FORMAT_VERSION = 3
+INDEX_SUFFIX = ".m6aidx"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "interogate_m6anet")
+# Replaced index versions are only deleted once they are this old, so a job still
+# writing or loading one is not pulled out from under
+OLD_VERSION_SECONDS = 3600
+
+logger = logging.getLogger('interogate_m6anet')
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    """
+    Return the SHA-256 hex digest of a file, read in blocks.
+
+    Parameters:
+    file_path (str): Path to the file.
+    block_size (int): Number of bytes to read at a time.
+
+    Returns:
+    str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def index_path_for(gtf_path, cache_dir=None):
+    """
+    Return where the index for a GTF file lives.
+
+    In a shared cache directory the index name also carries a hash of the GTF's
+    absolute path, so GTFs with the same file name do not replace each other.
+
+    Parameters:
+    gtf_path (str): Path to the GTF file.
+    cache_dir (str): Directory to keep indexes in. None puts the index next to the GTF.
+
+    Returns:
+    str: Path to the index (a link to its current version directory).
+    """
+    if cache_dir is None:
+        return gtf_path + INDEX_SUFFIX
+    path_hash = hashlib.sha256(os.path.abspath(gtf_path).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{os.path.basename(gtf_path)}.{path_hash}{INDEX_SUFFIX}")
+
+
+def read_index_metadata(index_path):
+    """Return the metadata of an index, or None if it is missing or unreadable."""
+    try:
+        with open(os.path.join(index_path, "meta.json")) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def index_is_current(index_path, gtf_path):
+    """
+    Check an index against the size, mtime and SHA-256 of its GTF file.
+
+    A different size means the index is stale. When the size and mtime both match
+    the index is trusted without hashing; when only the mtime differs the GTF is
+    hashed, so a touched but unchanged file does not force a rebuild.
+
+    Parameters:
+    index_path (str): Path to the index directory.
+    gtf_path (str): Path to the GTF file.
+
+    Returns:
+    bool: True if the index can be used for the GTF.
+    """
+    meta = read_index_metadata(index_path)
+    if meta is None or meta.get("format_version") != INDEX_FORMAT_VERSION:
+        return False
+    gtf_stat = os.stat(gtf_path)
+    if meta["gtf_size"] != gtf_stat.st_size:
+        return False
+    if meta["gtf_mtime_ns"] == gtf_stat.st_mtime_ns:
+        return True
+    return meta["gtf_sha256"] == file_sha256(gtf_path)
+
+
+def save_index(index_path, gtf_path, transcript_dict, transcript_exon_counts, gene_exon_counts):
+    """
+    Write the annotation index for a GTF file as a directory of .npy arrays.
+
+    The index is written as a new version with write_versioned_arrays, so a
+    reader never sees a half written index.
+
+    Parameters:
+    index_path (str): Path to the index link.
+    gtf_path (str): Path to the GTF file the index was built from.
+    transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+    transcript_exon_counts (dict): Maps each transcript ID to its number of exon records.
+    gene_exon_counts (dict): Maps each gene ID to its number of unique exons.
+    """
+    gtf_stat = os.stat(gtf_path)
+    meta = {
+        "format_version": INDEX_FORMAT_VERSION,
+        "gtf_path": os.path.abspath(gtf_path),
+        "gtf_size": gtf_stat.st_size,
+        "gtf_mtime_ns": gtf_stat.st_mtime_ns,
+        "gtf_sha256": file_sha256(gtf_path),
+    }
+    arrays = {
+        "transcript_ids": np.array(transcript_dict.transcript_ids, dtype=str),
+        "exon_offsets": transcript_dict.exon_offsets,
+        "exon_numbers": transcript_dict.exon_numbers,
+        "exon_starts": transcript_dict.exon_starts,
+        "exon_ends": transcript_dict.exon_ends,
+        "region_offsets": transcript_dict.region_offsets,
+        "region_starts": transcript_dict.region_starts,
+        "region_ends": transcript_dict.region_ends,
+        "region_codes": transcript_dict.region_codes,
+        "strands": transcript_dict.strands,
+        "transcript_exon_counts": np.array([transcript_exon_counts[transcript_id]
+                                            for transcript_id in transcript_dict.transcript_ids],
+                                           dtype=np.int32),
+        "gene_ids": np.array(list(gene_exon_counts), dtype=str),
+        "gene_exon_counts": np.array(list(gene_exon_counts.values()), dtype=np.int32),
+    }
+    write_versioned_arrays(index_path, arrays, meta)
+
+
+def write_versioned_arrays(path, arrays, meta):
+    """
+    Write .npy arrays and a meta.json as a new version of a directory of arrays.
+
+    The version is written to a hidden directory beside path and then path, a
+    symlink, is atomically pointed at it, so a reader never sees a half written
+    or missing directory. Nothing is deleted under a reader: the version it
+    replaces is kept, and older versions only go once OLD_VERSION_SECONDS old.
+
+    Parameters:
+    path (str): Path to the link to the current version.
+    arrays (dict): Maps each array name to the array to save as <name>.npy.
+    meta (dict): Metadata to save as meta.json.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    name = os.path.basename(path)
+    os.makedirs(parent, exist_ok=True)
+    version_path = tempfile.mkdtemp(prefix=f".{name}.", dir=parent)
+    try:
+        for array_name, array in arrays.items():
+            np.save(os.path.join(version_path, array_name + ".npy"), array)
+        with open(os.path.join(version_path, "meta.json"), 'w') as handle:
+            json.dump(meta, handle, indent=2)
+        os.chmod(version_path, 0o755)
+        if os.path.isdir(path) and not os.path.islink(path):
+            # A directory from before versioning: move it aside so the link can replace it
+            os.replace(path, tempfile.mkdtemp(prefix=f".{name}.", dir=parent))
+        previous = os.path.realpath(path) if os.path.islink(path) else None
+        link_path = os.path.join(parent, f".{name}.link.{os.getpid()}")
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        os.symlink(os.path.basename(version_path), link_path)
+        os.replace(link_path, path)
+    except BaseException:
+        shutil.rmtree(version_path, ignore_errors=True)
+        raise
+    remove_old_versions(path, keep=(version_path, previous))
+
+
+def remove_old_versions(index_path, keep, max_age=OLD_VERSION_SECONDS):
+    """
+    Delete the version directories of an index that are not in keep and are old.
+
+    Parameters:
+    index_path (str): Path to the index link.
+    keep (tuple): Version directories still in use (None entries are ignored).
+    max_age (float): Seconds since a version was last modified before it is deleted.
+    """
+    parent = os.path.dirname(os.path.abspath(index_path))
+    prefix = f".{os.path.basename(index_path)}."
+    keep = {os.path.realpath(path) for path in keep if path}
+    now = time.time()
+    for entry in os.listdir(parent):
+        path = os.path.join(parent, entry)
+        try:
+            if (entry.startswith(prefix) and os.path.isdir(path) and not os.path.islink(path)
+                    and os.path.realpath(path) not in keep
+                    and now - os.stat(path).st_mtime >= max_age):
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            # Removed by another job meanwhile
+            continue
+
+
+def load_index(index_path):
+    """
+    Memory-map a saved annotation index.
+
+    The index link is resolved once, so every array comes from the same version
+    even if another job saves a new one meanwhile.
+
+    Parameters:
+    index_path (str): Path to the index.
+
+    Returns:
+    tuple: The same four values as generate_transcript_coordinates.
+    """
+    index_path = os.path.realpath(index_path)
+
+    def load(name):
+        return np.load(os.path.join(index_path, name + ".npy"), mmap_mode='r')
+
+    transcript_ids = load("transcript_ids").tolist()
+    transcript_dict = TranscriptExonIndex(transcript_ids, load("exon_offsets"),
+                                          load("exon_numbers"), load("exon_starts"),
+                                          load("exon_ends"), load("region_offsets"),
+                                          load("region_starts"), load("region_ends"),
+                                          load("region_codes"), load("strands"))
+    # A defaultdict, as generate_transcript_coordinates returns
+    transcript_exon_counts = defaultdict(int, zip(transcript_ids,
+                                                  load("transcript_exon_counts").tolist()))
+    gene_exon_counts = dict(zip(load("gene_ids").tolist(), load("gene_exon_counts").tolist()))
+    last_exon_for_transcript = dict(zip(transcript_ids, transcript_dict.last_exons.tolist()))
+    return transcript_dict, transcript_exon_counts, gene_exon_counts, last_exon_for_transcript
+
+
+def build_index(gtf_path):
+    """Parse the exon, UTR and CDS records of a GTF file and build the annotation index."""
+    features = iter_gff_gft(gtf_path, feature_types=COORDINATE_FEATURE_TYPES)
+    return generate_transcript_coordinates(features)
+
+
+def load_or_build_index(gtf_path, cache_dir=None):
+    """
+    Load the cached annotation index for a GTF file, building it if needed.
+
+    The index is kept next to the GTF by default. If that directory is not
+    writable it is kept in the user cache directory instead.
+
+    Parameters:
+    gtf_path (str): Path to the GTF file.
+    cache_dir (str): Directory to keep indexes in. None puts the index next to the GTF.
+
+    Returns:
+    tuple: The same four values as generate_transcript_coordinates.
+    """
+    candidates = [index_path_for(gtf_path, cache_dir)]
+    if cache_dir is None:
+        candidates.append(index_path_for(gtf_path, DEFAULT_CACHE_DIR))
+
+    for index_path in candidates:
+        if index_is_current(index_path, gtf_path):
+            logger.info("Loading annotation index: %s", index_path)
+            return load_index(index_path)
+
+    logger.info("Building annotation index for: %s", gtf_path)
+    result = build_index(gtf_path)
+    for index_path in candidates:
+        try:
+            save_index(index_path, gtf_path, result[0], result[1], result[2])
+            logger.info("Saved annotation index: %s", index_path)
+            break
+        except OSError as error:
+            logger.warning("Could not write annotation index %s: %s", index_path, error)
+    return result
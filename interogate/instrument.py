@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# instrument.py
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux), else the peak so far."""
+    try:
+        with open('/proc/self/statm') as handle:
+            pages = int(handle.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return max_rss_mb()
+
+
+def max_rss_mb(who=resource.RUSAGE_SELF):
+    """
+    Peak resident set size so far in MB: of this process, or with
+    resource.RUSAGE_CHILDREN of the largest of its finished child processes.
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kB elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class Stage:
+    """
+    Context manager that times one pipeline stage and samples its peak RSS.
+
+    Set ``rows_in`` and ``rows_out`` on the stage inside the ``with`` block when
+    they are only known once the work is done. When the stage ends a record is
+    appended to the report and a line is written to the logger.
+    """
+
+    def __init__(self, report, name, input_file=None, rows_in=None, interval=0.05):
+        self.report = report
+        self.name = name
+        self.input_file = input_file
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.interval = interval
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def __enter__(self):
+        self.start_rss = current_rss_mb()
+        self.peak = self.start_rss
+        self._done = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        self._done.set()
+        self._sampler.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        record = {
+            'stage': self.name,
+            'file': self.input_file,
+            'seconds': round(seconds, 4),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rows_per_second': round(rows / seconds, 1) if rows is not None and seconds > 0 else None,
+            'start_rss_mb': round(self.start_rss, 1),
+            'peak_rss_mb': round(self.peak, 1),
+            'pid': os.getpid(),
+            'failed': exc_type is not None,
+        }
+        self.report.stages.append(record)
+        self.report.log_stage(record)
+        return False
+
+
+class RunReport:
+    """
+    Collects per-stage timings, row counts and peak RSS for a pipeline run,
+    logs each stage and writes the whole run as JSON.
+
+    The run's peak_rss_mb is of the main process only. With --thread > 1 the
+    annotation runs in pool workers, so children_peak_rss_mb gives the peak of
+    the largest worker that has finished; the workers' own stage records carry
+    their pid and peak. The workers run side by side, so the run can use up to
+    about peak_rss_mb plus children_peak_rss_mb times the number of workers.
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('interogate_m6anet')
+        self.stages = []
+        self.started = time.time()
+
+    def stage(self, name, input_file=None, rows_in=None):
+        """Return a Stage context manager recording into this report."""
+        return Stage(self, name, input_file=input_file, rows_in=rows_in)
+
+    def log_stage(self, record):
+        """Write one stage record to the logger."""
+        self.logger.info("Stage %s%s: %.3f s, rows in %s, rows out %s, %s rows/s, peak RSS %.1f MB",
+                         record['stage'],
+                         f" [{record['file']}]" if record['file'] else "",
+                         record['seconds'], record['rows_in'], record['rows_out'],
+                         record['rows_per_second'], record['peak_rss_mb'])
+
+    def extend(self, records):
+        """Add stage records collected elsewhere, e.g. in a worker process."""
+        self.stages.extend(records)
+
+    def to_dict(self, **extra):
+        """The run report as a JSON-serialisable dict."""
+        finished = time.time()
+        report = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'finished': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(finished)),
+            'total_seconds': round(finished - self.started, 4),
+            'peak_rss_mb': round(max_rss_mb(), 1),
+            'children_peak_rss_mb': round(max_rss_mb(resource.RUSAGE_CHILDREN), 1),
+            'stages': self.stages,
+        }
+        report.update(extra)
+        return report
+
+    def write_json(self, output_file, **extra):
+        """
+        Write the run report to a JSON file.
+
+        Parameters:
+        output_file (str): Path to the JSON file.
+        extra: Additional top level fields, e.g. the command line.
+        """
+        with open(output_file, 'w') as handle:
+            json.dump(self.to_dict(**extra), handle, indent=2)
+        self.logger.info("Run report saved to %s", output_file)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#
+# manifest.py
+
+import os
+import glob
+import json
+import hashlib
+import logging
+from interogate.index_cache import file_sha256
+
+# Bump when the layout of the manifest changes
+MANIFEST_FORMAT_VERSION = 1
+MANIFEST_SUFFIX = "_manifest.json"
+
+logger = logging.getLogger('interogate_m6anet')
+
+
+def code_version():
+    """
+    Return a SHA-256 over the pipeline's source code.
+
+    The interogate modules and interogate_m6anet.py are hashed, so any change to
+    the code that writes the outputs marks them as out of date.
+
+    Returns:
+    str: The hex digest.
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sources = sorted(glob.glob(os.path.join(package_dir, "*.py")))
+    sources.append(os.path.join(os.path.dirname(package_dir), "interogate_m6anet.py"))
+    digest = hashlib.sha256()
+    for source in sources:
+        if os.path.exists(source):
+            digest.update(os.path.basename(source).encode())
+            with open(source, 'rb') as handle:
+                digest.update(handle.read())
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path, previous=None):
+    """
+    Return the path, size, mtime and SHA-256 of a file.
+
+    As for the annotation index, the file is only hashed when its size or mtime
+    differ from a previous fingerprint of it.
+
+    Parameters:
+    file_path (str): Path to the file.
+    previous (dict): An earlier fingerprint of the same file, or None.
+
+    Returns:
+    dict: path, size, mtime_ns and sha256.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    if previous and previous.get("path") == file_path and previous.get("size") == stat.st_size \
+            and previous.get("mtime_ns") == stat.st_mtime_ns and previous.get("sha256"):
+        sha256 = previous["sha256"]
+    else:
+        sha256 = file_sha256(file_path)
+    return {"path": file_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+
+
+def manifest_path_for(m6a_file):
+    """Return the path of the manifest of an m6anet result file's outputs."""
+    return f"{os.path.splitext(m6a_file)[0]}{MANIFEST_SUFFIX}"
+
+
+def read_manifest(manifest_path):
+    """Return a manifest, or None if it is missing or unreadable."""
+    try:
+        with open(manifest_path) as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format_version") != MANIFEST_FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def build_manifest(m6a_file, gtf_fingerprint, settings, code, outputs, previous=None):
+    """
+    Describe the inputs, settings and code an m6anet result file's outputs were made from.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    gtf_fingerprint (dict): file_fingerprint of the GTF file.
+    settings (dict): The options that change the outputs, e.g. the threshold.
+    code (str): code_version of the pipeline.
+    outputs (list): Paths of the files written for m6a_file.
+    previous (dict): The manifest of an earlier run, to avoid re-hashing m6a_file.
+
+    Returns:
+    dict: The manifest.
+    """
+    return {
+        "format_version": MANIFEST_FORMAT_VERSION,
+        "input_fingerprint": file_fingerprint(m6a_file, previous and previous.get("input_fingerprint")),
+        "gtf": gtf_fingerprint,
+        "settings": settings,
+        "code_version": code,
+        "outputs": [os.path.basename(output) for output in outputs],
+    }
+
+
+def manifest_is_current(m6a_file, gtf_fingerprint, settings, code, outputs):
+    """
+    Check whether the outputs of an m6anet result file are up to date.
+
+    They are when every output exists and the manifest records the same input
+    file hash, GTF hash, settings (threshold and output options) and code version.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    gtf_fingerprint (dict): file_fingerprint of the GTF file.
+    settings (dict): The options that change the outputs.
+    code (str): code_version of the pipeline.
+    outputs (list): Paths of the files a run would write for m6a_file.
+
+    Returns:
+    bool: True if the file does not need to be processed again.
+    """
+    manifest = read_manifest(manifest_path_for(m6a_file))
+    if manifest is None:
+        return False
+    if not all(os.path.exists(output) for output in outputs):
+        return False
+    if manifest.get("outputs") != [os.path.basename(output) for output in outputs]:
+        return False
+    if manifest.get("settings") != settings or manifest.get("code_version") != code:
+        return False
+    if (manifest.get("gtf") or {}).get("sha256") != gtf_fingerprint["sha256"]:
+        return False
+    previous = manifest.get("input_fingerprint")
+    return file_fingerprint(m6a_file, previous)["sha256"] == (previous or {}).get("sha256")
+
+
+def gtf_fingerprint_for(gtf_path, m6a_files):
+    """
+    Fingerprint the GTF file, reusing the hash in an earlier manifest when the
+    GTF's path, size and mtime are unchanged.
+
+    Parameters:
+    gtf_path (str): Path to the GTF file.
+    m6a_files (list): The m6anet result files whose manifests may hold the hash.
+
+    Returns:
+    dict: file_fingerprint of the GTF file.
+    """
+    previous = None
+    for m6a_file in m6a_files:
+        manifest = read_manifest(manifest_path_for(m6a_file))
+        if manifest and (manifest.get("gtf") or {}).get("path") == os.path.abspath(gtf_path):
+            previous = manifest["gtf"]
+            break
+    return file_fingerprint(gtf_path, previous)
+
+
+def write_manifest(m6a_file, gtf_fingerprint, settings, code, outputs):
+    """
+    Record the inputs, settings and code of a finished m6anet result file.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    gtf_fingerprint (dict): file_fingerprint of the GTF file.
+    settings (dict): The options that change the outputs.
+    code (str): code_version of the pipeline.
+    outputs (list): Paths of the files written for m6a_file.
+    """
+    manifest_path = manifest_path_for(m6a_file)
+    manifest = build_manifest(m6a_file, gtf_fingerprint, settings, code, outputs,
+                              previous=read_manifest(manifest_path))
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+    os.replace(temp_path, manifest_path)
+    logger.info("Manifest saved to %s", manifest_path)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#
+# metagene.py
+
+import numpy as np
+import pandas as pd
+from interogate.exon_index import REGION_CODES
+
+# Regions of the metagene, 5' to 3'; region i covers metagene positions [i, i + 1)
+METAGENE_REGIONS = ['five_prime_UTR', 'CDS', 'three_prime_UTR']
+METAGENE_COLUMNS = ['region', 'bin', 'metagene_start', 'metagene_end', 'sites', 'fraction']
+DEFAULT_METAGENE_BINS = 50
+
+
+def metagene_positions(results_df, transcript_dict):
+    """
+    Place every site on the metagene: 0-1 along the 5'UTR, 1-2 along the CDS and
+    2-3 along the 3'UTR of its transcript, read 5' to 3'.
+
+    The region extents come from the index's region segments and each site's
+    relative position is computed for all sites at once. Transcripts on the minus
+    strand run from high to low transcript position, so their relative positions
+    are reversed.
+
+    Parameters:
+    results_df (DataFrame): Output of annotate_methylated_sites.
+    transcript_dict (TranscriptExonIndex): The index the sites were annotated with.
+
+    Returns:
+    array: float64 metagene position of each site, NaN for sites that are not in a
+           5'UTR, CDS or 3'UTR.
+    """
+    codes, uniques = pd.factorize(results_df['transcript_id'])
+    rows = transcript_dict.rows_for(np.asarray(uniques, dtype=object))[codes]
+    region_codes = np.full(len(results_df), -1, dtype=np.int64)
+    regions = results_df['region'].to_numpy()
+    for region in METAGENE_REGIONS:
+        region_codes[regions == region] = REGION_CODES[region]
+    positions = results_df['position'].to_numpy(dtype=np.int64)
+
+    metagene = np.full(len(results_df), np.nan)
+    inside = (rows >= 0) & (region_codes >= 0)
+    if not inside.any():
+        return metagene
+    starts, ends = transcript_dict.region_extents()
+    site_rows, site_codes = rows[inside], region_codes[inside]
+    region_start, region_end = starts[site_rows, site_codes], ends[site_rows, site_codes]
+
+    # Middle of the nucleotide, so the first and last positions sit inside (0, 1)
+    relative = (positions[inside] - region_start + 0.5) / (region_end - region_start + 1)
+    relative = np.where(transcript_dict.strands[site_rows] == -1, 1 - relative, relative)
+    metagene_index = np.searchsorted([REGION_CODES[region] for region in METAGENE_REGIONS], site_codes)
+    metagene[inside] = metagene_index + relative
+    return metagene
+
+
+def metagene_bin_counts(metagene, bins_per_region=DEFAULT_METAGENE_BINS):
+    """
+    Count the sites in each metagene bin.
+
+    Parameters:
+    metagene (array): Output of metagene_positions.
+    bins_per_region (int): Number of bins across each region.
+
+    Returns:
+    array: int64 site count of each of the 3 * bins_per_region bins.
+    """
+    metagene = metagene[~np.isnan(metagene)]
+    n_bins = len(METAGENE_REGIONS) * bins_per_region
+    bins = np.clip((metagene * bins_per_region).astype(np.int64), 0, n_bins - 1)
+    return np.bincount(bins, minlength=n_bins).astype(np.int64)
+
+
+def metagene_table(bin_counts):
+    """
+    Lay out metagene bin counts as a table.
+
+    Parameters:
+    bin_counts (array): Output of metagene_bin_counts.
+
+    Returns:
+    DataFrame: One row per bin with its region, bin number within the region,
+               metagene start and end, number of sites and fraction of all sites
+               in the profile.
+    """
+    bin_counts = np.asarray(bin_counts, dtype=np.int64)
+    bins_per_region = len(bin_counts) // len(METAGENE_REGIONS)
+    edges = np.arange(len(bin_counts) + 1) / bins_per_region
+    total = bin_counts.sum()
+    return pd.DataFrame({
+        'region': np.repeat(METAGENE_REGIONS, bins_per_region),
+        'bin': np.tile(np.arange(1, bins_per_region + 1), len(METAGENE_REGIONS)),
+        'metagene_start': edges[:-1],
+        'metagene_end': edges[1:],
+        'sites': bin_counts,
+        'fraction': bin_counts / total if total else np.zeros(len(bin_counts))
+    }, columns=METAGENE_COLUMNS)
+
+
+class MetageneAccumulator:
+    """
+    Running metagene bin counts, built up one batch of annotated sites at a time.
+    """
+
+    def __init__(self, transcript_dict, bins_per_region=DEFAULT_METAGENE_BINS):
+        self.transcript_dict = transcript_dict
+        self.bins_per_region = bins_per_region
+        self.bin_counts = np.zeros(len(METAGENE_REGIONS) * bins_per_region, dtype=np.int64)
+
+    def add(self, results_df):
+        """Add the sites of a batch to the bin counts."""
+        self.bin_counts += metagene_bin_counts(metagene_positions(results_df, self.transcript_dict),
+                                               self.bins_per_region)
+
+    def table(self):
+        """The bin counts as a metagene_table."""
+        return metagene_table(self.bin_counts)
+
+
+def write_metagene(metagene_df, output_file):
+    """
+    Write the binned metagene profile as a TSV.
+
+    Parameters:
+    metagene_df (DataFrame): Output of metagene_table.
+    output_file (str): Path to the output file.
+    """
+    metagene_df.to_csv(output_file, index=False, sep="\t")
+    print(f"Metagene profile saved to {output_file}")
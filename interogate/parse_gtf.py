@@ -1,40 +1,72 @@
 #!/usr/bin/env python3
 
+import gzip
 
-def parse_gff_gft(file_path):
+
+def open_gff_gtf(file_path):
     """
-    Parse a GFF/GTF file and return a list of features.
+    Open a GFF/GTF file for reading text, decompressing it if it ends in .gz.
 
     Parameters:
-    file_path (str): Path to the GFF or GTF file.
+    file_path (str): Path to the GFF or GTF file, optionally gzip compressed.
 
     Returns:
-    list: A list of tuples, each containing the fields of a feature.
+    file: A text mode file handle.
     """
-    features = []
-    # weird error occur in the gtf file .. so this to get around it. 
-    with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+    # weird error occur in the gtf file .. so this to get around it.
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rt', encoding='utf-8', errors='ignore')
+    return open(file_path, 'r', encoding='utf-8', errors='ignore')
+
+
+def iter_gff_gft(file_path, feature_types=None):
+    """
+    Stream the features of a GFF/GTF file one at a time.
+
+    Only one line is held in memory at once, and lines whose feature type is not
+    wanted are skipped before their fields are converted.
+
+    Parameters:
+    file_path (str): Path to the GFF or GTF file, optionally gzip compressed.
+    feature_types (set): Feature types to keep, e.g. {'exon'}. None keeps all.
+
+    Yields:
+    tuple: The fields of a feature.
+    """
+    with open_gff_gtf(file_path) as file:
         for line in file:
-            # Skip comment lines
-            if line.startswith('#'):
+            # Skip comment and blank lines
+            if line.startswith('#') or not line.strip():
                 continue
-            
+
             # Split the line into fields
             fields = line.strip().split('\t')
-            
+
             # Extract necessary fields
+            feature = fields[2]
+            if feature_types is not None and feature not in feature_types:
+                continue
             seqname = fields[0]
             source = fields[1]
-            feature = fields[2]
             start = int(fields[3])
             end = int(fields[4])
             score = fields[5]
             strand = fields[6]
             frame = fields[7]
             attribute = fields[8]
-            
-            # Append feature information as a tuple to the list
-            features.append((seqname, source, feature, start, end, score, strand, frame, attribute))
-    
-    return features
 
+            yield (seqname, source, feature, start, end, score, strand, frame, attribute)
+
+
+def parse_gff_gft(file_path, feature_types=None):
+    """
+    Parse a GFF/GTF file and return a list of features.
+
+    Parameters:
+    file_path (str): Path to the GFF or GTF file, optionally gzip compressed.
+    feature_types (set): Feature types to keep, e.g. {'exon'}. None keeps all.
+
+    Returns:
+    list: A list of tuples, each containing the fields of a feature.
+    """
+    return list(iter_gff_gft(file_path, feature_types))
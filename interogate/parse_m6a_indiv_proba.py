@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# parse_m6a_indiv_proba.py
+
+import numpy as np
+import pandas as pd
+
+# data.indiv_proba.csv has one row per read per site. Only the transcript and the
+# read's probability are needed to count modified reads per transcript.
+INDIV_PROBA_COLUMNS = ['transcript_id', 'probability_modified']
+INDIV_PROBA_DTYPES = {'transcript_id': 'category',
+                      'probability_modified': np.float64}
+READ_COUNT_COLUMNS = ['transcript_id', 'Modified', 'Non-Modified']
+
+
+class ReadCountAccumulator:
+    """
+    Running per-transcript modified and non-modified read counts, built up one
+    chunk of data.indiv_proba.csv at a time.
+
+    Memory grows with the number of transcripts, not the number of reads.
+    """
+
+    def __init__(self, threshold=0.9):
+        self.threshold = threshold
+        self.counts = None
+
+    def add(self, chunk):
+        """Add the reads of a chunk with transcript_id and probability_modified columns."""
+        transcript_ids = chunk['transcript_id'].astype('category')
+        codes = transcript_ids.cat.codes.to_numpy()
+        n_transcripts = len(transcript_ids.cat.categories)
+        is_modified = chunk['probability_modified'].to_numpy() >= self.threshold
+        reads = np.bincount(codes, minlength=n_transcripts)
+        modified = np.bincount(codes, weights=is_modified, minlength=n_transcripts).astype(np.int64)
+        batch = pd.DataFrame({'Modified': modified, 'Non-Modified': reads - modified},
+                             index=pd.Index(transcript_ids.cat.categories.astype(str),
+                                            name='transcript_id'))
+        batch = batch[reads > 0]
+        if self.counts is None:
+            self.counts = batch
+        else:
+            self.counts = self.counts.add(batch, fill_value=0).astype(np.int64)
+
+    def per_transcript(self):
+        """The counts, one row per transcript sorted by transcript_id."""
+        if self.counts is None:
+            return pd.DataFrame({'transcript_id': pd.Series([], dtype=object),
+                                 'Modified': np.array([], dtype=np.int64),
+                                 'Non-Modified': np.array([], dtype=np.int64)})
+        return self.counts.sort_index().reset_index()[READ_COUNT_COLUMNS]
+
+
+def count_modified_reads(m6a_indiv_proba, threshold=0.9, chunksize=1000000):
+    """
+    Count the modified and non-modified reads of every transcript in an m6anet
+    data.indiv_proba.csv.
+
+    The file is read in chunks of only the needed columns and each chunk is
+    folded into the running counts, so peak memory depends on the chunk size and
+    the number of transcripts rather than the size of the file.
+
+    Parameters:
+    m6a_indiv_proba (str): Path to the CSV file.
+    threshold (float): Reads with probability_modified at or above this are modified.
+    chunksize (int): Number of CSV rows to read at a time.
+
+    Returns:
+    pd.DataFrame: transcript_id, Modified and Non-Modified read counts.
+    """
+    header = pd.read_csv(m6a_indiv_proba, nrows=0).columns
+    if not all(col in header for col in INDIV_PROBA_COLUMNS):
+        raise ValueError(f"The input file must contain the following columns: {INDIV_PROBA_COLUMNS}")
+
+    counts = ReadCountAccumulator(threshold)
+    reader = pd.read_csv(m6a_indiv_proba, usecols=INDIV_PROBA_COLUMNS,
+                         dtype=INDIV_PROBA_DTYPES, chunksize=chunksize)
+    for chunk in reader:
+        counts.add(chunk)
+    return counts.per_transcript()
@@ -1,57 +1,98 @@
 #!/usr/bin/env python3
 #
-# interogate_m6anet.py 
+# parse_m6a_site_proba.py
 
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 
-def identify_methylated_sites(m6a_site_proba, threshold=0.9):
+# Only these columns of data.site_proba.csv are loaded, with compact dtypes.
+# Probabilities are parsed as float64 so the threshold test is exact, and only
+# the surviving sites are downcast to float32.
+SITE_PROBA_COLUMNS = ['transcript_id', 'transcript_position', 'probability_modified']
+SITE_PROBA_DTYPES = {'transcript_id': 'category',
+                     'transcript_position': np.int32,
+                     'probability_modified': np.float64}
+
+
+def iter_methylated_sites(m6a_site_proba, threshold=0.9, chunksize=1000000,
+                          probability_dtype=np.float32):
     """
-    Identify methylated sites with probability greater than the threshold.
+    Read an m6anet site_proba CSV in chunks and yield the sites above the threshold.
 
     Parameters:
     m6a_site_proba (str): Path to the CSV file.
     threshold (float): Probability threshold to consider for methylation prediction.
+    chunksize (int): Number of CSV rows to read at a time.
+    probability_dtype (dtype): dtype the surviving probabilities are stored as.
 
-    Returns:
-    pd.DataFrame: DataFrame containing transcript ID and positions of methylated sites above the threshold.
+    Yields:
+    pd.DataFrame: transcript_id (categorical), transcript_position (int32) and
+                  probability_modified (probability_dtype) of the sites in each chunk that
+                  are above the threshold.
     """
-    # Load the CSV file into a DataFrame
-    df = pd.read_csv(m6a_site_proba)
-
     # Ensure the necessary columns exist
-    required_columns = ['transcript_id', 'transcript_position', 'probability_modified']
-    if not all(col in df.columns for col in required_columns):
-        raise ValueError(f"The input file must contain the following columns: {required_columns}")
-
-    # Filter rows where the probability is greater than the threshold
-    methylated_sites = df[df['probability_modified'] > threshold]
-
-    # Select and return the relevant columns
-    result = methylated_sites[['transcript_id', 'transcript_position']]
-    return result
+    header = pd.read_csv(m6a_site_proba, nrows=0).columns
+    if not all(col in header for col in SITE_PROBA_COLUMNS):
+        raise ValueError(f"The input file must contain the following columns: {SITE_PROBA_COLUMNS}")
 
+    reader = pd.read_csv(m6a_site_proba, usecols=SITE_PROBA_COLUMNS,
+                         dtype=SITE_PROBA_DTYPES, chunksize=chunksize)
+    for chunk in reader:
+        # Filter rows where the probability is greater than the threshold
+        chunk = chunk[chunk['probability_modified'] > threshold]
+        chunk = chunk.astype({'probability_modified': probability_dtype})
+        chunk['transcript_id'] = chunk['transcript_id'].cat.remove_unused_categories()
+        yield chunk[SITE_PROBA_COLUMNS]
 
 
-def query_transcript_exon(transcript_dict, transcript_id, position):
+def concat_site_chunks(chunks):
     """
-    Query the exon and total number of exons for a given transcript ID and coordinate.
+    Concatenate site chunks, merging their transcript ID categories.
 
     Parameters:
-    transcript_dict (dict): A nested dictionary mapping each transcript ID to a dictionary of exons,
-                            where each exon maps to a list of nucleotide positions.
-    transcript_id (str): The ID of the transcript to query.
-    position (int): The nucleotide position to query.
+    chunks (list): DataFrames from iter_methylated_sites.
 
     Returns:
-    tuple: The exon number that the coordinate belongs to and the total number of exons for the transcript.
+    pd.DataFrame: All the sites, with transcript_id kept categorical.
     """
-    if transcript_id in transcript_dict:
-        for exon_number, coordinates in transcript_dict[transcript_id].items():
-            if position in coordinates:
-                total_exons = len(transcript_dict[transcript_id])
-                return exon_number, total_exons
-    return None, None
+    if not chunks:
+        return pd.DataFrame({
+            'transcript_id': pd.Categorical([]),
+            'transcript_position': np.array([], dtype=np.int32),
+            'probability_modified': np.array([], dtype=np.float32)})
+    transcript_ids = union_categoricals([chunk['transcript_id'] for chunk in chunks],
+                                        sort_categories=True)
+    sites = pd.concat([chunk.drop(columns='transcript_id') for chunk in chunks])
+    sites.insert(0, 'transcript_id', pd.Categorical(transcript_ids))
+    return sites
+
+
+def identify_methylated_sites(m6a_site_proba, threshold=0.9, chunksize=1000000,
+                              keep_probability=False, probability_dtype=np.float32):
+    """
+    Identify methylated sites with probability greater than the threshold.
 
+    The CSV is read in chunks, loading only the columns that are needed, and the
+    threshold is applied to each chunk, so peak memory depends on the number of
+    methylated sites rather than the size of the file.
 
+    Parameters:
+    m6a_site_proba (str): Path to the CSV file.
+    threshold (float): Probability threshold to consider for methylation prediction.
+    chunksize (int): Number of CSV rows to read at a time.
+    keep_probability (bool): Also return the probability_modified column.
+    probability_dtype (dtype): dtype of the probability_modified column. Use
+                               float64 to compare against other thresholds exactly.
 
+    Returns:
+    pd.DataFrame: DataFrame containing transcript ID (categorical) and positions (int32) of methylated sites above the threshold.
+    """
+    sites = concat_site_chunks(list(iter_methylated_sites(m6a_site_proba, threshold, chunksize,
+                                                          probability_dtype)))
+    if keep_probability:
+        return sites
 
+    # Select and return the relevant columns
+    result = sites[['transcript_id', 'transcript_position']]
+    return result
@@ -1,4 +1,16 @@
-import matplotlib.pyplot as plt
+
+def load_pyplot():
+    """
+    Import matplotlib.pyplot on first use, with the non-interactive Agg backend.
+
+    matplotlib is only loaded when a plot is drawn, so runs that skip plotting
+    do not pay for the import, and plots render the same on headless nodes.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
 
 def plot_methylation_distribution(results_df, output_file):
     """
@@ -15,7 +27,20 @@ def plot_methylation_distribution(results_df, output_file):
         'UTR': len(results_df[results_df['exon_number'] == 'UTR'])
     }
 
+    plot_category_counts(category_counts, output_file)
+
+
+def plot_category_counts(category_counts, output_file):
+    """
+    Plot the frequency distribution from precomputed category counts.
+
+    Parameters:
+    category_counts (dict): Sites per category: non_last_exon, last_exon and UTR,
+                            e.g. from SiteCountAccumulator.category_counts.
+    output_file (str): Path to the output PDF file for the plot.
+    """
     # Create a bar plot
+    plt = load_pyplot()
     categories = list(category_counts.keys())
     counts = list(category_counts.values())
 
@@ -30,6 +55,57 @@ def plot_methylation_distribution(results_df, output_file):
     plt.savefig(output_file)
     plt.close()
 
+
+def plot_threshold_sweep(sweep_df, output_file):
+    """
+    Plot the number of methylation sites in non-last exons, last exons, and UTRs
+    against the probability threshold.
+
+    Parameters:
+    sweep_df (DataFrame): Output of sweep_thresholds, one row per threshold.
+    output_file (str): Path to the output PDF file for the plot.
+    """
+    plt = load_pyplot()
+    plt.figure(figsize=(8, 6))
+    for column, label, color in [('non_last_exon_sites', 'non_last_exon', 'blue'),
+                                 ('last_exon_sites', 'last_exon', 'green'),
+                                 ('utr_sites', 'UTR', 'red')]:
+        plt.plot(sweep_df['threshold'], sweep_df[column], marker='o', color=color, label=label)
+    plt.xlabel('Probability threshold')
+    plt.ylabel('Frequency')
+    plt.title('Methylation Sites per Category by Threshold')
+    plt.legend()
+    plt.tight_layout()
+
+    # Save the plot to a PDF file
+    plt.savefig(output_file)
+    plt.close()
+
+def plot_metagene(metagene_df, output_file):
+    """
+    Plot the metagene profile: the fraction of sites along the 5'UTR, CDS and 3'UTR.
+
+    Parameters:
+    metagene_df (DataFrame): Output of metagene_table, one row per bin.
+    output_file (str): Path to the output PDF file for the plot.
+    """
+    plt = load_pyplot()
+    plt.figure(figsize=(8, 6))
+    midpoints = (metagene_df['metagene_start'] + metagene_df['metagene_end']) / 2
+    plt.plot(midpoints, metagene_df['fraction'], color='blue')
+    for boundary in (1, 2):
+        plt.axvline(boundary, color='grey', linestyle='--')
+    plt.xticks([0.5, 1.5, 2.5], ["5'UTR", 'CDS', "3'UTR"])
+    plt.xlim(0, 3)
+    plt.xlabel('Metagene position')
+    plt.ylabel('Fraction of sites')
+    plt.title('Metagene Profile of Methylation Sites')
+    plt.tight_layout()
+
+    # Save the plot to a PDF file
+    plt.savefig(output_file)
+    plt.close()
+
 # Example usage
 # results_df = pd.DataFrame(results)  # Assuming 'results' is the list of result dictionaries
 # output_file = 'methylation_distribution.pdf'
@@ -1,7 +1,122 @@
 #!/usr/bin/env python3
-import os
 from collections import defaultdict
 import re
+from bisect import bisect_right
+from interogate.exon_index import TranscriptExonIndex, REGION_CODES
+
+# GFF3 and GTF names of the features that become region segments
+REGION_FEATURE_TYPES = {
+    'five_prime_UTR': REGION_CODES['five_prime_UTR'],
+    'five_prime_utr': REGION_CODES['five_prime_UTR'],
+    '5UTR': REGION_CODES['five_prime_UTR'],
+    'CDS': REGION_CODES['CDS'],
+    'three_prime_UTR': REGION_CODES['three_prime_UTR'],
+    'three_prime_utr': REGION_CODES['three_prime_UTR'],
+    '3UTR': REGION_CODES['three_prime_UTR'],
+}
+# Feature types generate_transcript_coordinates uses, for iter_gff_gft(feature_types=...)
+COORDINATE_FEATURE_TYPES = {'exon'} | set(REGION_FEATURE_TYPES)
+
+
+def _merge_intervals(intervals):
+    """Merge closed (start, end) intervals into sorted, non-overlapping ones."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def _subtract_intervals(intervals, cuts):
+    """Remove the merged closed intervals cuts from each closed interval."""
+    pieces = []
+    for start, end in intervals:
+        for cut_start, cut_end in cuts:
+            if cut_end < start or cut_start > end:
+                continue
+            if cut_start > start:
+                pieces.append((start, cut_start - 1))
+            start = cut_end + 1
+            if start > end:
+                break
+        if start <= end:
+            pieces.append((start, end))
+    return pieces
+
+
+def _intersect_intervals(intervals, others):
+    """Intersect closed intervals with merged, sorted closed intervals."""
+    pieces = []
+    for start, end in intervals:
+        for other_start, other_end in others:
+            if other_start > end:
+                break
+            low, high = max(start, other_start), min(end, other_end)
+            if low <= high:
+                pieces.append((low, high))
+    return pieces
+
+
+def _introns(genomic_exons):
+    """The genomic gaps between the exons of a transcript."""
+    exons = sorted(genomic_exons)
+    return [(end + 1, next_start - 1) for (_, end), (next_start, _) in zip(exons, exons[1:])
+            if next_start - 1 >= end + 1]
+
+
+def transcript_regions(exons, features, sibling_introns):
+    """
+    Map a transcript's UTR and CDS features, and its retained introns, to transcript positions.
+
+    Within an exon, transcript positions run with the genomic coordinate from the
+    exon's first transcript position, as the exon intervals are built.
+
+    Parameters:
+    exons (list): (genomic start, genomic end, first transcript position) of each exon.
+    features (list): (genomic start, genomic end, region code) of each UTR and CDS feature.
+    sibling_introns (list): Merged genomic introns of the gene's other transcripts.
+
+    Returns:
+    list: Sorted, non-overlapping (start, end, region code) segments in transcript
+          positions. Exonic stretches with no UTR or CDS feature that fall in an
+          intron of another transcript of the gene are intron_retained; the
+          transcript's own features take precedence.
+    """
+    exons = sorted(exons)
+    exon_starts = [exon[0] for exon in exons]
+
+    def to_transcript(start, end, code):
+        # Clip a genomic interval to each exon it overlaps
+        i = bisect_right(exon_starts, end) - 1
+        while i >= 0 and exons[i][1] >= start:
+            exon_start, exon_end, transcript_start = exons[i]
+            low, high = max(start, exon_start), min(end, exon_end)
+            if low <= high:
+                segments.append((transcript_start + low - exon_start,
+                                 transcript_start + high - exon_start, code))
+                covered.append((low, high))
+            i -= 1
+
+    segments = []
+    covered = []
+    for start, end, code in features:
+        to_transcript(start, end, code)
+    if sibling_introns:
+        uncovered = _subtract_intervals([exon[:2] for exon in exons],
+                                        _merge_intervals(covered))
+        for start, end in _intersect_intervals(uncovered, sibling_introns):
+            to_transcript(start, end, REGION_CODES['intron_retained'])
+
+    # Features should not overlap; if they do the earlier segment keeps the overlap
+    regions = []
+    for start, end, code in sorted(segments):
+        if regions and start <= regions[-1][1]:
+            start = regions[-1][1] + 1
+        if start <= end:
+            regions.append((start, end, code))
+    return regions
 
 
 
@@ -10,24 +125,48 @@ def generate_transcript_coordinates(features):
     Generate transcript coordinates with continuous nucleotide positions for exons.
     Also, mark the last exon for each transcript.
 
+    Only the start and end of each exon in transcript space are stored, so memory
+    grows with the number of exons rather than the number of nucleotides.
+
+    Transcript positions run with the genomic coordinate on both strands (so 3' to 5'
+    on the minus strand, which the strand aware lookups allow for). Each transcript's
+    exons are sorted by genomic start first, so files that list minus strand exons
+    5' to 3' (descending, as Ensembl and GENCODE do) give the same index as files
+    that list them in ascending order.
+
+    The five_prime_UTR, CDS and three_prime_UTR records read in the same pass are
+    mapped onto the exons as region segments of the index (see transcript_regions).
+
     Parameters:
     features (list): A list of tuples, each containing the fields of a feature.
 
     Returns:
-    tuple: A nested dictionary mapping each transcript ID to a dictionary of exons,
-           where each exon maps to a list of nucleotide positions,
+    tuple: A TranscriptExonIndex mapping each transcript ID to its exons, where each
+           exon maps to the range of its nucleotide positions,
            a dictionary mapping each transcript ID to the number of exons in the transcript,
            and a dictionary mapping each gene ID to the total number of unique exons,
            and a dictionary marking the last exon for each transcript.
     """
-    transcript_dict = defaultdict(lambda: defaultdict(list))
+    exon_intervals = defaultdict(dict)
     transcript_exon_counts = defaultdict(int)
     gene_exon_sets = defaultdict(set)  # Using a set to count unique exons per gene
     nucleotide_counter = defaultdict(int)  # To count the nucleotide positions within exons per transcript
     last_exon_for_transcript = {}
+    exon_records = defaultdict(list)  # (genomic start, end, exon number) in file order
+    exon_genomic = defaultdict(dict)  # exon number -> (genomic start, end, first transcript position)
+    region_features = defaultdict(list)  # genomic (start, end, region code) of UTR and CDS records
+    strands = {}
 
     for feature in features:
         seqname, source, feature_type, start, end, score, strand, frame, attribute = feature
+
+        if feature_type in REGION_FEATURE_TYPES:
+            for attr in attribute.split(';'):
+                if 'Parent' in attr:
+                    parents = attr.split('=')[1] if '=' in attr else attr.split()[1].strip('"')
+                    for parent in parents.strip().split(','):
+                        region_features[parent].append((start, end, REGION_FEATURE_TYPES[feature_type]))
+            continue
         
         # Process only exon features
         if feature_type == 'exon':
@@ -46,26 +185,43 @@ def generate_transcript_coordinates(features):
             # If both transcript ID and exon number are found, add the coordinates to the dictionary
             if transcript_id and exon_number:
                 gene_id = transcript_id.split('.')[0]  # Extract gene ID from transcript ID
-                exon_positions = []
-                if strand == '+':
-                    for pos in range(start, end + 1):
-                        nucleotide_counter[transcript_id] += 1
-                        exon_positions.append(nucleotide_counter[transcript_id])
-                else:  # For negative strand
-                    for pos in range(end, start - 1, -1):
-                        nucleotide_counter[transcript_id] += 1
-                        exon_positions.append(nucleotide_counter[transcript_id])
-                
-                transcript_dict[transcript_id][exon_number] = exon_positions
+                exon_records[transcript_id].append((start, end, exon_number))
+                strands[transcript_id] = strand
                 transcript_exon_counts[transcript_id] += 1
                 gene_exon_sets[gene_id].add(exon_number)
                 
                 # Update last exon for this transcript
                 if transcript_id not in last_exon_for_transcript or exon_number > last_exon_for_transcript[transcript_id]:
                     last_exon_for_transcript[transcript_id] = exon_number
+
+    for transcript_id, records in exon_records.items():
+        # Exon positions run on from the previous exon in genomic order on either
+        # strand, so only the first and last position need to be kept
+        for start, end, exon_number in sorted(records, key=lambda record: record[0]):
+            exon_start = nucleotide_counter[transcript_id] + 1
+            nucleotide_counter[transcript_id] += end - start + 1
+            exon_intervals[transcript_id][exon_number] = (exon_start, nucleotide_counter[transcript_id])
+            exon_genomic[transcript_id][exon_number] = (start, end, exon_start)
     
     # Convert the set of exons per gene to counts
     gene_exon_counts = {gene: len(exons) for gene, exons in gene_exon_sets.items()}
+
+    # Introns of each transcript, to find the exonic stretches of its siblings
+    # that are retained introns
+    gene_transcripts = defaultdict(list)
+    for transcript_id in exon_genomic:
+        gene_transcripts[transcript_id.split('.')[0]].append(transcript_id)
+    introns = {transcript_id: _introns([exon[:2] for exon in exons.values()])
+               for transcript_id, exons in exon_genomic.items()}
+    region_intervals = {}
+    for transcript_id, exons in exon_genomic.items():
+        siblings = gene_transcripts[transcript_id.split('.')[0]]
+        sibling_introns = _merge_intervals([intron for sibling in siblings if sibling != transcript_id
+                                            for intron in introns[sibling]])
+        region_intervals[transcript_id] = transcript_regions(
+            list(exons.values()), region_features.get(transcript_id, []), sibling_introns)
+
+    transcript_dict = TranscriptExonIndex.from_exon_intervals(exon_intervals, region_intervals, strands)
     
     return transcript_dict, transcript_exon_counts, gene_exon_counts, last_exon_for_transcript
 
@@ -74,19 +230,17 @@ def query_transcript_exon(transcript_dict, transcript_id, position):
     """
     Query the exon and total number of exons for a given transcript ID and coordinate.
 
+    The exon is found by binary search over the sorted exon boundaries of the
+    transcript, so the cost is O(log n) in the number of exons.
+
     Parameters:
-    transcript_dict (dict): A nested dictionary mapping each transcript ID to a dictionary of exons,
-                            where each exon maps to a list of nucleotide positions.
+    transcript_dict (TranscriptExonIndex): Index of the exons of each transcript in
+                                           transcript coordinates.
     transcript_id (str): The ID of the transcript to query.
     position (int): The nucleotide position to query.
 
     Returns:
     tuple: The exon number that the coordinate belongs to and the total number of exons for the transcript.
     """
-    if transcript_id in transcript_dict:
-        for exon_number, coordinates in transcript_dict[transcript_id].items():
-            if position in coordinates:
-                total_exons = len(transcript_dict[transcript_id])
-                return exon_number, total_exons
-    return None, None
+    return transcript_dict.find_exon(transcript_id, position)
 
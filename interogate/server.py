@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+#
+# server.py
+#
+# Keep the exon index loaded and annotate batches of sites on request.
+#
+# python -m interogate.server --gtf data/test.gtf --port 8765
+# python -m interogate.server --gtf data/test.gtf --socket /tmp/m6a_annotate.sock
+
+import os
+import sys
+import json
+import stat
+import socket
+import logging
+import argparse
+import http.client
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from interogate.annotate import annotate_methylated_sites
+from interogate.index_cache import load_or_build_index
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+logger = logging.getLogger('interogate_m6anet')
+
+
+def annotate_payload(payload, transcript_dict, gene_exon_counts):
+    """
+    Annotate the sites of one request with annotate_methylated_sites.
+
+    Parameters:
+    payload (dict): {"transcript_id": [...], "transcript_position": [...]}.
+    transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+    gene_exon_counts (dict): Maps each gene ID to its number of unique exons.
+
+    Returns:
+    str: The annotated sites as JSON in pandas' "split" layout (columns and rows),
+         with missing values as null.
+
+    Raises:
+    ValueError: If the payload does not hold two lists of the same length.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("The request must be a JSON object")
+    transcript_ids = payload.get("transcript_id")
+    positions = payload.get("transcript_position")
+    if not isinstance(transcript_ids, list) or not isinstance(positions, list) \
+            or len(transcript_ids) != len(positions):
+        raise ValueError("transcript_id and transcript_position must be lists of the same length")
+    try:
+        sites = pd.DataFrame({
+            'transcript_id': pd.Categorical([str(transcript_id) for transcript_id in transcript_ids]),
+            'transcript_position': np.asarray(positions, dtype=np.int64)
+        })
+    except (TypeError, ValueError):
+        raise ValueError("transcript_position must be a list of integers")
+    results_df = annotate_methylated_sites(sites, transcript_dict, gene_exon_counts)
+    return results_df.to_json(orient='split', index=False)
+
+
+class AnnotationRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /health reports the loaded index; POST /annotate annotates a JSON batch.
+    """
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def send_json(self, status, body):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        transcript_dict, gene_exon_counts = self.server.annotation
+        self.send_json(200, {"status": "ok", "transcripts": len(transcript_dict),
+                             "exons": len(transcript_dict.exon_starts),
+                             "genes": len(gene_exon_counts)})
+
+    def do_POST(self):
+        if self.path != "/annotate":
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"null")
+            body = annotate_payload(payload, *self.server.annotation)
+        except ValueError as error:
+            self.send_json(400, {"error": str(error)})
+            return
+        except Exception as error:
+            # Keep serving, and tell the client why rather than dropping the connection
+            logger.exception("Could not annotate a request")
+            self.send_json(500, {"error": f"Internal server error: {type(error).__name__}: {error}"})
+            return
+        self.send_json(200, body)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP over a Unix domain socket, one thread per request."""
+    daemon_threads = True
+
+
+def socket_in_use(socket_path):
+    """
+    Whether a server is listening on a Unix socket.
+
+    Parameters:
+    socket_path (str): Path of the socket.
+
+    Returns:
+    bool: True if a connection is accepted, False if it is refused (a stale socket).
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def make_server(transcript_dict, gene_exon_counts, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                socket_path=None):
+    """
+    Create an annotation server holding the index in memory.
+
+    Parameters:
+    transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+    gene_exon_counts (dict): Maps each gene ID to its number of unique exons.
+    host (str): Address to listen on. Only localhost is recommended.
+    port (int): TCP port; 0 picks a free port.
+    socket_path (str): Listen on this Unix socket instead of TCP. A stale socket
+                       left at this path by a server that has stopped is replaced.
+
+    Returns:
+    socketserver.BaseServer: The server; call serve_forever() to start it.
+
+    Raises:
+    FileExistsError: If socket_path exists and is not a socket, or a running
+                     server is listening on it.
+    """
+    if socket_path:
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise FileExistsError(f"{socket_path} exists and is not a socket")
+            if socket_in_use(socket_path):
+                raise FileExistsError(f"A server is already listening on {socket_path}")
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, AnnotationRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), AnnotationRequestHandler)
+    # Build the lookup structures now, so the first request is as fast as the rest
+    transcript_dict.rows_for([])
+    if len(transcript_dict.exon_starts):
+        transcript_dict.exon_keys()
+    server.annotation = (transcript_dict, gene_exon_counts)
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection to a server listening on a Unix socket."""
+
+    def __init__(self, socket_path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class AnnotationClient:
+    """
+    Client for the annotation server.
+
+    Parameters:
+    host (str): Server address, for a TCP server.
+    port (int): Server port, for a TCP server.
+    socket_path (str): Path of the server's Unix socket, instead of host and port.
+    timeout (float): Seconds to wait for a reply.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, timeout=60):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        if self.socket_path:
+            connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            reply = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise ValueError(reply.get("error", f"Server replied {response.status}"))
+        return reply
+
+    def health(self):
+        """Return the server status and the size of its index."""
+        return self._request("GET", "/health")
+
+    def annotate(self, transcript_ids, positions):
+        """
+        Annotate a batch of sites.
+
+        Parameters:
+        transcript_ids (list): Transcript ID of each site.
+        positions (list): Transcript position of each site.
+
+        Returns:
+        DataFrame: The same table annotate_methylated_sites gives for the sites.
+        """
+        body = json.dumps({"transcript_id": [str(transcript_id) for transcript_id in transcript_ids],
+                           "transcript_position": [int(position) for position in positions]})
+        reply = self._request("POST", "/annotate", body)
+        # Rows are rebuilt the way pandas built the table from per-site records,
+        # so the column types match the CLI output
+        return pd.DataFrame(reply["data"], columns=reply["columns"])
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="m6anet annotation server: keep the exon " +
+                                     "index loaded and annotate batches of sites")
+    parser.add_argument("--gtf", required=True,
+                        help="gtf file to build or load the annotation index for")
+    parser.add_argument("--index-cache", dest='index_cache', default=None,
+                        help="directory to keep the binary annotation index in. " +
+                        "Default is next to the gtf file")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help="address to listen on. Default is localhost only")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="TCP port to listen on")
+    parser.add_argument("--socket", dest='socket_path', default=None,
+                        help="listen on this Unix socket instead of TCP")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    transcript_dict, transcript_exon_counts, gene_exon_counts, \
+        last_exon_for_transcript = load_or_build_index(args.gtf, args.index_cache)
+    server = make_server(transcript_dict, gene_exon_counts, args.host, args.port, args.socket_path)
+    where = args.socket_path or "http://%s:%d" % server.server_address[:2]
+    logger.info("Serving annotation of %d transcripts on %s", len(transcript_dict), where)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket_path and os.path.exists(args.socket_path):
+            os.remove(args.socket_path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+#
+# site_matrix.py
+#
+# Merge the data.site_proba.csv files of many samples into one site x sample matrix.
+#
+# python -m interogate.site_matrix --m6a rep1/data.site_proba.csv rep2/data.site_proba.csv -o sites.m6amat
+# python -m interogate.site_matrix --samples samples.tsv -o sites.m6amat
+
+import os
+import sys
+import json
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from interogate.index_cache import write_versioned_arrays
+
+# Bump when the arrays written by SiteMatrix.save change
+SITE_MATRIX_FORMAT_VERSION = 1
+SITE_MATRIX_SUFFIX = ".m6amat"
+SITE_MATRIX_COLUMNS = ['transcript_id', 'transcript_position', 'n_reads', 'probability_modified',
+                       'mod_ratio']
+SITE_MATRIX_DTYPES = {'transcript_id': 'category',
+                      'transcript_position': np.int64,
+                      'n_reads': np.int32,
+                      'probability_modified': np.float64,
+                      'mod_ratio': np.float32}
+# The per-entry value arrays, one value per site of each sample
+VALUE_ARRAYS = ['probability_modified', 'n_reads', 'mod_ratio']
+# Sites are keyed as transcript code << POSITION_BITS | position while merging;
+# positions are stored as int32
+POSITION_BITS = 31
+
+logger = logging.getLogger('interogate_m6anet')
+
+
+def merge_sorted_keys(keys, new_keys):
+    """
+    Union of two sorted arrays of distinct keys.
+
+    A stable sort of two sorted runs is a linear merge, so adding a chunk does
+    not re-sort every site seen so far.
+    """
+    merged = np.concatenate((keys, new_keys))
+    merged.sort(kind='stable')
+    if len(merged) < 2:
+        return merged
+    return merged[np.concatenate(([True], merged[1:] != merged[:-1]))]
+
+
+class SiteMatrix:
+    """
+    The sites of many m6anet samples as one sparse site x sample matrix.
+
+    Every distinct (transcript_id, transcript_position) site is a row, held as
+    an integer transcript code and position sorted by both. Each sample is a
+    column stored sparsely, as in a CSC matrix: sample_offsets slices the entry
+    arrays, entry_sites gives each entry's site row and the value arrays its
+    probability_modified, n_reads and mod_ratio. A sample's entries are kept in
+    the order of its CSV file, so its sites can be handed back exactly as they
+    were read.
+    """
+
+    def __init__(self, transcript_ids, site_transcripts, site_positions, sample_offsets,
+                 entry_sites, probability_modified, n_reads, mod_ratio, samples):
+        """
+        Parameters:
+        transcript_ids (list): Sorted distinct transcript IDs; site_transcripts index into it.
+        site_transcripts (array): Transcript code of every site.
+        site_positions (array): Transcript position of every site.
+        sample_offsets (array): Entries of sample i are entries sample_offsets[i]:sample_offsets[i + 1].
+        entry_sites (array): Site row of every entry.
+        probability_modified (array): probability_modified of every entry.
+        n_reads (array): n_reads of every entry.
+        mod_ratio (array): mod_ratio of every entry.
+        samples (list): One dict per sample with its name, source file and the
+                        source's size and mtime_ns, and optionally condition and replicate.
+        """
+        self.transcript_ids = list(transcript_ids)
+        self.site_transcripts = np.asarray(site_transcripts, dtype=np.int32)
+        self.site_positions = np.asarray(site_positions, dtype=np.int32)
+        self.sample_offsets = np.asarray(sample_offsets, dtype=np.int64)
+        self.entry_sites = np.asarray(entry_sites, dtype=np.int64)
+        self.probability_modified = np.asarray(probability_modified, dtype=np.float64)
+        self.n_reads = np.asarray(n_reads, dtype=np.int32)
+        self.mod_ratio = np.asarray(mod_ratio, dtype=np.float32)
+        self.samples = list(samples)
+
+    @classmethod
+    def from_site_files(cls, site_files, names=None, conditions=None, replicates=None,
+                        chunksize=1000000):
+        """
+        Read and merge the data.site_proba.csv files of several samples.
+
+        Each CSV is read in chunks. Only each chunk's transcript categories are
+        turned into strings; its rows become integer site keys that are merged
+        into the sorted distinct sites as they are read.
+
+        Parameters:
+        site_files (list): Paths to the data.site_proba.csv files.
+        names (list): Sample names. Default is the file paths.
+        conditions (list): Condition of each sample, or None.
+        replicates (list): Replicate number of each sample, or None.
+        chunksize (int): Number of CSV rows to read at a time.
+
+        Returns:
+        SiteMatrix: The merged sites.
+        """
+        names = list(names) if names is not None else list(site_files)
+        # Transcript codes in order of first appearance, and the sorted distinct
+        # site keys (code << POSITION_BITS | position) seen so far
+        transcript_codes = {}
+        site_keys = np.array([], dtype=np.int64)
+        entry_keys = []
+        values = {name: [] for name in VALUE_ARRAYS}
+        sample_offsets = np.zeros(len(site_files) + 1, dtype=np.int64)
+        samples = []
+        for index, site_file in enumerate(site_files):
+            header = pd.read_csv(site_file, nrows=0).columns
+            if not all(col in header for col in SITE_MATRIX_COLUMNS):
+                raise ValueError(f"The input file must contain the following columns: {SITE_MATRIX_COLUMNS}")
+            for chunk in pd.read_csv(site_file, usecols=SITE_MATRIX_COLUMNS,
+                                     dtype=SITE_MATRIX_DTYPES, chunksize=chunksize):
+                # Map the chunk's categories, not its rows, onto the transcript codes
+                categories = chunk['transcript_id'].cat.categories.astype(str)
+                chunk_codes = categories.map(transcript_codes)
+                new_ids = categories[chunk_codes.isna()]
+                transcript_codes.update(zip(new_ids, range(len(transcript_codes),
+                                                           len(transcript_codes) + len(new_ids))))
+                chunk_codes = categories.map(transcript_codes).to_numpy(dtype=np.int64)
+                positions = chunk['transcript_position'].to_numpy(dtype=np.int64)
+                if len(positions) and (positions.min() < 0 or positions.max() >> POSITION_BITS):
+                    raise ValueError(f"{site_file} has transcript positions outside 0 to "
+                                     f"{(1 << POSITION_BITS) - 1}")
+                keys = (chunk_codes[chunk['transcript_id'].cat.codes.to_numpy()] << POSITION_BITS) \
+                    | positions
+                # Keep the chunk's sorted distinct keys and where each row is in them
+                chunk_keys, inverse = np.unique(keys, return_inverse=True)
+                site_keys = merge_sorted_keys(site_keys, chunk_keys)
+                entry_keys.append((chunk_keys, inverse))
+                for name in VALUE_ARRAYS:
+                    values[name].append(chunk[name].to_numpy(dtype=SITE_MATRIX_DTYPES[name]))
+                sample_offsets[index + 1] += len(keys)
+            sample_offsets[index + 1] += sample_offsets[index]
+            stat = os.stat(site_file)
+            sample = {"name": str(names[index]), "source": os.path.abspath(site_file),
+                      "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            if conditions is not None:
+                sample["condition"] = str(conditions[index])
+            if replicates is not None:
+                sample["replicate"] = int(replicates[index])
+            samples.append(sample)
+            logger.info("Read %d sites of %s", sample_offsets[index + 1] - sample_offsets[index],
+                        site_file)
+
+        # Look up each chunk's keys and drop them as it goes
+        entry_keys.reverse()
+        entry_sites = np.empty(sample_offsets[-1], dtype=np.int64)
+        cursor = 0
+        while entry_keys:
+            chunk_keys, inverse = entry_keys.pop()
+            entry_sites[cursor:cursor + len(inverse)] = np.searchsorted(site_keys, chunk_keys)[inverse]
+            cursor += len(inverse)
+        # Renumber the transcripts in sorted order, and the sites to match
+        transcript_ids = np.array(list(transcript_codes), dtype=object)
+        order = np.argsort(transcript_ids, kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        site_transcripts = rank[site_keys >> POSITION_BITS]
+        site_positions = site_keys & ((1 << POSITION_BITS) - 1)
+        site_order = np.lexsort((site_positions, site_transcripts))
+        site_rows = np.empty(len(site_order), dtype=np.int64)
+        site_rows[site_order] = np.arange(len(site_order))
+        values = {name: np.concatenate(arrays + [np.array([], dtype=SITE_MATRIX_DTYPES[name])])
+                  for name, arrays in values.items()}
+        return cls(transcript_ids[order].tolist(), site_transcripts[site_order],
+                   site_positions[site_order], sample_offsets, site_rows[entry_sites],
+                   values['probability_modified'], values['n_reads'], values['mod_ratio'], samples)
+
+    @classmethod
+    def concatenate(cls, matrices):
+        """
+        Merge the samples of several matrices, e.g. each built from one sample in
+        its own worker process, into one matrix.
+
+        Parameters:
+        matrices (list): SiteMatrix objects; their samples are kept in this order.
+
+        Returns:
+        SiteMatrix: The merged sites.
+        """
+        transcript_ids = np.array(sorted({transcript_id for matrix in matrices
+                                          for transcript_id in matrix.transcript_ids}), dtype=object)
+        # Each matrix's sites as keys on the merged transcript codes, which keep
+        # the (transcript, position) order
+        matrix_keys = [(np.searchsorted(transcript_ids, np.asarray(matrix.transcript_ids, dtype=object))
+                        .astype(np.int64)[matrix.site_transcripts] << POSITION_BITS)
+                       | matrix.site_positions.astype(np.int64) for matrix in matrices]
+        site_keys = np.unique(np.concatenate(matrix_keys + [np.array([], dtype=np.int64)]))
+        entry_sites = [np.searchsorted(site_keys, keys)[matrix.entry_sites]
+                       for matrix, keys in zip(matrices, matrix_keys)]
+        sample_sizes = np.concatenate([np.diff(matrix.sample_offsets) for matrix in matrices]
+                                      + [np.array([], dtype=np.int64)])
+        sample_offsets = np.concatenate(([0], np.cumsum(sample_sizes))).astype(np.int64)
+
+        def joined(name):
+            return np.concatenate([np.asarray(getattr(matrix, name)) for matrix in matrices]
+                                  + [np.array([], dtype=SITE_MATRIX_DTYPES[name])])
+
+        return cls(transcript_ids.tolist(), site_keys >> POSITION_BITS,
+                   site_keys & ((1 << POSITION_BITS) - 1), sample_offsets,
+                   np.concatenate(entry_sites + [np.array([], dtype=np.int64)]),
+                   joined('probability_modified'), joined('n_reads'), joined('mod_ratio'),
+                   [sample for matrix in matrices for sample in matrix.samples])
+
+    def __len__(self):
+        return len(self.site_positions)
+
+    @property
+    def sample_names(self):
+        return [sample["name"] for sample in self.samples]
+
+    def sample_index(self, sample):
+        """
+        Column of a sample, given by its name or the path of its source file.
+
+        Raises:
+        KeyError: If no sample has that name or source.
+        """
+        for index, entry in enumerate(self.samples):
+            if sample == entry["name"]:
+                return index
+        source = os.path.abspath(sample)
+        for index, entry in enumerate(self.samples):
+            if source == entry["source"]:
+                return index
+        raise KeyError(f"{sample} is not a sample of the site matrix")
+
+    def has_sample(self, sample):
+        """Whether the matrix holds a sample, given by its name or source path."""
+        try:
+            self.sample_index(sample)
+        except KeyError:
+            return False
+        return True
+
+    def is_current(self, sample):
+        """
+        Check that a sample's source file has the size and mtime it had when it was merged.
+
+        A missing source is reported as stale: the matrix can no longer be checked
+        against it.
+        """
+        entry = self.samples[self.sample_index(sample)]
+        try:
+            stat = os.stat(entry["source"])
+        except OSError:
+            return False
+        return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+
+    def sample_sites(self, sample):
+        """
+        The sites of one sample, in the order of its CSV file.
+
+        Parameters:
+        sample (str): Sample name or source path.
+
+        Returns:
+        pd.DataFrame: transcript_id (categorical), transcript_position (int32),
+                      n_reads, probability_modified and mod_ratio.
+        """
+        index = self.sample_index(sample)
+        entries = slice(self.sample_offsets[index], self.sample_offsets[index + 1])
+        site_rows = self.entry_sites[entries]
+        codes = self.site_transcripts[site_rows]
+        used, codes = np.unique(codes, return_inverse=True)
+        categories = np.asarray(self.transcript_ids, dtype=object)[used]
+        return pd.DataFrame({
+            'transcript_id': pd.Categorical.from_codes(codes.astype(np.int32), categories),
+            'transcript_position': self.site_positions[site_rows],
+            'n_reads': self.n_reads[entries],
+            'probability_modified': self.probability_modified[entries],
+            'mod_ratio': self.mod_ratio[entries]
+        })
+
+    def methylated_sites(self, sample, threshold=0.9, keep_probability=False,
+                         probability_dtype=np.float32):
+        """
+        The sites of one sample above the threshold, as identify_methylated_sites
+        gives them from the sample's CSV file.
+
+        Parameters:
+        sample (str): Sample name or source path.
+        threshold (float): Probability threshold to consider for methylation prediction.
+        keep_probability (bool): Also return the probability_modified column.
+        probability_dtype (dtype): dtype of the probability_modified column.
+
+        Returns:
+        pd.DataFrame: transcript_id (categorical), transcript_position (int32) and,
+                      if asked for, probability_modified, indexed by CSV row.
+        """
+        sites = self.sample_sites(sample)
+        sites = sites[sites['probability_modified'] > threshold]
+        sites = sites.astype({'probability_modified': probability_dtype})
+        sites['transcript_id'] = sites['transcript_id'].cat.remove_unused_categories()
+        if keep_probability:
+            return sites[['transcript_id', 'transcript_position', 'probability_modified']]
+        return sites[['transcript_id', 'transcript_position']]
+
+    def sites(self):
+        """The transcript_id and transcript_position of every site row."""
+        return pd.DataFrame({
+            'transcript_id': np.asarray(self.transcript_ids, dtype=object)[self.site_transcripts],
+            'transcript_position': self.site_positions.astype(np.int64)})
+
+    def read_counts(self, sample):
+        """
+        Modified and unmodified reads of one sample's sites.
+
+        m6anet's mod_ratio is the fraction of a site's n_reads that are modified.
+
+        Parameters:
+        sample (str): Sample name or source path.
+
+        Returns:
+        tuple: (site_rows, modified, unmodified): the site row of each of the
+               sample's entries, a slice of the (memory-mapped) entry_sites, and
+               int64 read counts of each entry.
+        """
+        index = self.sample_index(sample)
+        entries = slice(self.sample_offsets[index], self.sample_offsets[index + 1])
+        n_reads = self.n_reads[entries].astype(np.int64)
+        modified = np.rint(self.mod_ratio[entries].astype(np.float64) * n_reads).astype(np.int64)
+        return self.entry_sites[entries], modified, n_reads - modified
+
+    def save(self, matrix_path):
+        """
+        Write the matrix as a directory of .npy arrays and a meta.json.
+
+        As for the annotation index, each save is a new version directory that
+        matrix_path, a symlink, is atomically switched to, so a reader never sees
+        a half written matrix or none at all.
+
+        Parameters:
+        matrix_path (str): Path to the matrix.
+        """
+        meta = {"format_version": SITE_MATRIX_FORMAT_VERSION, "samples": self.samples}
+        arrays = {
+            "transcript_ids": np.array(self.transcript_ids, dtype=str),
+            "site_transcripts": self.site_transcripts,
+            "site_positions": self.site_positions,
+            "sample_offsets": self.sample_offsets,
+            "entry_sites": self.entry_sites,
+            "probability_modified": self.probability_modified,
+            "n_reads": self.n_reads,
+            "mod_ratio": self.mod_ratio,
+        }
+        write_versioned_arrays(matrix_path, arrays, meta)
+
+    @classmethod
+    def load(cls, matrix_path):
+        """
+        Memory-map a saved site matrix.
+
+        The matrix link is resolved once, so every array comes from the same
+        version even if the matrix is saved again meanwhile.
+
+        Parameters:
+        matrix_path (str): Path to the matrix directory.
+
+        Returns:
+        SiteMatrix: The matrix, its arrays read from disk as they are used.
+
+        Raises:
+        ValueError: If the matrix was written in another format version.
+        """
+        matrix_path = os.path.realpath(matrix_path)
+        with open(os.path.join(matrix_path, "meta.json")) as handle:
+            meta = json.load(handle)
+        if meta.get("format_version") != SITE_MATRIX_FORMAT_VERSION:
+            raise ValueError(f"{matrix_path} is not a version {SITE_MATRIX_FORMAT_VERSION} "
+                             "site matrix: rebuild it with python -m interogate.site_matrix")
+
+        def load(name):
+            return np.load(os.path.join(matrix_path, name + ".npy"), mmap_mode='r')
+
+        return cls(load("transcript_ids").tolist(), load("site_transcripts"),
+                   load("site_positions"), load("sample_offsets"), load("entry_sites"),
+                   load("probability_modified"), load("n_reads"), load("mod_ratio"),
+                   meta["samples"])
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Merge the data.site_proba.csv files of " +
+                                     "many samples into one memory-mappable site x sample matrix")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("--m6a", nargs='+', default=None,
+                        help="m6anet data.site_proba.csv files; each file path is a sample")
+    inputs.add_argument("--samples", default=None,
+                        help="tab separated sample sheet (sample, condition, replicate, " +
+                        "site_proba, indiv_proba), as used by interogate.statistical_analysis")
+    parser.add_argument("-o", "--out", dest='out', required=True,
+                        help="directory to write the matrix to, e.g. sites" + SITE_MATRIX_SUFFIX)
+    parser.add_argument("--chunksize", type=int, default=1000000,
+                        help="number of CSV rows to read at a time")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    if args.samples:
+        from interogate.statistical_analysis import read_sample_sheet
+        samples = read_sample_sheet(args.samples)
+        matrix = SiteMatrix.from_site_files(samples['site_proba'].tolist(), samples['sample'].tolist(),
+                                            samples['condition'].tolist(),
+                                            samples['replicate'].tolist(), args.chunksize)
+    else:
+        matrix = SiteMatrix.from_site_files(args.m6a, chunksize=args.chunksize)
+    matrix.save(args.out)
+    logger.info("Saved %d sites of %d samples to %s", len(matrix), len(matrix.samples), args.out)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,728 @@
+#!/usr/bin/env python3
+#
+# statistical_analysis.py
+#
+# STATs analysis of m6anet output across conditions, driven by a sample sheet.
+#
+# python -m interogate.statistical_analysis --samples samples.tsv [--gene-list genes.txt] --threads 8
+
+import os
+import sys
+import argparse
+import itertools
+import logging
+import multiprocessing
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2, kruskal
+from interogate.parse_m6a_indiv_proba import ReadCountAccumulator, count_modified_reads
+from interogate.site_matrix import SiteMatrix
+
+logger = logging.getLogger('interogate_m6anet')
+
+# Tab separated, one row per sample. Relative paths are read from the sheet's directory.
+SAMPLE_SHEET_COLUMNS = ['sample', 'condition', 'replicate', 'site_proba', 'indiv_proba']
+SITE_SUMMARY_COLUMNS = ['transcript_id', 'Non-Modified', 'Modified', 'total_sites', 'mod_ratio',
+                        'condition', 'replicate']
+INDIV_SUMMARY_COLUMNS = ['transcript_id', 'Modified', 'Non-Modified', 'mod_ratio', 'condition',
+                         'replicate']
+SITE_TEST_COLUMNS = ['transcript_id', 'transcript_position', 'condition_a', 'condition_b',
+                     'modified_a', 'unmodified_a', 'modified_b', 'unmodified_b', 'mod_ratio_a',
+                     'mod_ratio_b', 'log2_odds_ratio', 'chi2', 'p_value', 'fdr']
+
+
+def read_sample_sheet(sample_sheet):
+    """
+    Read the sample sheet.
+
+    Parameters:
+    sample_sheet (str): Path to a tab separated file with the columns sample,
+                        condition, replicate, site_proba and indiv_proba.
+
+    Returns:
+    pd.DataFrame: One row per sample, with the site_proba and indiv_proba paths
+                  resolved against the sheet's directory.
+    """
+    samples = pd.read_csv(sample_sheet, sep='\t', dtype=str, comment='#').dropna(how='all')
+    missing = [column for column in SAMPLE_SHEET_COLUMNS if column not in samples.columns]
+    if missing:
+        raise ValueError(f"The sample sheet must contain the following columns: {SAMPLE_SHEET_COLUMNS}")
+    if samples['sample'].duplicated().any():
+        raise ValueError("Sample names in the sample sheet must be unique")
+    samples = samples[SAMPLE_SHEET_COLUMNS].copy()
+    samples['replicate'] = samples['replicate'].astype(int)
+    sheet_dir = os.path.dirname(os.path.abspath(sample_sheet))
+    for column in ('site_proba', 'indiv_proba'):
+        samples[column] = [os.path.join(sheet_dir, path) for path in samples[column]]
+    return samples.reset_index(drop=True)
+
+
+def site_summary(counts, condition, replicate):
+    """
+    Per-transcript site summary from modified and non-modified site counts.
+
+    Parameters:
+    counts (pd.DataFrame): transcript_id, Modified and Non-Modified site counts.
+    condition (str): Condition label of the sample.
+    replicate (int): Replicate number of the sample.
+
+    Returns:
+    pd.DataFrame: One row per transcript with the SITE_SUMMARY_COLUMNS.
+    """
+    summary = counts.copy()
+    summary['total_sites'] = summary['Modified'] + summary['Non-Modified']
+    summary['mod_ratio'] = summary['Modified'] / summary['total_sites']
+    summary['condition'] = condition
+    summary['replicate'] = replicate
+    return summary[SITE_SUMMARY_COLUMNS]
+
+
+def process_site_proba(data, condition, replicate, threshold=0.9):
+    """Process a single site_proba data frame"""
+    counts = ReadCountAccumulator(threshold)
+    counts.add(data)
+    return site_summary(counts.per_transcript(), condition, replicate)
+
+
+def summarize_site_proba(path, condition, replicate, threshold=0.9, chunksize=1000000):
+    """
+    Count the modified and non-modified sites per transcript of one site_proba file.
+
+    Only transcript_id and probability_modified are read, in chunks, as for
+    the reads of process_indiv_proba.
+
+    Parameters:
+    path (str): Path to the data.site_proba.csv file.
+    condition (str): Condition label of the sample.
+    replicate (int): Replicate number of the sample.
+    threshold (float): Sites with probability_modified at or above this are modified.
+    chunksize (int): Number of CSV rows to read at a time.
+
+    Returns:
+    pd.DataFrame: One row per transcript with the SITE_SUMMARY_COLUMNS.
+    """
+    counts = count_modified_reads(path, threshold=threshold, chunksize=chunksize)
+    return site_summary(counts, condition, replicate)
+
+
+def process_indiv_proba(path, condition, replicate, threshold=0.9, chunksize=1000000):
+    """
+    Count the modified and non-modified reads per transcript of one indiv_proba file.
+
+    The file is read in chunks and only the per-transcript counters are kept.
+
+    Parameters:
+    path (str): Path to the data.indiv_proba.csv file.
+    condition (str): Condition label of the sample.
+    replicate (int): Replicate number of the sample.
+    threshold (float): Reads with probability_modified at or above this are modified.
+    chunksize (int): Number of CSV rows to read at a time.
+
+    Returns:
+    pd.DataFrame: One row per transcript with Modified, Non-Modified, mod_ratio,
+                  condition and replicate.
+    """
+    summary = count_modified_reads(path, threshold=threshold, chunksize=chunksize)
+    summary['mod_ratio'] = summary['Modified'] / (summary['Modified'] + summary['Non-Modified'])
+    summary['condition'] = condition
+    summary['replicate'] = replicate
+    return summary
+
+
+def matrix_sample_names(matrix, samples):
+    """
+    The name of each sample sheet row in a SiteMatrix.
+
+    A matrix built from a sample sheet names its samples as the sheet does; one
+    built from --m6a files names them by path, so a sample is also found by
+    its site_proba file.
+
+    Parameters:
+    matrix (SiteMatrix): Matrix holding the sites of every sample.
+    samples (pd.DataFrame): Output of read_sample_sheet.
+
+    Returns:
+    list: The matrix sample name or source path of each sample.
+
+    Raises:
+    ValueError: If some samples are in the matrix under neither their name nor their site_proba path.
+    """
+    names = []
+    missing = []
+    for name, site_file in zip(samples['sample'], samples['site_proba']):
+        if matrix.has_sample(name):
+            names.append(name)
+        elif matrix.has_sample(site_file):
+            names.append(site_file)
+        else:
+            missing.append(name)
+    if missing:
+        raise ValueError(f"Samples not in the site matrix (by name or site_proba path): "
+                         f"{', '.join(missing)}")
+    return names
+
+
+def summarize_sample(task):
+    """
+    Summarize the site_proba and indiv_proba files of one sample.
+
+    Parameters:
+    task (tuple): (sample, threshold, chunksize, site_matrix, build_matrix), where sample
+                  is a sample sheet row as a dict, site_matrix the path of a SiteMatrix
+                  holding the sample's sites (with the sample's name in it as
+                  matrix_name), or None to read its site_proba file, and build_matrix
+                  whether to also return the sample's sites as a SiteMatrix.
+
+    Returns:
+    tuple: (site summary, indiv summary) per-transcript DataFrames of the sample, and
+           the sample's SiteMatrix, or None if it was not asked for.
+    """
+    sample, threshold, chunksize, site_matrix, build_matrix = task
+    matrix = None
+    if site_matrix:
+        site_data = SiteMatrix.load(site_matrix).sample_sites(sample['matrix_name'])
+        sites = process_site_proba(site_data[['transcript_id', 'probability_modified']],
+                                   sample['condition'], sample['replicate'], threshold)
+    elif build_matrix:
+        # Read the file once, into the sample's matrix, and summarize from that
+        matrix = SiteMatrix.from_site_files([sample['site_proba']], [sample['sample']],
+                                            [sample['condition']], [sample['replicate']], chunksize)
+        site_data = matrix.sample_sites(sample['sample'])
+        sites = process_site_proba(site_data[['transcript_id', 'probability_modified']],
+                                   sample['condition'], sample['replicate'], threshold)
+    else:
+        sites = summarize_site_proba(sample['site_proba'], sample['condition'],
+                                     sample['replicate'], threshold, chunksize)
+    indiv_summary = process_indiv_proba(sample['indiv_proba'], sample['condition'],
+                                        sample['replicate'], threshold, chunksize)
+    return sites, indiv_summary, matrix
+
+
+def load_samples(samples, threads=1, threshold=0.9, chunksize=1000000, site_matrix=None,
+                 build_matrix=False):
+    """
+    Summarize every sample, in parallel worker processes, and concatenate the summaries.
+
+    Only the per-transcript summaries come back from the workers, and, with
+    build_matrix, each sample's sites as integer coded SiteMatrix arrays.
+
+    Parameters:
+    samples (pd.DataFrame): Output of read_sample_sheet.
+    threads (int): Number of worker processes.
+    threshold (float): Probability at or above which a site or read is modified.
+    chunksize (int): Number of site_proba and indiv_proba rows to read at a time.
+    site_matrix (str): Path of a SiteMatrix with the sites of every sample, by sample
+                       name or site_proba path, to use instead of the site_proba files.
+    build_matrix (bool): Also merge the samples' sites into a SiteMatrix, read in the
+                         same pass as the summaries. Ignored with site_matrix.
+
+    Returns:
+    tuple: (site_proba_data, indiv_proba_data) DataFrames of all samples, in sample sheet
+           order, and the SiteMatrix of their sites, or None if it was not built.
+    """
+    records = samples.to_dict('records')
+    if site_matrix:
+        matrix_names = matrix_sample_names(SiteMatrix.load(site_matrix), samples)
+        for record, matrix_name in zip(records, matrix_names):
+            record['matrix_name'] = matrix_name
+    tasks = [(sample, threshold, chunksize, site_matrix, build_matrix) for sample in records]
+    if threads > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(processes=min(threads, len(tasks))) as pool:
+            summaries = pool.map(summarize_sample, tasks)
+    else:
+        summaries = [summarize_sample(task) for task in tasks]
+    site_proba_data = pd.concat([site for site, _, _ in summaries], ignore_index=True)
+    indiv_proba_data = pd.concat([indiv for _, indiv, _ in summaries], ignore_index=True)
+    matrix = None
+    if build_matrix and not site_matrix:
+        matrix = SiteMatrix.concatenate([sample_matrix for _, _, sample_matrix in summaries])
+    return site_proba_data, indiv_proba_data, matrix
+
+
+def pairwise_dunn_test(data, group_col, value_col):
+    """
+    Perform pairwise Dunn's test with Benjamini-Hochberg correction.
+
+    Parameters:
+    data (pd.DataFrame): DataFrame containing the data to be tested.
+    group_col (str): Name of the column containing the group labels.
+    value_col (str): Name of the column containing the values to be tested.
+
+    Returns:
+    pd.DataFrame: DataFrame containing the pairwise comparison p-values.
+    """
+    import scikit_posthocs as sp
+    comparisons = sp.posthoc_dunn(data, val_col=value_col,
+                                  group_col=group_col, p_adjust='fdr_bh')
+    return comparisons
+
+
+def site_read_counts(data):
+    """
+    Modified and unmodified read counts of every site of an m6anet site_proba table.
+
+    m6anet's mod_ratio is the fraction of a site's n_reads that are modified.
+
+    Parameters:
+    data (pd.DataFrame): site_proba rows with transcript_id, transcript_position,
+                         n_reads and mod_ratio.
+
+    Returns:
+    pd.DataFrame: transcript_id, transcript_position, modified and unmodified (int64).
+    """
+    n_reads = data['n_reads'].to_numpy(dtype=np.int64)
+    modified = np.rint(data['mod_ratio'].to_numpy(dtype=np.float64) * n_reads).astype(np.int64)
+    return pd.DataFrame({'transcript_id': data['transcript_id'].astype(str).to_numpy(dtype=object),
+                         'transcript_position': data['transcript_position'].to_numpy(dtype=np.int64),
+                         'modified': modified,
+                         'unmodified': n_reads - modified})
+
+
+def align_site_counts(site_counts):
+    """
+    Line up the sites of several samples as rows of site x sample count arrays.
+
+    Sites are keyed as transcript code * stride + position, so the union and the
+    placement of each sample's sites are sorts and binary searches rather than
+    joins. A sample without reads at a site has 0 modified and 0 unmodified reads.
+
+    Parameters:
+    site_counts (list): One site_read_counts DataFrame per sample.
+
+    Returns:
+    tuple: (sites, modified, unmodified): a DataFrame of transcript_id and
+           transcript_position sorted by both, and int64 arrays of shape
+           (sites, samples).
+    """
+    transcript_ids = pd.Index(sorted({transcript_id for counts in site_counts
+                                      for transcript_id in pd.unique(counts['transcript_id'])}),
+                              dtype=object)
+    stride = max([int(counts['transcript_position'].max()) for counts in site_counts
+                  if len(counts)] or [0]) + 1
+    sample_keys = [transcript_ids.get_indexer(counts['transcript_id'].to_numpy(dtype=object))
+                   .astype(np.int64) * stride + counts['transcript_position'].to_numpy(dtype=np.int64)
+                   for counts in site_counts]
+    keys = np.unique(np.concatenate(sample_keys + [np.array([], dtype=np.int64)]))
+
+    modified = np.zeros((len(keys), len(site_counts)), dtype=np.int64)
+    unmodified = np.zeros((len(keys), len(site_counts)), dtype=np.int64)
+    for column, (counts, sample_key) in enumerate(zip(site_counts, sample_keys)):
+        rows = np.searchsorted(keys, sample_key)
+        np.add.at(modified[:, column], rows, counts['modified'].to_numpy(dtype=np.int64))
+        np.add.at(unmodified[:, column], rows, counts['unmodified'].to_numpy(dtype=np.int64))
+    sites = pd.DataFrame({'transcript_id': transcript_ids.to_numpy()[keys // stride],
+                          'transcript_position': keys % stride})
+    return sites, modified, unmodified
+
+
+def condition_read_counts(matrix, samples):
+    """
+    Modified and unmodified reads of every site of a SiteMatrix, pooled per condition.
+
+    Each sample's entries are read from the memory-mapped matrix and added into
+    its condition's column, so no site x sample array is built.
+
+    Parameters:
+    matrix (SiteMatrix): Matrix holding the sites of every sample, by sample name or
+                         site_proba path.
+    samples (pd.DataFrame): Output of read_sample_sheet.
+
+    Returns:
+    tuple: (conditions, modified, unmodified): the conditions in sample sheet order
+           and int64 arrays of shape (sites, conditions).
+
+    Raises:
+    ValueError: If some samples are not in the matrix.
+    """
+    conditions = list(pd.unique(samples['condition']))
+    modified = np.zeros((len(matrix), len(conditions)), dtype=np.int64)
+    unmodified = np.zeros((len(matrix), len(conditions)), dtype=np.int64)
+    for sample, condition in zip(matrix_sample_names(matrix, samples), samples['condition']):
+        site_rows, sample_modified, sample_unmodified = matrix.read_counts(sample)
+        column = conditions.index(condition)
+        modified[:, column] += np.bincount(site_rows, weights=sample_modified,
+                                           minlength=len(matrix)).astype(np.int64)
+        unmodified[:, column] += np.bincount(site_rows, weights=sample_unmodified,
+                                             minlength=len(matrix)).astype(np.int64)
+    return conditions, modified, unmodified
+
+
+def benjamini_hochberg(p_values):
+    """
+    Benjamini-Hochberg adjusted p-values (FDR), ignoring NaN p-values.
+
+    Parameters:
+    p_values (array): p-values, NaN where no test was done.
+
+    Returns:
+    array: float64 adjusted p-values, NaN where the p-value is NaN.
+    """
+    p_values = np.asarray(p_values, dtype=np.float64)
+    adjusted = np.full(len(p_values), np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    if not len(tested):
+        return adjusted
+    order = tested[np.argsort(p_values[tested], kind='stable')]
+    ranked = p_values[order] * len(order) / np.arange(1, len(order) + 1)
+    adjusted[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return adjusted
+
+
+def chi2_2x2(a, b, c, d, correction=True):
+    """
+    Pearson chi-squared statistics of many 2x2 tables [[a, b], [c, d]] at once.
+
+    Matches scipy.stats.chi2_contingency on each table, including its Yates
+    continuity correction. Tables with an empty row or column get NaN.
+
+    Parameters:
+    a, b, c, d (array): Cell counts of every table.
+    correction (bool): Apply Yates' continuity correction.
+
+    Returns:
+    tuple: (statistic, p_value) float64 arrays.
+    """
+    a, b, c, d = (np.asarray(cell, dtype=np.float64) for cell in (a, b, c, d))
+    n = a + b + c + d
+    margins = (a + b) * (c + d) * (a + c) * (b + d)
+    valid = margins > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Every cell of a 2x2 table is |ad - bc| / n away from its expected count
+        deviation = np.abs(a * d - b * c) / n
+        if correction:
+            deviation = np.maximum(deviation - 0.5, 0)
+        statistic = np.where(valid, deviation ** 2 * n ** 3 / margins, np.nan)
+    return statistic, chi2.sf(statistic, 1)
+
+
+def per_site_differential_test(sites, modified, unmodified, conditions, condition_a, condition_b,
+                               correction=True):
+    """
+    Test every site for a difference in modified reads between two conditions.
+
+    The replicates of each condition are pooled into one 2x2 table per site
+    (modified and unmodified reads in condition_a and condition_b) and all the
+    tables are tested at once with chi2_2x2. p-values are BH corrected over the
+    sites given that could be tested, so filter the sites (e.g. to a gene list)
+    before calling this, not its results.
+
+    Parameters:
+    sites (pd.DataFrame): Sites from align_site_counts.
+    modified (array): (sites, samples) modified read counts from align_site_counts.
+    unmodified (array): (sites, samples) unmodified read counts from align_site_counts.
+    conditions (list): Condition of each sample (column).
+    condition_a (str): First condition.
+    condition_b (str): Second condition.
+    correction (bool): Apply Yates' continuity correction.
+
+    Returns:
+    pd.DataFrame: One row per site with the SITE_TEST_COLUMNS. mod_ratio_a/b are the
+                  pooled fractions of modified reads, log2_odds_ratio uses a 0.5
+                  pseudocount and chi2, p_value and fdr are NaN where a condition
+                  has no reads or no read class is seen.
+    """
+    conditions = np.asarray(conditions)
+    in_a, in_b = conditions == condition_a, conditions == condition_b
+    a, b = modified[:, in_a].sum(axis=1), unmodified[:, in_a].sum(axis=1)
+    c, d = modified[:, in_b].sum(axis=1), unmodified[:, in_b].sum(axis=1)
+    statistic, p_values = chi2_2x2(a, b, c, d, correction)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mod_ratio_a = a / (a + b)
+        mod_ratio_b = c / (c + d)
+    return pd.DataFrame({
+        'transcript_id': sites['transcript_id'].to_numpy(),
+        'transcript_position': sites['transcript_position'].to_numpy(),
+        'condition_a': condition_a,
+        'condition_b': condition_b,
+        'modified_a': a,
+        'unmodified_a': b,
+        'modified_b': c,
+        'unmodified_b': d,
+        'mod_ratio_a': mod_ratio_a,
+        'mod_ratio_b': mod_ratio_b,
+        'log2_odds_ratio': np.log2((a + 0.5) * (d + 0.5) / ((b + 0.5) * (c + 0.5))),
+        'chi2': statistic,
+        'p_value': p_values,
+        'fdr': benjamini_hochberg(p_values)
+    }, columns=SITE_TEST_COLUMNS)
+
+
+def pairwise_site_tests(sites, modified, unmodified, conditions, correction=True):
+    """
+    Run per_site_differential_test for every pair of conditions.
+
+    Returns:
+    pd.DataFrame: The per-pair tables one after the other, each with its own FDR.
+    """
+    pairs = itertools.combinations(pd.unique(np.asarray(conditions)), 2)
+    return pd.concat([per_site_differential_test(sites, modified, unmodified, conditions,
+                                                 condition_a, condition_b, correction)
+                      for condition_a, condition_b in pairs]
+                     + [pd.DataFrame(columns=SITE_TEST_COLUMNS)], ignore_index=True)
+
+
+def read_gene_list(file_path):
+    """
+    Read a list of genes from a file, one gene per line.
+
+    Parameters:
+    file_path (str): Path to the file containing the list of genes.
+
+    Returns:
+    set: Set of genes read from the file.
+    """
+    gene_set = set()
+    with open(file_path, 'r') as file:
+        genes = file.read().splitlines()
+    for gene in genes:
+        if not gene.endswith(".1"):
+            gene = gene + ".1"
+        gene_set.add(gene)
+    return gene_set
+
+
+def filter_common_transcripts(site_proba_data, indiv_proba_data):
+    """
+    Keep only the transcripts that have sites in every condition.
+
+    Returns:
+    tuple: The filtered site_proba_data and indiv_proba_data, and the file name
+           label for the common genes.
+    """
+    common_genes = set(site_proba_data['transcript_id'])
+    for condition in site_proba_data['condition'].unique():
+        condition_genes = set(site_proba_data[site_proba_data['condition'] == condition]['transcript_id'])
+        common_genes = common_genes.intersection(condition_genes)
+
+    logger.info("Keeping the %d transcripts with sites in every condition", len(common_genes))
+    gene_list_file_name = "common_%d_genes" % (len(common_genes))
+
+    site_proba_data = site_proba_data[site_proba_data['transcript_id'].isin(common_genes)]
+    indiv_proba_data = indiv_proba_data[indiv_proba_data['transcript_id'].isin(common_genes)]
+    return site_proba_data, indiv_proba_data, gene_list_file_name
+
+
+def plot_condition_distribution(data, value_col, title, ylabel, output_file):
+    """
+    Violin, box and strip plot of a per-transcript value for each condition.
+
+    Parameters:
+    data (pd.DataFrame): Table with a condition column and the value column.
+    value_col (str): Name of the column to plot.
+    title (str): Plot title.
+    ylabel (str): y axis label.
+    output_file (str): Path to the PNG file.
+    """
+    import seaborn as sns
+    from interogate.plot import load_pyplot
+    plt = load_pyplot()
+    plt.figure(figsize=(12, 8))
+    sns.violinplot(x='condition', y=value_col, data=data, inner=None, palette="vlag")
+    sns.boxplot(x='condition', y=value_col, data=data, whis=[0, 100], width=.2, palette="vlag")
+    sns.stripplot(x='condition', y=value_col, data=data, size=1, color=".4", linewidth=0)
+    plt.title(title)
+    plt.ylabel(ylabel)
+    plt.xlabel('Condition')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(output_file)
+    plt.close()
+
+
+def run_statistics(site_proba_data, indiv_proba_data, gene_list_file_name, out_dir='.'):
+    """
+    Plot, test and summarize the per-transcript summaries of all samples.
+
+    Parameters:
+    site_proba_data (pd.DataFrame): Site summaries of all samples, from load_samples.
+    indiv_proba_data (pd.DataFrame): Read summaries of all samples, from load_samples.
+    gene_list_file_name (str): Label the output files start with.
+    out_dir (str): Directory to write the outputs to.
+    """
+    prefix = os.path.join(out_dir, gene_list_file_name)
+
+    # Write the first "number_of_lines" lines of each DataFrame to a file with tab-separated values
+    number_of_lines = 100000
+    site_proba_data.head(number_of_lines).to_csv(f'{prefix}_site_proba_data_first_{number_of_lines}_lines.csv', index=False, sep='\t')
+    indiv_proba_data.head(number_of_lines).to_csv(f'{prefix}_indiv_proba_data_first_{number_of_lines}_lines.csv', index=False, sep='\t')
+
+    plot_condition_distribution(
+        site_proba_data, 'mod_ratio',
+        f'Ratio of Modified to Non-Modified Sites per Transcript per Experiment (Site Proba) - {gene_list_file_name}',
+        'Ratio of Modified to Non-Modified Sites',
+        f'{prefix}_ratio_of_modified_sites_boxplot_site_proba.png')
+    plot_condition_distribution(
+        indiv_proba_data, 'mod_ratio',
+        f'Ratio of Modified to Non-Modified Reads per Transcript per Experiment (Indiv Proba) - {gene_list_file_name}',
+        'Ratio of Modified to Non-Modified Reads',
+        f'{prefix}_ratio_of_modified_reads_boxplot_indiv_proba.png')
+
+    # Calculate mean modification ratio per site per transcript
+    mean_mod_ratio_data = site_proba_data.groupby(['transcript_id', 'condition']).agg(
+        mean_mod_ratio=pd.NamedAgg(column='mod_ratio', aggfunc='mean')
+    ).reset_index()
+    plot_condition_distribution(
+        mean_mod_ratio_data, 'mean_mod_ratio',
+        f'Mean Modification Ratio per Site per Transcript per Experiment - {gene_list_file_name}',
+        'Mean Modification Ratio per Site',
+        f'{prefix}_mean_modification_ratio_per_site_boxplot.png')
+
+    logger.info("""Summary of Comparisons:
+Modification Ratios (Site Proba): Comparison of modification ratios of modified to non-modified sites across conditions.
+Modification Ratios (Indiv Proba): Comparison of modification ratios of modified to non-modified reads across conditions.
+Mean Modification Ratios (Per Site Per Transcript): Comparison of mean modification ratios per site per transcript across conditions.
+Number of Modified Reads: Comparison of the number of modified reads per transcript across conditions\n""")
+
+    # Summary statistics for site proba, indiv proba and mean modification ratio per site per transcript
+    summary_stats_site = site_proba_data.groupby('condition')['mod_ratio'].describe()
+    logger.info("Modification ratio of the sites per transcript:\n%s", summary_stats_site)
+    summary_stats_indiv = indiv_proba_data.groupby('condition')['mod_ratio'].describe()
+    logger.info("Modification ratio of the reads per transcript:\n%s", summary_stats_indiv)
+    summary_stats_mean_mod_ratio = mean_mod_ratio_data.groupby('condition')['mean_mod_ratio'].describe()
+    logger.info("Mean modification ratio per site per transcript:\n%s", summary_stats_mean_mod_ratio)
+
+    kruskal_test_site = kruskal(*[group["mod_ratio"].values for name, group in site_proba_data.groupby("condition")])
+    logger.info("Comparison of modified sites\n"
+                "This test compares the modification ratios (mod_ratio) of modified to non-modified sites across different conditions\n"
+                "Kruskal-Wallis test for site proba: %s", kruskal_test_site)
+
+    kruskal_test_indiv = kruskal(*[group["mod_ratio"].values for name, group in indiv_proba_data.groupby("condition")])
+    logger.info("Comparison of modified reads\n"
+                "This test compares the modification ratios (mod_ratio) of modified to non-modified reads across different conditions.\n"
+                "Kruskal-Wallis test for indiv proba: %s", kruskal_test_indiv)
+
+    kruskal_test_mean_mod_ratio = kruskal(*[group["mean_mod_ratio"].values for name, group in mean_mod_ratio_data.groupby("condition")])
+    logger.info("Mean modification rate\n"
+                "This test compares the mean modification ratios per site per transcript across different conditions.\n"
+                "Kruskal-Wallis test for mean modification ratio per site per transcript: %s", kruskal_test_mean_mod_ratio)
+
+    kruskal_test_reads = kruskal(*[group["Modified"].values for name, group in indiv_proba_data.groupby("condition")])
+    logger.info("Number of modified reads\n"
+                "This test compares the number of modified reads per transcript across different conditions.\n"
+                "Kruskal-Wallis test for the number of modified reads per transcript: %s", kruskal_test_reads)
+
+    # Post hoc pairwise comparisons using Dunn's test with Benjamini-Hochberg correction
+    pairwise_comparisons_site = pairwise_dunn_test(site_proba_data, 'condition', 'mod_ratio')
+    pairwise_comparisons_indiv = pairwise_dunn_test(indiv_proba_data, 'condition', 'mod_ratio')
+    pairwise_comparisons_mean_mod_ratio = pairwise_dunn_test(mean_mod_ratio_data, 'condition', 'mean_mod_ratio')
+    pairwise_comparisons_reads = pairwise_dunn_test(indiv_proba_data, 'condition', 'Modified')
+
+    logger.info("### SECTION: Dunn test with BH post hoc correction ###")
+
+    logger.info("Pairwise comparisons for site proba:\n"
+                "Modification ratios of modified to non-modified SITES across conditions.\n%s",
+                pairwise_comparisons_site)
+
+    logger.info("Pairwise comparisons for indiv proba:\n"
+                "Modification ratios of modified to non-modified READS across conditions.\n%s",
+                pairwise_comparisons_indiv)
+
+    logger.info("Pairwise comparisons for mean modification ratio per site per transcript:\n"
+                "Mean modification ratios per site per transcript across conditions.\n%s",
+                pairwise_comparisons_mean_mod_ratio)
+
+    logger.info("Pairwise comparisons for the number of modified reads per transcript:\n"
+                "Number of modified reads per transcript across conditions.\n%s",
+                pairwise_comparisons_reads)
+
+    # Save summary statistics and comparison results to TSV files
+    summary_stats_site.to_csv(f'{prefix}_summary_statistics_site.tsv', sep='\t')
+    summary_stats_indiv.to_csv(f'{prefix}_summary_statistics_indiv.tsv', sep='\t')
+    summary_stats_mean_mod_ratio.to_csv(f'{prefix}_summary_statistics_mean_mod_ratio.tsv', sep='\t')
+    pairwise_comparisons_site.to_csv(f'{prefix}_pairwise_comparisons_site.tsv', sep='\t')
+    pairwise_comparisons_indiv.to_csv(f'{prefix}_pairwise_comparisons_indiv.tsv', sep='\t')
+    pairwise_comparisons_mean_mod_ratio.to_csv(f'{prefix}_pairwise_comparisons_mean_mod_ratio.tsv', sep='\t')
+    pairwise_comparisons_reads.to_csv(f'{prefix}_pairwise_comparisons_reads.tsv', sep='\t')
+
+
+def run_site_tests(matrix, samples, gene_list, gene_list_file_name, out_dir='.'):
+    """
+    Test the modified reads at every site between each pair of conditions and write the tests.
+
+    Parameters:
+    matrix (SiteMatrix): Matrix holding the sites of every sample.
+    samples (pd.DataFrame): Output of read_sample_sheet.
+    gene_list (set): Transcripts to test, or None for every site.
+    gene_list_file_name (str): Label the output file starts with.
+    out_dir (str): Directory to write the tests to.
+
+    Returns:
+    str: Path of the per-site tests file.
+    """
+    sites = matrix.sites()
+    conditions, modified, unmodified = condition_read_counts(matrix, samples)
+    if gene_list is not None:
+        # Filter before testing, so the FDR is over the gene list's sites only
+        keep = sites['transcript_id'].isin(gene_list).to_numpy()
+        sites = sites[keep].reset_index(drop=True)
+        modified, unmodified = modified[keep], unmodified[keep]
+    site_tests = pairwise_site_tests(sites, modified, unmodified, conditions)
+    site_tests_file = os.path.join(out_dir, f'{gene_list_file_name}_per_site_tests.tsv')
+    site_tests.to_csv(site_tests_file, index=False, sep='\t')
+    logger.info("Per-site tests of %d sites saved to %s", len(sites), site_tests_file)
+    return site_tests_file
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Compare m6anet site and read level " +
+                                     "modification across the conditions of a sample sheet")
+    parser.add_argument("--samples", required=True,
+                        help="tab separated sample sheet with the columns: " +
+                        ", ".join(SAMPLE_SHEET_COLUMNS))
+    parser.add_argument("--site-matrix", dest='site_matrix', default=None,
+                        help="site matrix built by python -m interogate.site_matrix with " +
+                        "the sites of every sample, to use instead of the site_proba files")
+    parser.add_argument("--site-tests", dest='site_tests', action='store_true',
+                        help="also test every site between each pair of conditions and write " +
+                        "<label>_per_site_tests.tsv")
+    parser.add_argument("--gene-list", dest='gene_list', default=None,
+                        help="file of genes to filter to, one per line")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="number of samples to load in parallel")
+    parser.add_argument("--threshold", type=float, default=0.9,
+                        help="probability at or above which a site or read is modified")
+    parser.add_argument("--chunksize", type=int, default=1000000,
+                        help="number of site_proba and indiv_proba rows to read at a time")
+    parser.add_argument("-o", "--out", dest='out_dir', default='.',
+                        help="directory to write the outputs to")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    samples = read_sample_sheet(args.samples)
+    if args.gene_list:
+        logger.info("Filtering to the genes in: %s", args.gene_list)
+
+    site_proba_data, indiv_proba_data, matrix = load_samples(samples, args.threads, args.threshold,
+                                                             args.chunksize, args.site_matrix,
+                                                             build_matrix=args.site_tests)
+
+    # Filter the data to include only the genes in the provided gene list
+    gene_list = None
+    if args.gene_list:
+        gene_list = read_gene_list(args.gene_list)
+        site_proba_data = site_proba_data[site_proba_data['transcript_id'].isin(gene_list)]
+        indiv_proba_data = indiv_proba_data[indiv_proba_data['transcript_id'].isin(gene_list)]
+
+    site_proba_data, indiv_proba_data, gene_list_file_name = \
+        filter_common_transcripts(site_proba_data, indiv_proba_data)
+
+    # Ensure the order of columns is consistent
+    site_proba_data = site_proba_data[SITE_SUMMARY_COLUMNS]
+    indiv_proba_data = indiv_proba_data[INDIV_SUMMARY_COLUMNS]
+
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    # Condition vs condition test of the modified reads at every site
+    if args.site_tests:
+        if matrix is None:
+            matrix = SiteMatrix.load(args.site_matrix)
+        run_site_tests(matrix, samples, gene_list, gene_list_file_name, args.out_dir)
+
+    run_statistics(site_proba_data, indiv_proba_data, gene_list_file_name, args.out_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# stream.py
+
+from interogate.parse_m6a_site_proba import iter_methylated_sites
+from interogate.annotate import annotate_methylated_sites
+from interogate.summary_stats import SiteCountAccumulator
+from interogate.columnar import ParquetBatchWriter
+
+
+def tab_annotation(results_df):
+    """
+    annotate_methylated_sites output as it is written to _exon_annotated.tab.
+
+    total_exons_in_transcript is float with NaN when any site is in a UTR and
+    int otherwise; as a nullable Int32 (as in columnar.typed_annotation) it is
+    written as "3", or empty for UTR sites, whichever sites a batch holds.
+
+    Parameters:
+    results_df (DataFrame): Output of annotate_methylated_sites.
+
+    Returns:
+    DataFrame: results_df with total_exons_in_transcript as Int32.
+    """
+    return results_df.astype({'total_exons_in_transcript': 'Int32'})
+
+
+class AnnotatedSiteWriter:
+    """
+    Write batches of annotated sites to _exon_annotated.tab and/or .parquet.
+
+    The TSV header is written with the first batch and later batches are
+    appended. Each batch is formatted with tab_annotation, as the whole-file
+    output is, so streamed and whole-file tables are the same.
+    """
+
+    def __init__(self, tab_file=None, parquet_file=None):
+        self.tab_file = tab_file
+        self.parquet = ParquetBatchWriter(parquet_file) if parquet_file else None
+        self.rows = 0
+        self.batches = 0
+        self._handle = open(tab_file, 'w') if tab_file else None
+
+    def write(self, results_df):
+        """Append one batch of annotate_methylated_sites output."""
+        if self._handle is not None:
+            tab_annotation(results_df).to_csv(self._handle, index=False, sep="\t",
+                                              header=self.batches == 0)
+        if self.parquet is not None:
+            self.parquet.write(results_df)
+        self.rows += len(results_df)
+        self.batches += 1
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            print(f"Results saved to {self.tab_file}")
+        if self.parquet is not None:
+            self.parquet.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+        return False
+
+
+def stream_annotate(m6a_site_proba, transcript_dict, gene_exon_counts, writer,
+                    threshold=0.9, batch_size=1000000, accumulators=()):
+    """
+    Filter, annotate and write an m6anet result file one batch at a time.
+
+    Only one batch of sites is held at once, and the per-transcript counts the
+    summary and plot need are accumulated as the batches go by, so memory stays
+    flat however many sites pass the threshold.
+
+    Parameters:
+    m6a_site_proba (str): Path to the data.site_proba.csv file.
+    transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+    gene_exon_counts (dict): Maps each gene ID to its number of unique exons.
+    writer (AnnotatedSiteWriter): Receives each annotated batch.
+    threshold (float): Probability threshold to consider for methylation prediction.
+    batch_size (int): Number of CSV rows read per batch.
+    accumulators (list): Further objects whose add() receives each annotated batch,
+                         e.g. a MetageneAccumulator.
+
+    Returns:
+    tuple: The SiteCountAccumulator of the written sites and the number of sites.
+    """
+    counts = SiteCountAccumulator()
+    n_sites = 0
+    for sites in iter_methylated_sites(m6a_site_proba, threshold, chunksize=batch_size):
+        if not len(sites) and writer.batches:
+            # Empty batches are only needed to write the header
+            continue
+        results_df = annotate_methylated_sites(sites, transcript_dict, gene_exon_counts)
+        writer.write(results_df)
+        counts.add(results_df)
+        for accumulator in accumulators:
+            accumulator.add(results_df)
+        n_sites += len(results_df)
+    return counts, n_sites
@@ -1,5 +1,80 @@
+import numpy as np
 import pandas as pd
-from scipy.stats import chi2_contingency
+
+
+def site_category_flags(results_df):
+    """
+    Flag each annotated site as a non-last exon, last exon or UTR site.
+
+    Parameters:
+    results_df (DataFrame): DataFrame containing the methylation site annotations.
+
+    Returns:
+    DataFrame: int64 columns non_last_exon_sites, last_exon_sites and utr_sites,
+               holding 1 where the site is in that category.
+    """
+    is_utr = (results_df['exon_number'] == 'UTR').to_numpy()
+    is_last = (results_df['is_last_exon'] == True).to_numpy()
+    return pd.DataFrame({
+        'non_last_exon_sites': (~is_utr & ~is_last).astype(np.int64),
+        'last_exon_sites': is_last.astype(np.int64),
+        'utr_sites': is_utr.astype(np.int64)
+    }, index=results_df.index)
+
+
+def count_sites_per_transcript(results_df):
+    """
+    Count the sites in each category for every transcript with one groupby-sum.
+
+    Parameters:
+    results_df (DataFrame): DataFrame containing the methylation site annotations.
+
+    Returns:
+    DataFrame: transcript_id, total_sites, non_last_exon_sites, last_exon_sites and
+               utr_sites, one row per transcript sorted by transcript ID.
+    """
+    flags = site_category_flags(results_df)
+    grouped = flags.groupby(results_df['transcript_id'].to_numpy(), sort=True)
+    summary = grouped.sum()
+    summary.insert(0, 'total_sites', grouped.size().astype(np.int64))
+    summary.index.name = 'transcript_id'
+    return summary.reset_index()
+
+
+class SiteCountAccumulator:
+    """
+    Running per-transcript site category counts, built up one batch at a time.
+
+    Memory grows with the number of transcripts, not the number of sites, so
+    the summary and plot can be produced while sites are streamed to disk.
+    """
+
+    def __init__(self):
+        self.counts = None
+
+    def add(self, results_df):
+        """Add the counts of a batch of annotated sites."""
+        batch = count_sites_per_transcript(results_df).set_index('transcript_id')
+        if self.counts is None:
+            self.counts = batch
+        else:
+            self.counts = self.counts.add(batch, fill_value=0).astype(np.int64)
+
+    def per_transcript(self):
+        """The counts in the layout of count_sites_per_transcript."""
+        if self.counts is None:
+            return count_sites_per_transcript(pd.DataFrame({
+                'transcript_id': [], 'exon_number': [], 'is_last_exon': []}))
+        return self.counts.sort_index().reset_index()
+
+    def category_counts(self):
+        """Total sites per category, as used by the distribution plot."""
+        summary = self.per_transcript()
+        return {
+            'non_last_exon': int(summary['non_last_exon_sites'].sum()),
+            'last_exon': int(summary['last_exon_sites'].sum()),
+            'UTR': int(summary['utr_sites'].sum())
+        }
 
 
 def summarize_methylation_sites(results_df, output_file):
@@ -8,16 +83,26 @@ def summarize_methylation_sites(results_df, output_file):
 
     Parameters:
     results_df (DataFrame): DataFrame containing the methylation site annotations.
-    output_file (str): Path to the output file for the summary.
+    output_file (str): Path to the output file for the summary. None skips writing it.
+
+    Returns:
+    DataFrame: The summary, one row per transcript plus the Overall row.
+    """
+    # Summarize the data: flag each site's category once, then sum per transcript
+    return summarize_site_counts(count_sites_per_transcript(results_df), output_file)
+
+
+def summarize_site_counts(summary, output_file):
     """
-    # Summarize the data
-    summary = results_df.groupby('transcript_id').apply(lambda df: pd.Series({
-        'total_sites': len(df),
-        'non_last_exon_sites': len(df[(df['exon_number'] != 'UTR') & (df['is_last_exon'] == False)]),
-        'last_exon_sites': len(df[df['is_last_exon'] == True]),
-        'utr_sites': len(df[df['exon_number'] == 'UTR'])
-    })).reset_index()
+    Add the Overall row and chi-squared test to per-transcript site counts and write them.
+
+    Parameters:
+    summary (DataFrame): Output of count_sites_per_transcript or SiteCountAccumulator.per_transcript.
+    output_file (str): Path to the output file for the summary. None skips writing it.
 
+    Returns:
+    DataFrame: The summary, one row per transcript plus the Overall row.
+    """
     # Statistical comparison: Chi-squared test
     total_sites = summary['total_sites'].sum()
     non_last_exon_sites = summary['non_last_exon_sites'].sum()
@@ -29,6 +114,7 @@ def summarize_methylation_sites(results_df, output_file):
         [total_sites - non_last_exon_sites, total_sites - last_exon_sites, total_sites - utr_sites]
     ]
 
+    from scipy.stats import chi2_contingency
     chi2, p, _, _ = chi2_contingency(contingency_table)
 
     # Add statistical test results to the summary
@@ -38,7 +124,9 @@ def summarize_methylation_sites(results_df, output_file):
     summary['p_value'] = p
 
     # Write summary to a file
-    summary.to_csv(output_file, index=False, sep="\t")
-    print(f"Summary saved to {output_file}")
+    if output_file is not None:
+        summary.to_csv(output_file, index=False, sep="\t")
+        print(f"Summary saved to {output_file}")
+    return summary
 
 
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# threshold_sweep.py
+
+import numpy as np
+import pandas as pd
+from interogate.summary_stats import site_category_flags
+
+SWEEP_COLUMNS = ['threshold', 'total_sites', 'transcripts', 'non_last_exon_sites',
+                 'last_exon_sites', 'utr_sites', 'chi2', 'p_value']
+
+
+def parse_thresholds(text):
+    """
+    Parse a comma separated list of thresholds, e.g. "0.5,0.7,0.9".
+
+    Parameters:
+    text (str): The thresholds.
+
+    Returns:
+    list: Sorted, distinct thresholds as floats.
+    """
+    try:
+        thresholds = sorted({float(value) for value in text.split(',') if value.strip()})
+    except ValueError:
+        raise ValueError(f"Thresholds must be a comma separated list of numbers: {text}")
+    if not thresholds or not all(0 <= threshold <= 1 for threshold in thresholds):
+        raise ValueError(f"Thresholds must be between 0 and 1: {text}")
+    return thresholds
+
+
+def sweep_thresholds(results_df, probabilities, thresholds, with_stats=True):
+    """
+    Count sites per category and run the chi-squared test for many thresholds at once.
+
+    Sites are sorted by probability once. For each threshold the number of sites
+    above it is found by binary search, and the category counts are read from
+    cumulative sums over the sorted sites, so the sites are annotated and counted
+    only once however many thresholds are asked for.
+
+    Parameters:
+    results_df (DataFrame): Annotated sites from annotate_methylated_sites.
+    probabilities (array-like): probability_modified of each site in results_df.
+    thresholds (list): Thresholds to report; a site counts when its probability is
+                       greater than the threshold.
+    with_stats (bool): Run the chi-squared test. When False chi2 and p_value are NaN
+                       and scipy is never imported.
+
+    Returns:
+    DataFrame: One row per threshold with the site, transcript and category
+               counts and the chi-squared statistic and p-value, using the same
+               contingency table as summarize_methylation_sites.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    flags = site_category_flags(results_df).to_numpy()
+
+    # Highest probability first, so the sites above any threshold are a prefix
+    order = np.argsort(-probabilities, kind='stable')
+    descending = probabilities[order]
+    cumulative = np.vstack([np.zeros((1, flags.shape[1]), dtype=np.int64),
+                            np.cumsum(flags[order], axis=0)])
+
+    # A transcript is counted from the first (highest probability) site it has
+    codes = pd.factorize(results_df['transcript_id'].to_numpy())[0][order]
+    first_seen = np.zeros(len(codes), dtype=np.int64)
+    if len(codes):
+        first_seen[np.unique(codes, return_index=True)[1]] = 1
+    transcripts = np.concatenate([[0], np.cumsum(first_seen)])
+
+    # Number of sites with probability > threshold, searching the ascending view
+    above = len(descending) - np.searchsorted(descending[::-1], thresholds, side='right')
+
+    if with_stats:
+        from scipy.stats import chi2_contingency
+
+    rows = []
+    for threshold, n_sites in zip(thresholds, above):
+        non_last_exon_sites, last_exon_sites, utr_sites = cumulative[n_sites]
+        chi2, p = np.nan, np.nan
+        if with_stats and n_sites > 0:
+            contingency_table = [
+                [non_last_exon_sites, last_exon_sites, utr_sites],
+                [n_sites - non_last_exon_sites, n_sites - last_exon_sites, n_sites - utr_sites]
+            ]
+            chi2, p, _, _ = chi2_contingency(contingency_table)
+        rows.append([threshold, n_sites, transcripts[n_sites], non_last_exon_sites,
+                     last_exon_sites, utr_sites, chi2, p])
+    return pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+
+
+def write_threshold_sweep(sweep_df, output_file):
+    """
+    Write the threshold sweep table as a TSV.
+
+    Parameters:
+    sweep_df (DataFrame): Output of sweep_thresholds.
+    output_file (str): Path to the output file.
+    """
+    sweep_df.to_csv(output_file, index=False, sep="\t")
+    print(f"Threshold sweep saved to {output_file}")
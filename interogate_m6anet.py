@@ -4,26 +4,32 @@
 
 import os
 import sys
-import shutil
-import errno
 import time
 import argparse
-from collections import defaultdict
+import functools
+import multiprocessing
 import logging
-import logging.handlers
-import argparse
-import matplotlib.pyplot as plt
-import pandas as pd
-from interogate.parse_gtf import parse_gff_gft
-from interogate.return_dict import generate_transcript_coordinates
-from interogate.parse_m6a_site_proba import identify_methylated_sites, query_transcript_exon
-from interogate.plot import plot_methylation_distribution
-from interogate.summary_stats import summarize_methylation_sites
-
-from scipy.stats import chi2_contingency
-
-
-print(" ...   libs loaded ...")
+import numpy as np
+from interogate.parse_gtf import iter_gff_gft
+from interogate.return_dict import generate_transcript_coordinates, COORDINATE_FEATURE_TYPES
+from interogate.index_cache import load_or_build_index
+from interogate.parse_m6a_site_proba import identify_methylated_sites
+from interogate.site_matrix import SiteMatrix
+from interogate.annotate import annotate_methylated_sites, SiteAnnotationLookup
+from interogate.plot import (plot_methylation_distribution, plot_category_counts,
+                             plot_threshold_sweep, plot_metagene)
+from interogate.metagene import (DEFAULT_METAGENE_BINS, MetageneAccumulator, metagene_positions,
+                                 metagene_bin_counts, metagene_table, write_metagene)
+from interogate.summary_stats import (count_sites_per_transcript, summarize_methylation_sites,
+                                      summarize_site_counts)
+from interogate.enrichment import NULL_MODELS, permutation_enrichment, write_enrichment
+from interogate.stream import AnnotatedSiteWriter, stream_annotate, tab_annotation
+from interogate.instrument import RunReport
+from interogate.manifest import (code_version, gtf_fingerprint_for, manifest_is_current,
+                                 write_manifest)
+from interogate.columnar import (OUTPUT_FORMATS, require_parquet_engine,
+                                 write_annotation_parquet, write_summary_parquet)
+from interogate.threshold_sweep import parse_thresholds, sweep_thresholds, write_threshold_sweep
 
 def get_args():
     parser = argparse.ArgumentParser(description="m6anet interogater:  " +
@@ -35,16 +41,21 @@ def get_args():
     optional.add_argument("--m6a", dest='m6a',
                           action="store",
                           nargs='+',  # This allows multiple arguments
-                          required=True,
-                          default=os.path.join(file_directory, "data", 
-                                               "test.site_proba.csv"),
+                          default=None,
                           type=str,
                           help="List of m6anet result files to be parsed e.g. --m6a file1.csv file2.csv file3.csv")
+
+    optional.add_argument("--site-matrix", dest='site_matrix',
+                          action="store", default=None,
+                          type=str,
+                          help="site matrix built by python -m interogate.site_matrix: read " +
+                          "the sites of the --m6a files from it instead of their CSVs. " +
+                          "Without --m6a, every sample in it is processed")
  
     optional.add_argument("--thread", dest='threads',
-                          action="store", default="1",
-                          type=str,
-                          help="number of threads: currently does nothing yet")
+                          action="store", default=1,
+                          type=int,
+                          help="number of worker processes used to process the --m6a files in parallel")
     
 
     optional.add_argument("--threshold", dest='threshold',
@@ -52,6 +63,71 @@ def get_args():
                           type=float,
                           help="theshold for m6a dat filtering. Default is recommended 0.9")
     
+    optional.add_argument("--thresholds", dest='thresholds',
+                          action="store", default=None,
+                          type=parse_thresholds,
+                          help="comma separated thresholds e.g. 0.5,0.7,0.8,0.9,0.95. " +
+                          "Annotates every site once and writes _threshold_sweep.tab " +
+                          "and _threshold_sweep.pdf instead of the single threshold outputs")
+
+    optional.add_argument("--no-plot", dest='no_plot',
+                          action="store_true", default=False,
+                          help="do not draw the pdf plots or write the metagene profile " +
+                          "(matplotlib is then never loaded)")
+
+    optional.add_argument("--metagene-bins", dest='metagene_bins',
+                          action="store", default=DEFAULT_METAGENE_BINS,
+                          type=int,
+                          help="number of bins across each of the 5'UTR, CDS and 3'UTR " +
+                          "in _metagene.tab and _metagene.pdf")
+
+    optional.add_argument("--no-stats", dest='no_stats',
+                          action="store_true", default=False,
+                          help="do not write the per transcript summary and chi-squared " +
+                          "test (scipy is then never loaded)")
+
+    optional.add_argument("--permutations", dest='permutations',
+                          action="store", default=0,
+                          type=int,
+                          help="test the enrichment of sites in last exons against the " +
+                          "other exons with this many random placements of the sites " +
+                          "within their transcripts, written to _enrichment.tab. " +
+                          "Default 0 skips the test")
+
+    optional.add_argument("--null-model", dest='null_model',
+                          action="store", default="uniform",
+                          choices=NULL_MODELS,
+                          help="where --permutations places the random sites: any exonic " +
+                          "position of the transcript (uniform) or any exonic site m6anet " +
+                          "tested on it (drach). Default is uniform")
+
+    optional.add_argument("--seed", dest='seed',
+                          action="store", default=0,
+                          type=int,
+                          help="seed of the --permutations random draws")
+
+    optional.add_argument("--output-format", dest='output_format',
+                          action="store", default="tab",
+                          choices=OUTPUT_FORMATS,
+                          help="write _exon_annotated and _summary_per_transcript as text " +
+                          "TSV (tab), typed compressed Parquet (parquet, needs pyarrow) " +
+                          "or both. Default is tab")
+
+    optional.add_argument("--batch-size", dest='batch_size',
+                          action="store", default=0,
+                          type=int,
+                          help="annotate and write the sites this many CSV rows at a " +
+                          "time, so memory stays flat on very large files. Default 0 " +
+                          "loads the whole file")
+
+    optional.add_argument("--site-dedupe", dest='site_dedupe',
+                          action="store_true", default=False,
+                          help="load the sites of all --m6a files first, annotate their " +
+                          "distinct sites once and join them back to each file. Holds " +
+                          "every file's sites in memory and loads them one after another; " +
+                          "by default each file is loaded and annotated on its own, in " +
+                          "parallel with --thread")
+
     optional.add_argument("-o", "--out", dest='out',
                           action="store",
                           default="temp.out",
@@ -65,13 +141,466 @@ def get_args():
                           type=str,
                           help="input gtf file to get the transcript coordinates")
     
+    optional.add_argument("--index-cache", dest='index_cache',
+                          action="store", default=None,
+                          type=str,
+                          help="directory to keep the binary annotation index in. " +
+                          "Default is next to the gtf file")
+
+    optional.add_argument("--no-index-cache", dest='no_index_cache',
+                          action="store_true", default=False,
+                          help="always re-parse the gtf file and do not read or write the index")
+
+    optional.add_argument("--force", dest='force',
+                          action="store_true", default=False,
+                          help="process every --m6a file, even those whose outputs are " +
+                          "up to date with their _manifest.json")
+
+    optional.add_argument("--report", dest='report',
+                          action="store", default=None,
+                          type=str,
+                          help="JSON file for the per-stage timing, row counts and peak " +
+                          "memory of the run (of the main process, and of the largest " +
+                          "--thread worker). Default is the log file name with _report.json")
+
     optional.add_argument("-l", "--logfile", dest='logfile',
                           action="store",
                           default="pipeline.log",
                           type=str,
                           help="log file name")
-    return parser.parse_args()
-    
+    args = parser.parse_args()
+    if not args.m6a and not args.site_matrix:
+        parser.error("one of --m6a or --site-matrix is required")
+    return args
+
+
+# Annotation shared with worker processes: (transcript_dict, gene_exon_counts)
+ANNOTATION = None
+
+
+def set_annotation(annotation):
+    """Make the annotation index available to process_m6a_file."""
+    global ANNOTATION
+    ANNOTATION = annotation
+
+
+# Sites of every --m6a file and the annotation of their distinct sites:
+# ({m6a_file: sites}, SiteAnnotationLookup), or None to annotate each file alone
+SHARED_SITES = None
+
+
+def set_shared_sites(shared_sites):
+    """Make the pre-loaded sites and their shared annotation available to process_m6a_file."""
+    global SHARED_SITES
+    SHARED_SITES = shared_sites
+
+
+@functools.lru_cache(maxsize=None)
+def open_site_matrix(matrix_path):
+    """Memory-map a site matrix once per process."""
+    return SiteMatrix.load(matrix_path)
+
+
+def load_sites(m6a_file, args, threshold, keep_probability=False, probability_dtype=np.float32):
+    """
+    The sites of one m6anet result file above the threshold.
+
+    They are taken from the --site-matrix when it holds the file and the file has
+    not changed since it was merged, and read from the CSV otherwise.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    args (Namespace): The parsed command line options.
+    threshold (float): Probability threshold to consider for methylation prediction.
+    keep_probability (bool): Also return the probability_modified column.
+    probability_dtype (dtype): dtype of the probability_modified column.
+
+    Returns:
+    pd.DataFrame: The same table as identify_methylated_sites.
+    """
+    if args.site_matrix:
+        matrix = open_site_matrix(args.site_matrix)
+        if matrix.has_sample(m6a_file) and matrix.is_current(m6a_file):
+            return matrix.methylated_sites(m6a_file, threshold, keep_probability, probability_dtype)
+        logging.getLogger('interogate_m6anet').info(
+            "%s is not current in the site matrix %s: reading the CSV", m6a_file, args.site_matrix)
+    return identify_methylated_sites(m6a_file, threshold, keep_probability=keep_probability,
+                                     probability_dtype=probability_dtype)
+
+
+def load_annotation(gtf, index_cache, no_index_cache):
+    """Pool initializer for spawned workers: memory-map the cached index."""
+    if no_index_cache:
+        features = iter_gff_gft(gtf, feature_types=COORDINATE_FEATURE_TYPES)
+        transcript_dict, transcript_exon_counts, gene_exon_counts, \
+            last_exon_for_transcript = generate_transcript_coordinates(features)
+    else:
+        transcript_dict, transcript_exon_counts, gene_exon_counts, \
+            last_exon_for_transcript = load_or_build_index(gtf, index_cache)
+    set_annotation((transcript_dict, gene_exon_counts))
+
+
+def output_settings(args):
+    """The command line options that change the outputs, as recorded in the manifest."""
+    return {
+        'threshold': None if args.thresholds else args.threshold,
+        'thresholds': args.thresholds,
+        'output_format': args.output_format,
+        'streamed': args.batch_size > 0,
+        'no_plot': args.no_plot,
+        'metagene_bins': None if args.no_plot or args.thresholds else args.metagene_bins,
+        'no_stats': args.no_stats,
+        'permutations': None if args.thresholds else args.permutations,
+        'null_model': None if args.thresholds or not args.permutations else args.null_model,
+        'seed': None if args.thresholds or not args.permutations else args.seed,
+    }
+
+
+def expected_outputs(m6a_file, args):
+    """
+    The files a run writes for one m6anet result file.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    args (Namespace): The parsed command line options.
+
+    Returns:
+    list: Paths of the output files.
+    """
+    output_base = os.path.splitext(m6a_file)[0]
+    if args.thresholds:
+        outputs = [f"{output_base}_threshold_sweep.tab"]
+        if not args.no_plot:
+            outputs.append(f"{output_base}_threshold_sweep.pdf")
+        return outputs
+    extensions = {'tab': ['tab'], 'parquet': ['parquet'], 'both': ['tab', 'parquet']}[args.output_format]
+    outputs = [f"{output_base}_exon_annotated.{extension}" for extension in extensions]
+    if not args.no_plot:
+        outputs += [f"{output_base}_m6a_distribution.pdf", f"{output_base}_metagene.tab",
+                    f"{output_base}_metagene.pdf"]
+    if not args.no_stats:
+        outputs += [f"{output_base}_summary_per_transcript.{extension}" for extension in extensions]
+    if args.permutations > 0:
+        outputs.append(f"{output_base}_enrichment.tab")
+    return outputs
+
+
+def process_m6a_file(m6a_file, args, manifest=None):
+    """
+    Filter, annotate, plot and summarise one m6anet result file.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    args (Namespace): The parsed command line options.
+    manifest (tuple): (gtf fingerprint, settings, code version) to record in the
+                      file's manifest once its outputs are written, or None.
+
+    Returns:
+    tuple: The m6anet result file that was processed and its stage records.
+    """
+    logger = logging.getLogger('interogate_m6anet')
+    logger.info("Starting processing: %s", m6a_file)
+    report = RunReport(logger)
+    if args.thresholds:
+        sweep_m6a_file(m6a_file, args, report)
+    elif args.batch_size > 0:
+        stream_m6a_file(m6a_file, args, report)
+    else:
+        annotate_m6a_file(m6a_file, args, report)
+    if manifest is not None:
+        write_manifest(m6a_file, *manifest, expected_outputs(m6a_file, args))
+    return m6a_file, report.stages
+
+
+def annotate_m6a_file(m6a_file, args, report):
+    """
+    Filter, annotate, plot and summarise one m6anet result file held in memory.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    args (Namespace): The parsed command line options.
+    report (RunReport): Collects the timing of each stage.
+    """
+    transcript_dict, gene_exon_counts = ANNOTATION
+    threshold = args.threshold
+
+    if SHARED_SITES is not None:
+        # The sites were loaded and annotated with the other files' sites
+        sites_by_file, site_lookup = SHARED_SITES
+        methylated_sites = sites_by_file[m6a_file]
+        with report.stage("join_site_annotation", m6a_file,
+                          rows_in=len(methylated_sites)) as stage:
+            results_df = site_lookup.annotate(methylated_sites)
+            stage.rows_out = len(results_df)
+    else:
+        with report.stage("load_sites", m6a_file) as stage:
+            methylated_sites = load_sites(m6a_file, args, threshold)
+            stage.rows_out = len(methylated_sites)
+        # print(methylated_sites)
+
+        # Determine exon/UTR location for every methylation site in one pass
+        with report.stage("annotate", m6a_file, rows_in=len(methylated_sites)) as stage:
+            results_df = annotate_methylated_sites(methylated_sites, transcript_dict,
+                                                   gene_exon_counts)
+            stage.rows_out = len(results_df)
+    # print(results_df)
+
+    # Print and save the result
+    output_base = os.path.splitext(m6a_file)[0]
+    with report.stage("write_annotation", m6a_file, rows_in=len(results_df)):
+        if args.output_format in ('tab', 'both'):
+            output_file = f"{output_base}_exon_annotated.tab"
+            tab_annotation(results_df).to_csv(output_file, index=False, sep="\t")
+            print(f"Results saved to {output_file}")
+        if args.output_format in ('parquet', 'both'):
+            write_annotation_parquet(results_df, f"{output_base}_exon_annotated.parquet")
+
+
+    # plot out the data usage
+    if not args.no_plot:
+        output_plot = f"{os.path.splitext(m6a_file)[0]}_m6a_distribution.pdf"
+        with report.stage("plot", m6a_file, rows_in=len(results_df)):
+            plot_methylation_distribution(results_df, output_plot)
+
+        # metagene profile of where the sites fall along the 5'UTR, CDS and 3'UTR
+        with report.stage("metagene", m6a_file, rows_in=len(results_df)) as stage:
+            metagene = metagene_positions(results_df, transcript_dict)
+            metagene_df = metagene_table(metagene_bin_counts(metagene, args.metagene_bins))
+            stage.rows_out = int(metagene_df['sites'].sum())
+            write_metagene(metagene_df, f"{output_base}_metagene.tab")
+            plot_metagene(metagene_df, f"{output_base}_metagene.pdf")
+
+    # write out a summary per transcript usage
+    if not args.no_stats:
+        output_summary = None
+        if args.output_format in ('tab', 'both'):
+            output_summary = f"{output_base}_summary_per_transcript.tab"
+        with report.stage("summary_chi2", m6a_file, rows_in=len(results_df)):
+            summary = summarize_methylation_sites(results_df, output_summary)
+            if args.output_format in ('parquet', 'both'):
+                write_summary_parquet(summary, f"{output_base}_summary_per_transcript.parquet")
+
+    if args.permutations > 0:
+        enrichment_m6a_file(m6a_file, args, count_sites_per_transcript(results_df), report)
+
+
+def stream_m6a_file(m6a_file, args, report):
+    """
+    Filter, annotate and write one m6anet result file in batches of args.batch_size rows.
+
+    The plot and summary are drawn from counts accumulated per transcript while
+    the batches are written, so the annotated sites are never all in memory.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    args (Namespace): The parsed command line options.
+    report (RunReport): Collects the timing of each stage.
+    """
+    transcript_dict, gene_exon_counts = ANNOTATION
+    output_base = os.path.splitext(m6a_file)[0]
+    tab_file = parquet_file = None
+    if args.output_format in ('tab', 'both'):
+        tab_file = f"{output_base}_exon_annotated.tab"
+    if args.output_format in ('parquet', 'both'):
+        parquet_file = f"{output_base}_exon_annotated.parquet"
+
+    metagene = MetageneAccumulator(transcript_dict, args.metagene_bins)
+    with report.stage("stream_annotate", m6a_file) as stage:
+        with AnnotatedSiteWriter(tab_file, parquet_file) as writer:
+            counts, stage.rows_out = stream_annotate(
+                m6a_file, transcript_dict, gene_exon_counts, writer, args.threshold,
+                args.batch_size, accumulators=[] if args.no_plot else [metagene])
+
+    if not args.no_plot:
+        output_plot = f"{output_base}_m6a_distribution.pdf"
+        with report.stage("plot", m6a_file):
+            plot_category_counts(counts.category_counts(), output_plot)
+        with report.stage("metagene", m6a_file):
+            write_metagene(metagene.table(), f"{output_base}_metagene.tab")
+            plot_metagene(metagene.table(), f"{output_base}_metagene.pdf")
+
+    if not args.no_stats:
+        output_summary = tab_file and f"{output_base}_summary_per_transcript.tab"
+        with report.stage("summary_chi2", m6a_file) as stage:
+            summary = summarize_site_counts(counts.per_transcript(), output_summary)
+            stage.rows_out = len(summary)
+            if parquet_file:
+                write_summary_parquet(summary, f"{output_base}_summary_per_transcript.parquet")
+
+    if args.permutations > 0:
+        enrichment_m6a_file(m6a_file, args, counts.per_transcript(), report)
+
+
+def enrichment_m6a_file(m6a_file, args, per_transcript, report):
+    """
+    Permutation test of where one file's sites fall, written to _enrichment.tab.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    args (Namespace): The parsed command line options.
+    per_transcript (DataFrame): The file's site counts per transcript.
+    report (RunReport): Collects the timing of each stage.
+    """
+    transcript_dict, gene_exon_counts = ANNOTATION
+    tested_sites = None
+    if args.null_model == 'drach':
+        # Every site m6anet scored, whatever its probability
+        tested_sites = load_sites(m6a_file, args, -np.inf)
+    # Files processed in a pool's workers cannot start a pool of their own
+    threads = 1 if multiprocessing.current_process().daemon else max(1, args.threads)
+    with report.stage("enrichment", m6a_file,
+                      rows_in=int(per_transcript['total_sites'].sum())) as stage:
+        enrichment_df = permutation_enrichment(per_transcript, transcript_dict, args.null_model,
+                                               tested_sites, args.permutations, threads, args.seed)
+        stage.rows_out = args.permutations
+    write_enrichment(enrichment_df, f"{os.path.splitext(m6a_file)[0]}_enrichment.tab")
+
+
+def sweep_m6a_file(m6a_file, args, report):
+    """
+    Annotate one m6anet result file once and report on many thresholds.
+
+    Parameters:
+    m6a_file (str): Path to the data.site_proba.csv file.
+    args (Namespace): The parsed command line options; args.thresholds are the
+                      sorted probability thresholds to report.
+    report (RunReport): Collects the timing of each stage.
+    """
+    transcript_dict, gene_exon_counts = ANNOTATION
+    thresholds = args.thresholds
+
+    # Keep every site above the lowest threshold, with exact probabilities
+    with report.stage("load_sites", m6a_file) as stage:
+        methylated_sites = load_sites(m6a_file, args, thresholds[0], keep_probability=True,
+                                      probability_dtype=np.float64)
+        stage.rows_out = len(methylated_sites)
+    with report.stage("annotate", m6a_file, rows_in=len(methylated_sites)) as stage:
+        results_df = annotate_methylated_sites(methylated_sites, transcript_dict,
+                                               gene_exon_counts)
+        stage.rows_out = len(results_df)
+    with report.stage("threshold_sweep", m6a_file, rows_in=len(results_df)) as stage:
+        sweep_df = sweep_thresholds(results_df, methylated_sites['probability_modified'],
+                                    thresholds, with_stats=not args.no_stats)
+        stage.rows_out = len(sweep_df)
+
+    output_sweep = f"{os.path.splitext(m6a_file)[0]}_threshold_sweep.tab"
+    write_threshold_sweep(sweep_df, output_sweep)
+
+    if not args.no_plot:
+        output_plot = f"{os.path.splitext(m6a_file)[0]}_threshold_sweep.pdf"
+        with report.stage("plot", m6a_file, rows_in=len(sweep_df)):
+            plot_threshold_sweep(sweep_df, output_plot)
+
+
+def load_shared_sites(m6a_files, args, transcript_dict, gene_exon_counts, report):
+    """
+    Load the sites of every m6anet result file and annotate their distinct sites once.
+
+    Replicates share most (transcript_id, transcript_position) sites, so the exon
+    lookups grow with the number of distinct sites rather than sites times files.
+
+    Parameters:
+    m6a_files (list): Paths to the data.site_proba.csv files.
+    args (Namespace): The parsed command line options.
+    transcript_dict (TranscriptExonIndex): Index of the exons of each transcript.
+    gene_exon_counts (dict): Maps each gene ID to its number of unique exons.
+    report (RunReport): Collects the timing of each stage.
+
+    Returns:
+    tuple: {m6a_file: sites} and the SiteAnnotationLookup of all their sites.
+    """
+    sites_by_file = {}
+    for m6a_file in m6a_files:
+        if m6a_file in sites_by_file:
+            continue
+        with report.stage("load_sites", m6a_file) as stage:
+            sites_by_file[m6a_file] = load_sites(m6a_file, args, args.threshold)
+            stage.rows_out = len(sites_by_file[m6a_file])
+    total_sites = sum(len(sites) for sites in sites_by_file.values())
+    with report.stage("annotate_distinct_sites", rows_in=total_sites) as stage:
+        site_lookup = SiteAnnotationLookup.from_samples(sites_by_file.values(), transcript_dict,
+                                                        gene_exon_counts)
+        stage.rows_out = len(site_lookup)
+    logging.getLogger('interogate_m6anet').info(
+        "Annotated %d distinct sites for %d sites in %d files",
+        len(site_lookup), total_sites, len(sites_by_file))
+    return sites_by_file, site_lookup
+
+
+def process_m6a_file_task(task):
+    """Unpack a (m6a_file, args, manifest) task for Pool.imap_unordered."""
+    return process_m6a_file(*task)
+
+
+def process_m6a_files(m6a_files, args, manifest, report):
+    """
+    Load the annotation index and process the m6anet result files.
+
+    Parameters:
+    m6a_files (list): Paths to the data.site_proba.csv files to process.
+    args (Namespace): The parsed command line options.
+    manifest (tuple): (gtf fingerprint, settings, code version) for the manifests.
+    report (RunReport): Collects the timing of each stage.
+    """
+    logger = logging.getLogger('interogate_m6anet')
+
+    # Load the annotation index for the GTF file, or stream its exon records
+    # into the transcript coordinates
+    # (parsing is streamed into the coordinate builder, so they are one stage)
+    file_path = args.gtf
+    if args.no_index_cache:
+        with report.stage("parse_gtf_and_build_coordinates", file_path) as stage:
+            features = iter_gff_gft(file_path, feature_types=COORDINATE_FEATURE_TYPES)
+            transcript_dict, transcript_exon_counts, gene_exon_counts, \
+                 last_exon_for_transcript = generate_transcript_coordinates(features)
+            stage.rows_out = len(transcript_dict.exon_starts)
+    else:
+        with report.stage("load_or_build_index", file_path) as stage:
+            transcript_dict, transcript_exon_counts, gene_exon_counts, \
+                 last_exon_for_transcript = load_or_build_index(file_path, args.index_cache)
+            stage.rows_out = len(transcript_dict.exon_starts)
+
+    #with open(args.out, 'w') as out_file:
+    #    for transcript, exons in transcript_dict.items():
+    #        for exon, coordinates in exons.items():
+    #            out_data = f'{transcript} exon {exon}: {coordinates}'
+    #            out_file.write(out_data + '\n')
+    #            print(out_data)
+
+    # Process each m6A result file, in a pool of worker processes if asked to.
+    # Workers see the annotation index through the module global: inherited on
+    # fork, or memory-mapped from the index cache by each spawned worker.
+    set_annotation((transcript_dict, gene_exon_counts))
+    threads = max(1, args.threads)
+    can_fork = 'fork' in multiprocessing.get_all_start_methods()
+
+    # Replicate files share most sites: with --site-dedupe, annotate the distinct
+    # ones once. Spawned workers cannot see the shared sites, so they annotate
+    # their own file.
+    if (len(m6a_files) > 1 and not args.thresholds and args.batch_size <= 0
+            and args.site_dedupe and (threads == 1 or can_fork)):
+        set_shared_sites(load_shared_sites(m6a_files, args, transcript_dict, gene_exon_counts,
+                                           report))
+
+    if threads == 1 or len(m6a_files) == 1:
+        for m6a_file in m6a_files:
+            m6a_file, stages = process_m6a_file(m6a_file, args, manifest)
+            report.extend(stages)
+    else:
+        if can_fork:
+            context = multiprocessing.get_context('fork')
+            initializer, initargs = None, ()
+        else:
+            context = multiprocessing.get_context('spawn')
+            initializer, initargs = load_annotation, (args.gtf, args.index_cache,
+                                                      args.no_index_cache)
+        with context.Pool(processes=min(threads, len(m6a_files)),
+                          initializer=initializer, initargs=initargs) as pool:
+            tasks = [(m6a_file, args, manifest) for m6a_file in m6a_files]
+            for m6a_file, stages in pool.imap_unordered(process_m6a_file_task, tasks):
+                logger.info("Finished processing: %s", m6a_file)
+                report.extend(stages)
+
 
 def main():
     args = get_args()
@@ -95,6 +624,13 @@ def main():
         logger.error(f"Could not open {args.logfile} for logging")
         sys.exit(1)
 
+    if args.output_format != 'tab':
+        try:
+            require_parquet_engine()
+        except ImportError as error:
+            logger.error(str(error))
+            sys.exit(1)
+
     # Report input arguments
     logger.info(sys.version_info)
     logger.info("Command-line: %s", ' '.join(sys.argv))
@@ -104,80 +640,30 @@ def main():
     logger.info("Starting processing: %s", args.gtf )
     file_path = args.gtf  # Replace with the path to your GFF or GTF file
 
-    # Parse GTF file and generate transcript coordinates
-    file_path = args.gtf
-    features = parse_gff_gft(file_path)
-    transcript_dict, transcript_exon_counts, gene_exon_counts, \
-         last_exon_for_transcript = generate_transcript_coordinates(features)
-    
-
+    # With only a site matrix, process every sample merged into it
+    if not args.m6a:
+        args.m6a = [sample["source"] for sample in open_site_matrix(args.site_matrix).samples]
 
-    #with open(args.out, 'w') as out_file:
-    #    for transcript, exons in transcript_dict.items():
-    #        for exon, coordinates in exons.items():
-    #            out_data = f'{transcript} exon {exon}: {coordinates}'
-    #            out_file.write(out_data + '\n')
-    #            print(out_data)
-
-   # Process each m6A result file
-    
-    for m6a_file in args.m6a:
-        logger.info("Starting processing: %s", m6a_file)
-        threshold = args.threshold
-
-        methylated_sites = identify_methylated_sites(m6a_file, threshold)
-        # print(methylated_sites)
-
-        # Determine exon/UTR location for each methylation site
-        results = []
-        for index, row in methylated_sites.iterrows():
-            transcript_id = row['transcript_id']
-            position = row['transcript_position']
-            exon_number, total_exons_in_transcript = query_transcript_exon(transcript_dict,
-                                                                            transcript_id, 
-                                                                            position)
-
-            if exon_number is not None:
-                gene_id = transcript_id.split('.')[0]
-                total_exons_in_gene = gene_exon_counts.get(gene_id, 'Unknown')
-                is_last_exon = exon_number == last_exon_for_transcript.get(transcript_id)
-                result = {
-                    'transcript_id': transcript_id,
-                    'position': position,
-                    'exon_number': exon_number,
-                    'total_exons_in_transcript': total_exons_in_transcript,
-                    'total_exons_in_gene': total_exons_in_gene,
-                    'is_last_exon': is_last_exon
-                }
+    # Only process the files whose outputs are missing or out of date with
+    # their manifest: a changed input, GTF, threshold or output option, or code
+    report = RunReport(logger)
+    with report.stage("check_manifests", args.gtf, rows_in=len(args.m6a)) as stage:
+        manifest = (gtf_fingerprint_for(args.gtf, args.m6a), output_settings(args), code_version())
+        m6a_files = []
+        for m6a_file in dict.fromkeys(args.m6a):
+            if not args.force and manifest_is_current(m6a_file, *manifest,
+                                                      expected_outputs(m6a_file, args)):
+                logger.info("Skipping %s: outputs are up to date (use --force to re-run)", m6a_file)
             else:
-                result = {
-                    'transcript_id': transcript_id,
-                    'position': position,
-                    'exon_number': 'UTR',
-                    'total_exons_in_transcript': total_exons_in_transcript,
-                    'total_exons_in_gene': 'Unknown',
-                    'is_last_exon': False
-                }
-            results.append(result)
-
-        results_df = pd.DataFrame(results)
-        # print(results_df)
-
-        # Print and save the result
-        output_file = f"{os.path.splitext(m6a_file)[0]}_exon_annotated.tab"
-        results_df.to_csv(output_file, index=False, sep="\t")
-        print(f"Results saved to {output_file}")
-
-
-        # plot out the data usage
-        output_plot = f"{os.path.splitext(m6a_file)[0]}_m6a_distribution.pdf"
-        plot_methylation_distribution(results_df, output_plot)
-
-        # write out a summary per transcript usage
-        output_summary = f"{os.path.splitext(m6a_file)[0]}_summary_per_transcript.tab"
-        summarize_methylation_sites(results_df, output_summary)
+                m6a_files.append(m6a_file)
+        stage.rows_out = len(m6a_files)
 
+    if m6a_files:
+        process_m6a_files(m6a_files, args, manifest, report)
 
+    report_file = args.report or f"{os.path.splitext(args.logfile)[0]}_report.json"
+    report.write_json(report_file, command_line=' '.join(sys.argv),
+                      gtf=args.gtf, m6a=args.m6a, threads=args.threads)
     logger.info("Processing finished: %s", time.asctime())
 
 if __name__ == '__main__':
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""Tests of the vectorized methylation site annotation"""
+
+import unittest
+import numpy as np
+import pandas as pd
+from interogate.parse_gtf import parse_gff_gft
+from interogate.return_dict import generate_transcript_coordinates, query_transcript_exon
+from interogate.annotate import annotate_methylated_sites, DISTANCE_COLUMNS, SiteAnnotationLookup
+
+
+def annotate_row_by_row(methylated_sites, transcript_dict, gene_exon_counts, last_exon_for_transcript):
+    """The per-row annotation loop that main() used before the batch API."""
+    results = []
+    for index, row in methylated_sites.iterrows():
+        transcript_id = row['transcript_id']
+        position = row['transcript_position']
+        exon_number, total_exons_in_transcript = query_transcript_exon(transcript_dict,
+                                                                       transcript_id,
+                                                                       position)
+        if exon_number is not None:
+            gene_id = transcript_id.split('.')[0]
+            results.append({
+                'transcript_id': transcript_id,
+                'position': position,
+                'exon_number': exon_number,
+                'total_exons_in_transcript': total_exons_in_transcript,
+                'total_exons_in_gene': gene_exon_counts.get(gene_id, 'Unknown'),
+                'is_last_exon': exon_number == last_exon_for_transcript.get(transcript_id)
+            })
+        else:
+            results.append({
+                'transcript_id': transcript_id,
+                'position': position,
+                'exon_number': 'UTR',
+                'total_exons_in_transcript': total_exons_in_transcript,
+                'total_exons_in_gene': 'Unknown',
+                'is_last_exon': False
+            })
+    return pd.DataFrame(results)
+
+
+class TestAnnotateMethylatedSites(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        features = parse_gff_gft('data/test.gtf')
+        cls.transcript_dict, _, cls.gene_exon_counts, \
+            cls.last_exon_for_transcript = generate_transcript_coordinates(features)
+        cls.sites = pd.read_csv('data/test.data.site_proba.csv')[['transcript_id', 'transcript_position']]
+
+    def assert_same_output(self, sites):
+        expected = annotate_row_by_row(sites, self.transcript_dict, self.gene_exon_counts,
+                                       self.last_exon_for_transcript)
+        result = annotate_methylated_sites(sites, self.transcript_dict, self.gene_exon_counts)
+        # The row loop predates the region and distance columns
+        result = result.drop(columns=['region'] + DISTANCE_COLUMNS)
+        self.assertEqual(result.to_csv(index=False, sep="\t"), expected.to_csv(index=False, sep="\t"))
+
+    def test_all_sites(self):
+        """Mixed exon and UTR sites give the same table as the row loop"""
+        self.assert_same_output(self.sites)
+
+    def test_exon_sites_only(self):
+        """Sites that are all in exons keep integer columns"""
+        sites = self.sites[self.sites['transcript_id'] == 'AT1G01100.2']
+        self.assert_same_output(sites)
+        result = annotate_methylated_sites(sites, self.transcript_dict, self.gene_exon_counts)
+        self.assertEqual(result['exon_number'].tolist(), [10, 10, 10, 7, 7, 7, 7])
+        self.assertEqual(result['is_last_exon'].tolist(), [True, True, True, False, False, False, False])
+
+    def test_regions(self):
+        """Sites are placed in the UTR and CDS records of their transcript"""
+        sites = pd.DataFrame({'transcript_id': ['AT1G01100.2'] * 5 + ['TEST.1', 'NOPE.1'],
+                              'transcript_position': [1, 375, 376, 714, 808, 5, 5]})
+        result = annotate_methylated_sites(sites, self.transcript_dict, self.gene_exon_counts)
+        self.assertEqual(result['region'].tolist(),
+                         ['three_prime_UTR', 'three_prime_UTR', 'CDS', 'CDS', 'five_prime_UTR',
+                          'unannotated', 'unannotated'])
+
+    def test_distances(self):
+        """Junction and stop codon distances are read 5' to 3' on the minus strand"""
+        # AT1G01100.2 is on the minus strand: exons 1-429, 430-642, 643-723, 724-808
+        # and CDS 376-714, so its stop codon ends at position 376
+        sites = pd.DataFrame({'transcript_id': ['AT1G01100.2'] * 5 + ['NOPE.1'],
+                              'transcript_position': [1, 375, 714, 808, 900, 5]})
+        result = annotate_methylated_sites(sites, self.transcript_dict, self.gene_exon_counts)
+        np.testing.assert_array_equal(result['distance_upstream_junction'],
+                                      [429, 55, 10, np.nan, np.nan, np.nan])
+        np.testing.assert_array_equal(result['distance_downstream_junction'],
+                                      [np.nan, np.nan, 72, 85, np.nan, np.nan])
+        np.testing.assert_array_equal(result['distance_stop_codon'],
+                                      [375, 1, -338, -432, np.nan, np.nan])
+
+    def test_unknown_transcript(self):
+        """Sites on transcripts missing from the GTF are UTR"""
+        sites = pd.DataFrame({'transcript_id': ['AT1G01090.1', 'TEST.1'],
+                              'transcript_position': [278, 5]})
+        self.assert_same_output(sites)
+
+
+class TestSiteAnnotationLookup(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        features = parse_gff_gft('data/test.gtf')
+        cls.transcript_dict, _, cls.gene_exon_counts, _ = generate_transcript_coordinates(features)
+        cls.sites = pd.read_csv('data/test.data.site_proba.csv')[['transcript_id', 'transcript_position']]
+
+    def test_replicates_annotated_once(self):
+        """Overlapping samples are annotated once and joined back unchanged"""
+        samples = [self.sites, self.sites.iloc[::2],
+                   self.sites[self.sites['transcript_id'] == 'AT1G01100.2'],
+                   pd.DataFrame({'transcript_id': ['TEST.1'], 'transcript_position': [5]})]
+        lookup = SiteAnnotationLookup.from_samples(samples, self.transcript_dict,
+                                                   self.gene_exon_counts)
+        self.assertEqual(len(lookup), len(pd.concat(samples).drop_duplicates()))
+        for sites in samples:
+            pd.testing.assert_frame_equal(
+                lookup.annotate(sites),
+                annotate_methylated_sites(sites, self.transcript_dict, self.gene_exon_counts))
+
+    def test_site_not_in_lookup(self):
+        """Sites that were not collected raise KeyError"""
+        lookup = SiteAnnotationLookup.from_samples([self.sites.iloc[:3]], self.transcript_dict,
+                                                   self.gene_exon_counts)
+        with self.assertRaises(KeyError):
+            lookup.annotate(self.sites.iloc[:4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""Tests of the typed columnar (Parquet) output"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from interogate.index_cache import build_index
+from interogate.annotate import annotate_methylated_sites
+from interogate.columnar import typed_annotation, write_annotation_parquet
+
+try:
+    import pyarrow  # noqa: F401
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+
+class TestTypedAnnotation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        transcript_dict, _, gene_exon_counts, _ = build_index('data/test.gtf')
+        sites = pd.read_csv('data/test.data.site_proba.csv')
+        cls.results_df = annotate_methylated_sites(sites, transcript_dict, gene_exon_counts)
+
+    def test_typed_columns(self):
+        """Sites outside exons have a missing exon number and an unannotated region"""
+        typed = typed_annotation(self.results_df)
+        self.assertEqual(str(typed['exon_number'].dtype), 'Int32')
+        self.assertEqual(str(typed['total_exons_in_gene'].dtype), 'Int32')
+        self.assertEqual(typed['is_last_exon'].dtype, bool)
+        self.assertEqual(list(typed['region'].cat.categories),
+                         ['unannotated', 'five_prime_UTR', 'CDS', 'three_prime_UTR', 'intron_retained'])
+
+        is_utr = (self.results_df['exon_number'] == 'UTR').to_numpy()
+        self.assertTrue(typed['exon_number'][is_utr].isna().all())
+        self.assertTrue((typed['region'][is_utr] == 'unannotated').all())
+        self.assertEqual(typed['region'].astype(str).tolist(), self.results_df['region'].tolist())
+        self.assertEqual(typed['exon_number'][~is_utr].astype(int).tolist(),
+                         self.results_df['exon_number'][~is_utr].astype(int).tolist())
+
+    @unittest.skipUnless(HAVE_PYARROW, "pyarrow is not installed")
+    def test_parquet_round_trip(self):
+        """The Parquet file keeps the types and can be read column by column"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            output_file = os.path.join(temp_dir, 'sample_exon_annotated.parquet')
+            write_annotation_parquet(self.results_df, output_file)
+            typed = pd.read_parquet(output_file)
+            region = pd.read_parquet(output_file, columns=['region'])
+        finally:
+            shutil.rmtree(temp_dir)
+        pd.testing.assert_frame_equal(typed, typed_annotation(self.results_df))
+        self.assertEqual(list(region.columns), ['region'])
+
+
+if __name__ == '__main__':
+    unittest.main()
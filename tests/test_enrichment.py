@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Tests of the permutation test of site category enrichment"""
+
+import unittest
+import numpy as np
+import pandas as pd
+from interogate.annotate import annotate_methylated_sites
+from interogate.enrichment import (TESTED_CATEGORIES, CandidatePositions, classify_positions,
+                                   permutation_enrichment)
+from interogate.exon_index import TranscriptExonIndex
+from interogate.parse_gtf import iter_gff_gft
+from interogate.parse_m6a_site_proba import identify_methylated_sites
+from interogate.return_dict import generate_transcript_coordinates, COORDINATE_FEATURE_TYPES
+from interogate.summary_stats import count_sites_per_transcript
+
+
+class TestEnrichment(unittest.TestCase):
+
+    def setUp(self):
+        # T.1 is 100 positions of exon 1 and 300 of its last exon; T.2 has a
+        # 50 position gap between its exons. T.1's UTR site and NOT.1 are left out
+        self.index = TranscriptExonIndex.from_exon_intervals({
+            "T.1": {1: (1, 100), 2: (101, 400)},
+            "T.2": {1: (1, 50), 2: (101, 200)},
+        })
+        self.per_transcript = pd.DataFrame({
+            'transcript_id': ['T.1', 'T.2', 'NOT.1'],
+            'total_sites': [41, 10, 5],
+            'non_last_exon_sites': [0, 0, 5],
+            'last_exon_sites': [40, 10, 0],
+            'utr_sites': [1, 0, 0]})
+
+    def test_classification_matches_annotation(self):
+        """Positions are put in the same category as annotated sites"""
+        features = iter_gff_gft('data/test.gtf', feature_types=COORDINATE_FEATURE_TYPES)
+        transcript_dict, _, gene_exon_counts, _ = generate_transcript_coordinates(features)
+        sites = identify_methylated_sites('data/test.data.site_proba.csv', 0.0)
+        results_df = annotate_methylated_sites(sites, transcript_dict, gene_exon_counts)
+        known = results_df['total_exons_in_transcript'].notna().to_numpy()
+        rows = transcript_dict.rows_for(results_df['transcript_id'].to_numpy(dtype=object))
+        codes = classify_positions(transcript_dict, rows[known], results_df['position'][known])
+        expected = np.where(results_df['exon_number'] == 'UTR', 2,
+                            np.where(results_df['is_last_exon'] == True, 1, 0))[known]
+        np.testing.assert_array_equal(codes, expected)
+
+    def test_uniform_candidates(self):
+        """Every position of each transcript is a candidate, gaps included"""
+        candidates = CandidatePositions.uniform(self.index, np.array([0, 1]), block_positions=7)
+        np.testing.assert_array_equal(candidates.offsets, [0, 400, 600])
+        np.testing.assert_array_equal(np.bincount(candidates.codes[:400], minlength=3), [100, 300, 0])
+        np.testing.assert_array_equal(np.bincount(candidates.codes[400:], minlength=3), [50, 100, 50])
+        exonic = candidates.exonic()
+        np.testing.assert_array_equal(exonic.offsets, [0, 400, 550])
+        np.testing.assert_array_equal(np.bincount(exonic.codes, minlength=3), [150, 400, 0])
+
+    def test_uniform_null(self):
+        """Expected counts follow the categories' share of each transcript's exons"""
+        enrichment = permutation_enrichment(self.per_transcript, self.index, n_permutations=2000,
+                                            seed=1).set_index('category')
+        self.assertEqual(enrichment.index.tolist(), TESTED_CATEGORIES)
+        self.assertEqual(enrichment['sites'].iloc[0], 50)
+        self.assertEqual(enrichment['excluded_sites'].iloc[0], 6)
+        np.testing.assert_array_equal(enrichment['observed'], [0, 50])
+        np.testing.assert_allclose(enrichment['expected'], [10 + 10 / 3, 30 + 20 / 3], rtol=0.05)
+        self.assertTrue(np.isfinite(enrichment['z_score']).all())
+        self.assertEqual(enrichment.at['last_exon', 'p_enriched'], 1 / 2001)
+        self.assertEqual(enrichment.at['non_last_exon', 'p_depleted'], 1 / 2001)
+
+    def test_threads_and_seed(self):
+        """The draws depend on the seed but not on the number of workers"""
+        serial = permutation_enrichment(self.per_transcript, self.index, n_permutations=250, seed=4)
+        parallel = permutation_enrichment(self.per_transcript, self.index, n_permutations=250,
+                                          threads=3, seed=4)
+        pd.testing.assert_frame_equal(parallel, serial)
+        other = permutation_enrichment(self.per_transcript, self.index, n_permutations=250, seed=5)
+        self.assertFalse(np.array_equal(other['expected'], serial['expected']))
+
+    def test_drach_null(self):
+        """Sites drawn from the tested sites alone keep to the tested sites' categories"""
+        # T.2's site at 75 is outside its exons, so it is not a candidate
+        tested_sites = pd.DataFrame({'transcript_id': ['T.1', 'T.1', 'T.2', 'T.2', 'T.2', 'NOT.1'],
+                                     'transcript_position': [150, 150, 120, 180, 75, 3]})
+        enrichment = permutation_enrichment(self.per_transcript, self.index, 'drach', tested_sites,
+                                            n_permutations=100)
+        np.testing.assert_array_equal(enrichment['expected'], enrichment['observed'])
+        np.testing.assert_array_equal(enrichment['p_two_sided'], 1.0)
+        with self.assertRaises(ValueError):
+            permutation_enrichment(self.per_transcript, self.index, 'drach')
+        with self.assertRaises(ValueError):
+            permutation_enrichment(self.per_transcript, self.index, 'shuffle')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""Tests of the interval-based transcript exon index"""
+
+import unittest
+from interogate.parse_gtf import parse_gff_gft
+import numpy as np
+from interogate.return_dict import (generate_transcript_coordinates, query_transcript_exon,
+                                    transcript_regions)
+from interogate.exon_index import TranscriptExonIndex, REGION_CODES, REGION_LABELS
+
+
+class TestTranscriptExonIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        features = parse_gff_gft('data/test.gtf')
+        cls.transcript_dict, cls.transcript_exon_counts, cls.gene_exon_counts, \
+            cls.last_exon_for_transcript = generate_transcript_coordinates(features)
+
+    def test_returns_index(self):
+        """The transcript dict is the compact index"""
+        self.assertIsInstance(self.transcript_dict, TranscriptExonIndex)
+        self.assertIn("TEST.1", self.transcript_dict)
+        self.assertNotIn("NOT_A_TRANSCRIPT", self.transcript_dict)
+
+    def test_exon_ranges(self):
+        """TEST.1 has three 10 nt exons running on in transcript space"""
+        exons = self.transcript_dict["TEST.1"]
+        self.assertEqual(exons, {1: range(1, 11), 2: range(11, 21), 3: range(21, 31)})
+        self.assertIn(25, exons[3])
+        self.assertNotIn(31, exons[3])
+
+    def test_negative_strand_offsets(self):
+        """Exon lengths are kept on the negative strand"""
+        exons = self.transcript_dict["AT1G01020.1"]
+        self.assertEqual(exons[14], range(1, 283))
+        self.assertEqual(exons[13], range(283, 359))
+
+    def test_counts_match_dicts(self):
+        """Exon counts and last exons agree with the returned dictionaries"""
+        for transcript_id in self.transcript_dict:
+            self.assertEqual(self.transcript_dict.exon_count(transcript_id),
+                             self.transcript_exon_counts[transcript_id])
+            self.assertEqual(self.transcript_dict.last_exon(transcript_id),
+                             self.last_exon_for_transcript[transcript_id])
+
+    def test_storage_is_per_exon(self):
+        """Storage does not grow with transcript length"""
+        short = TranscriptExonIndex.from_exon_intervals({"T.1": {1: (1, 10)}})
+        long = TranscriptExonIndex.from_exon_intervals({"T.1": {1: (1, 10 ** 9)}})
+        self.assertEqual(short.nbytes, long.nbytes)
+
+    def test_duplicate_exon_number(self):
+        """A repeated exon number keeps the later interval, as the old dict did"""
+        index = TranscriptExonIndex.from_exon_intervals({"T.1": {1: (11, 20), 2: (21, 30)}})
+        self.assertEqual(index.exon_count("T.1"), 2)
+        self.assertEqual(index.last_exon("T.1"), 2)
+        self.assertEqual(index["T.1"][1], range(11, 21))
+
+    def test_find_exon_matches_linear_scan(self):
+        """Binary search agrees with scanning every exon's positions"""
+        for transcript_id in self.transcript_dict:
+            exons = self.transcript_dict[transcript_id]
+            length = max(coordinates[-1] for coordinates in exons.values())
+            for position in range(0, length + 3):
+                expected = (None, None)
+                for exon_number, coordinates in exons.items():
+                    if position in coordinates:
+                        expected = (exon_number, len(exons))
+                        break
+                self.assertEqual(query_transcript_exon(self.transcript_dict, transcript_id, position),
+                                 expected)
+
+    def test_find_exon_boundaries(self):
+        """First and last positions of an exon, and unknown transcripts"""
+        self.assertEqual(self.transcript_dict.find_exon("TEST.1", 10), (1, 3))
+        self.assertEqual(self.transcript_dict.find_exon("TEST.1", 11), (2, 3))
+        self.assertEqual(self.transcript_dict.find_exon("TEST.1", 30), (3, 3))
+        self.assertEqual(self.transcript_dict.find_exon("TEST.1", 31), (None, None))
+        self.assertEqual(self.transcript_dict.find_exon("TEST.1", 0), (None, None))
+        self.assertEqual(self.transcript_dict.find_exon("NOT_A_TRANSCRIPT", 5), (None, None))
+
+
+
+class TestRegions(unittest.TestCase):
+
+    def test_features_mapped_to_transcript_positions(self):
+        """UTR and CDS records split across exons land on the exon's transcript positions"""
+        # Exons at 100-109 and 200-209 are transcript positions 1-10 and 11-20
+        exons = [(100, 109, 1), (200, 209, 11)]
+        features = [(100, 104, REGION_CODES['five_prime_UTR']), (105, 109, REGION_CODES['CDS']),
+                    (200, 203, REGION_CODES['CDS']), (204, 209, REGION_CODES['three_prime_UTR'])]
+        self.assertEqual(transcript_regions(exons, features, []),
+                         [(1, 5, 1), (6, 10, 2), (11, 14, 2), (15, 20, 3)])
+
+    def test_intron_retained(self):
+        """Uncovered exonic stretches inside a sibling's intron are intron_retained"""
+        # One exon 100-209 retains the sibling intron 110-199; only 100-109 is CDS
+        regions = transcript_regions([(100, 209, 1)], [(100, 109, REGION_CODES['CDS'])],
+                                     [(110, 199)])
+        self.assertEqual(regions, [(1, 10, REGION_CODES['CDS']),
+                                   (11, 100, REGION_CODES['intron_retained'])])
+
+    def test_find_regions(self):
+        """Sites outside every segment, or on unknown transcripts, are unannotated"""
+        index = TranscriptExonIndex.from_exon_intervals(
+            {"A.1": {1: (1, 20)}, "B.1": {1: (1, 30)}},
+            {"A.1": [(1, 5, 1), (6, 20, 2)], "B.1": [(11, 20, 4)]}, {"A.1": "+", "B.1": "-"})
+        rows = index.rows_for(["A.1", "A.1", "A.1", "B.1", "B.1", "C.1"])
+        codes = index.find_regions_by_row(rows, [1, 6, 21, 10, 11, 5])
+        self.assertEqual([REGION_LABELS[code] for code in codes],
+                         ['five_prime_UTR', 'CDS', 'unannotated', 'unannotated',
+                          'intron_retained', 'unannotated'])
+        np.testing.assert_array_equal(index.strands, [1, -1])
+        np.testing.assert_array_equal(index.transcript_lengths(), [20, 30])
+
+    def test_distances(self):
+        """Plus strand distances to the junctions either side and to the end of the CDS"""
+        # Exons 1-10, 11-20, 21-30 with the CDS at 4-25; C.1 has one exon and no CDS
+        index = TranscriptExonIndex.from_exon_intervals(
+            {"A.1": {1: (1, 10), 2: (11, 20), 3: (21, 30)}, "C.1": {1: (1, 30)}},
+            {"A.1": [(1, 3, 1), (4, 25, 2), (26, 30, 3)]}, {"A.1": "+", "C.1": "+"})
+        rows = index.rows_for(["A.1", "A.1", "A.1", "A.1", "C.1", "A.1"])
+        positions = [1, 10, 11, 26, 5, 31]
+        upstream, downstream = index.junction_distances_by_row(rows, positions)
+        np.testing.assert_array_equal(upstream, [np.nan, np.nan, 1, 6, np.nan, np.nan])
+        np.testing.assert_array_equal(downstream, [10, 1, 10, np.nan, np.nan, np.nan])
+        found = index.find_exon_slots_by_row(rows, positions) >= 0
+        np.testing.assert_array_equal(index.stop_codon_distances_by_row(rows, positions, found),
+                                      [-24, -15, -14, 1, np.nan, np.nan])
+
+
+    def test_minus_strand_exon_order(self):
+        """Minus strand exons listed 5' to 3' (descending) give the same index as ascending"""
+        def record(feature_type, start, end, attribute):
+            return ('1', 'test', feature_type, start, end, '.', '-', '.', attribute)
+        # Exon 1 (300-309) is the 5' exon: 5'UTR 305-309, CDS 105-304, 3'UTR 100-104
+        exons = [record('exon', 100, 109, 'ID=M:exon:3;Parent=M.1'),
+                 record('exon', 200, 209, 'ID=M:exon:2;Parent=M.1'),
+                 record('exon', 300, 309, 'ID=M:exon:1;Parent=M.1')]
+        regions = [record('three_prime_UTR', 100, 104, 'Parent=M.1'),
+                   record('CDS', 105, 109, 'Parent=M.1'), record('CDS', 200, 209, 'Parent=M.1'),
+                   record('CDS', 300, 304, 'Parent=M.1'),
+                   record('five_prime_UTR', 305, 309, 'Parent=M.1')]
+        ascending = generate_transcript_coordinates(exons + regions)[0]
+        descending = generate_transcript_coordinates(exons[::-1] + regions[::-1])[0]
+
+        for index in (ascending, descending):
+            # Transcript positions run with the genomic coordinate, 3' to 5'
+            self.assertEqual(index["M.1"], {3: range(1, 11), 2: range(11, 21), 1: range(21, 31)})
+            rows = index.rows_for(["M.1"] * 4)
+            positions = [3, 8, 15, 28]
+            codes = index.find_regions_by_row(rows, positions)
+            self.assertEqual([REGION_LABELS[code] for code in codes],
+                             ['three_prime_UTR', 'CDS', 'CDS', 'five_prime_UTR'])
+            upstream, downstream = index.junction_distances_by_row(rows, positions)
+            np.testing.assert_array_equal(upstream, [8, 3, 6, np.nan])
+            np.testing.assert_array_equal(downstream, [np.nan, np.nan, 5, 8])
+            found = index.find_exon_slots_by_row(rows, positions) >= 0
+            np.testing.assert_array_equal(index.stop_codon_distances_by_row(rows, positions, found),
+                                          [3, -2, -9, -22])
+        for name in ['exon_starts', 'exon_ends', 'exon_numbers', 'region_starts', 'region_ends',
+                     'region_codes', 'strands']:
+            np.testing.assert_array_equal(getattr(descending, name), getattr(ascending, name))
+
+
+if __name__ == '__main__':
+    unittest.main()
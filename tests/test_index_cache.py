@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Tests of the on-disk annotation index cache"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from collections import defaultdict
+import numpy as np
+from interogate.index_cache import (build_index, index_is_current, index_path_for,
+                                    load_index, load_or_build_index, save_index)
+
+
+class TestIndexCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.gtf_path = os.path.join(self.temp_dir, 'test.gtf')
+        shutil.copy('data/test.gtf', self.gtf_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_round_trip(self):
+        """A saved index loads back memory-mapped with the same contents"""
+        built = build_index(self.gtf_path)
+        index_path = index_path_for(self.gtf_path)
+        save_index(index_path, self.gtf_path, built[0], built[1], built[2])
+        loaded = load_index(index_path)
+
+        self.assertIsInstance(loaded[0].exon_starts.base, np.memmap)
+        self.assertEqual(loaded[0].transcript_ids, built[0].transcript_ids)
+        for transcript_id in built[0]:
+            self.assertEqual(loaded[0][transcript_id], built[0][transcript_id])
+        self.assertEqual(loaded[1], dict(built[1]))
+        self.assertIsInstance(loaded[1], defaultdict)
+        self.assertEqual(loaded[2], built[2])
+        self.assertEqual(loaded[3], built[3])
+        for name in ['region_offsets', 'region_starts', 'region_ends', 'region_codes', 'strands']:
+            np.testing.assert_array_equal(getattr(loaded[0], name), getattr(built[0], name))
+
+    def test_load_or_build_writes_next_to_gtf(self):
+        """The first run builds the index beside the GTF and later runs reuse it"""
+        load_or_build_index(self.gtf_path)
+        index_path = self.gtf_path + '.m6aidx'
+        self.assertTrue(index_is_current(index_path, self.gtf_path))
+        loaded = load_or_build_index(self.gtf_path)
+        self.assertIsInstance(loaded[0].exon_starts.base, np.memmap)
+
+    def test_cache_dir(self):
+        """An explicit cache directory is used instead of the GTF directory"""
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+        load_or_build_index(self.gtf_path, cache_dir)
+        self.assertTrue(os.path.isdir(index_path_for(self.gtf_path, cache_dir)))
+        self.assertFalse(os.path.exists(self.gtf_path + '.m6aidx'))
+
+        # A GTF of the same name elsewhere gets its own index in the cache
+        other_gtf = os.path.join(self.temp_dir, 'other', 'test.gtf')
+        os.makedirs(os.path.dirname(other_gtf))
+        shutil.copy(self.gtf_path, other_gtf)
+        self.assertNotEqual(index_path_for(other_gtf, cache_dir),
+                            index_path_for(self.gtf_path, cache_dir))
+        load_or_build_index(other_gtf, cache_dir)
+        self.assertTrue(index_is_current(index_path_for(self.gtf_path, cache_dir), self.gtf_path))
+
+    def test_resave_keeps_loaded_version(self):
+        """Saving a new index does not delete the version a reader has loaded"""
+        built = build_index(self.gtf_path)
+        index_path = index_path_for(self.gtf_path)
+        save_index(index_path, self.gtf_path, built[0], built[1], built[2])
+        loaded = load_index(index_path)
+        loaded_version = os.path.realpath(index_path)
+        save_index(index_path, self.gtf_path, built[0], built[1], built[2])
+        self.assertTrue(os.path.islink(index_path))
+        self.assertNotEqual(os.path.realpath(index_path), loaded_version)
+        self.assertTrue(os.path.isdir(loaded_version))
+        # Arrays not yet read still come from the loaded version
+        np.testing.assert_array_equal(loaded[0].exon_ends, built[0].exon_ends)
+        self.assertTrue(index_is_current(index_path, self.gtf_path))
+
+    def test_stale_after_edit(self):
+        """Changing the GTF invalidates the index"""
+        load_or_build_index(self.gtf_path)
+        with open(self.gtf_path, 'a') as handle:
+            handle.write("1\tAraport11\texon\t41\t50\t.\t+\t.\tID=TEST:exon:4;Parent=TEST.1\n")
+        self.assertFalse(index_is_current(self.gtf_path + '.m6aidx', self.gtf_path))
+        transcript_dict = load_or_build_index(self.gtf_path)[0]
+        self.assertEqual(transcript_dict.exon_count('TEST.1'), 4)
+
+    def test_touched_gtf_is_current(self):
+        """A new mtime with unchanged content is confirmed by the hash"""
+        load_or_build_index(self.gtf_path)
+        stat = os.stat(self.gtf_path)
+        os.utime(self.gtf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertTrue(index_is_current(self.gtf_path + '.m6aidx', self.gtf_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
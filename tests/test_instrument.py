@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Tests of the per-stage timing and memory instrumentation"""
+
+import os
+import sys
+import json
+import logging
+import tempfile
+import subprocess
+import unittest
+from interogate.instrument import RunReport, current_rss_mb
+
+
+class TestRunReport(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('interogate_m6anet.test_instrument')
+        self.report = RunReport(self.logger)
+
+    def test_stage_record(self):
+        """A stage records its time, rows and memory, and logs a line"""
+        with self.assertLogs(self.logger, level='INFO') as logs:
+            with self.report.stage("annotate", "sample.csv", rows_in=10) as stage:
+                stage.rows_out = 8
+        record = self.report.stages[0]
+        self.assertEqual(record['stage'], "annotate")
+        self.assertEqual(record['file'], "sample.csv")
+        self.assertEqual((record['rows_in'], record['rows_out']), (10, 8))
+        self.assertGreaterEqual(record['peak_rss_mb'], record['start_rss_mb'])
+        self.assertFalse(record['failed'])
+        self.assertIn("Stage annotate [sample.csv]", logs.output[0])
+
+    def test_failed_stage_is_recorded(self):
+        """A stage that raises is still recorded and the error propagates"""
+        with self.assertLogs(self.logger, level='INFO'):
+            with self.assertRaises(RuntimeError):
+                with self.report.stage("plot"):
+                    raise RuntimeError("no display")
+        self.assertTrue(self.report.stages[0]['failed'])
+
+    def test_write_json(self):
+        """The run report is written as JSON with extra fields"""
+        with self.assertLogs(self.logger, level='INFO'):
+            with self.report.stage("load_sites"):
+                pass
+            handle, output_file = tempfile.mkstemp(suffix='.json')
+            os.close(handle)
+            try:
+                self.report.write_json(output_file, command_line="interogate_m6anet.py")
+                with open(output_file) as json_file:
+                    report = json.load(json_file)
+            finally:
+                os.remove(output_file)
+        self.assertEqual(report['command_line'], "interogate_m6anet.py")
+        self.assertEqual([stage['stage'] for stage in report['stages']], ["load_sites"])
+        self.assertIn('peak_rss_mb', report)
+
+    def test_children_peak_rss(self):
+        """The run report includes the peak RSS of finished child processes"""
+        # The child touches every page of 64 MB, so it is resident
+        subprocess.run([sys.executable, '-c',
+                        'data = bytearray(64 * 2 ** 20); data[::4096] = b"x" * (len(data) // 4096)'],
+                       check=True)
+        report = self.report.to_dict()
+        self.assertGreaterEqual(report['children_peak_rss_mb'], 64)
+        self.assertGreater(report['peak_rss_mb'], 0)
+
+    def test_current_rss(self):
+        """The current RSS is a positive number of MB"""
+        self.assertGreater(current_rss_mb(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
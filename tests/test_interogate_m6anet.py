@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""Tests of the interogate_m6anet.py command line"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_DIR, 'interogate_m6anet.py')
+
+
+def run_pipeline(*args):
+    """Run interogate_m6anet.py and return the completed process."""
+    return subprocess.run([sys.executable, SCRIPT] + list(args), cwd=REPO_DIR,
+                          capture_output=True, text=True)
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.m6a_file = os.path.join(self.temp_dir, 'sample.csv')
+        shutil.copy(os.path.join(REPO_DIR, 'data', 'test.data.site_proba.csv'), self.m6a_file)
+        self.logfile = os.path.join(self.temp_dir, 'pipeline.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_import_is_lazy(self):
+        """Importing the CLI does not load matplotlib or scipy"""
+        code = ("import sys, interogate_m6anet; "
+                "print('matplotlib' in sys.modules, 'scipy.stats' in sys.modules)")
+        result = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR,
+                                capture_output=True, text=True)
+        self.assertEqual(result.stdout.strip(), "False False")
+
+    def test_no_plot_no_stats(self):
+        """--no-plot and --no-stats only write the annotation"""
+        result = run_pipeline('--m6a', self.m6a_file, '--no-plot', '--no-stats',
+                              '--no-index-cache', '-l', self.logfile)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        outputs = sorted(name for name in os.listdir(self.temp_dir) if name.startswith('sample_'))
+        self.assertEqual(outputs, ['sample_exon_annotated.tab', 'sample_manifest.json'])
+
+    def test_default_outputs(self):
+        """A default run writes the annotation, plot, summary and run report"""
+        result = run_pipeline('--m6a', self.m6a_file, '--no-index-cache', '-l', self.logfile)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        for name in ['sample_exon_annotated.tab', 'sample_m6a_distribution.pdf',
+                     'sample_summary_per_transcript.tab', 'pipeline_report.json']:
+            self.assertTrue(os.path.isfile(os.path.join(self.temp_dir, name)), name)
+
+    def test_rerun_skips_up_to_date(self):
+        """A re-run skips files whose manifest matches, unless the threshold changes or --force"""
+        args = ['--m6a', self.m6a_file, '--no-plot', '--no-index-cache', '-l', self.logfile]
+        self.assertEqual(run_pipeline(*args).returncode, 0)
+        self.assertIn("Skipping", run_pipeline(*args).stderr)
+        self.assertNotIn("Skipping", run_pipeline(*args, '--force').stderr)
+        self.assertNotIn("Skipping", run_pipeline(*args, '--threshold', '0.5').stderr)
+        with open(self.m6a_file, 'a') as handle:
+            handle.write("TEST.1,10,5,0.99,GGACT,0.5\n")
+        self.assertNotIn("Skipping", run_pipeline(*args, '--threshold', '0.5').stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""Tests of the metagene profile"""
+
+import unittest
+import numpy as np
+import pandas as pd
+from interogate.exon_index import TranscriptExonIndex
+from interogate.return_dict import generate_transcript_coordinates
+from interogate.metagene import (MetageneAccumulator, metagene_bin_counts, metagene_positions,
+                                 metagene_table)
+
+
+class TestMetagene(unittest.TestCase):
+
+    def setUp(self):
+        # P.1 (plus): 5'UTR 1-10, CDS 11-30, 3'UTR 31-40; M.1 (minus) is the mirror image
+        self.index = TranscriptExonIndex.from_exon_intervals(
+            {"P.1": {1: (1, 40)}, "M.1": {1: (1, 40)}},
+            {"P.1": [(1, 10, 1), (11, 20, 2), (21, 30, 2), (31, 40, 3)],
+             "M.1": [(1, 10, 3), (11, 30, 2), (31, 40, 1)]},
+            {"P.1": "+", "M.1": "-"})
+
+    def sites(self, transcript_ids, positions, regions):
+        return pd.DataFrame({'transcript_id': transcript_ids, 'position': positions,
+                             'region': regions})
+
+    def test_positions(self):
+        """Sites are placed 5' to 3' within their region, on either strand"""
+        results_df = self.sites(['P.1', 'P.1', 'P.1', 'M.1', 'M.1', 'P.1', 'X.1'],
+                                [1, 20, 40, 40, 1, 5, 5],
+                                ['five_prime_UTR', 'CDS', 'three_prime_UTR', 'five_prime_UTR',
+                                 'three_prime_UTR', 'unannotated', 'CDS'])
+        metagene = metagene_positions(results_df, self.index)
+        np.testing.assert_allclose(metagene[:5], [0.05, 1.475, 2.95, 0.05, 2.95])
+        self.assertTrue(np.isnan(metagene[5:]).all())
+
+    def test_minus_strand_exon_order(self):
+        """A minus strand transcript is read 5' to 3' whatever order its exons are listed in"""
+        def record(feature_type, start, end, attribute):
+            return ('1', 'test', feature_type, start, end, '.', '-', '.', attribute)
+        features = [record('exon', 300, 309, 'ID=M:exon:1;Parent=M.1'),
+                    record('exon', 100, 109, 'ID=M:exon:2;Parent=M.1'),
+                    record('five_prime_UTR', 305, 309, 'Parent=M.1'),
+                    record('CDS', 105, 304, 'Parent=M.1'),
+                    record('three_prime_UTR', 100, 104, 'Parent=M.1')]
+        results_df = self.sites(['M.1', 'M.1'], [20, 1], ['five_prime_UTR', 'three_prime_UTR'])
+        for order in (features, features[1::-1] + features[2:]):
+            index = generate_transcript_coordinates(order)[0]
+            np.testing.assert_allclose(metagene_positions(results_df, index), [0.1, 2.9])
+
+    def test_table_and_accumulator(self):
+        """Bin counts are the same whole or batch by batch and sum to the profiled sites"""
+        results_df = self.sites(['P.1'] * 40, np.arange(1, 41),
+                                ['five_prime_UTR'] * 10 + ['CDS'] * 20 + ['three_prime_UTR'] * 10)
+        table = metagene_table(metagene_bin_counts(metagene_positions(results_df, self.index), 5))
+        self.assertEqual(table['sites'].tolist(), [2] * 5 + [4] * 5 + [2] * 5)
+        self.assertAlmostEqual(table['fraction'].sum(), 1.0)
+        self.assertEqual(table['region'].iloc[5], 'CDS')
+
+        accumulator = MetageneAccumulator(self.index, 5)
+        for start in range(0, 40, 7):
+            accumulator.add(results_df.iloc[start:start + 7])
+        pd.testing.assert_frame_equal(accumulator.table(), table)
+
+
+if __name__ == '__main__':
+    unittest.main()
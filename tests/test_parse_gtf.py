@@ -3,8 +3,12 @@
 """Tests of GTF parsing functionality"""
 
 import os
+import gzip
+import shutil
+import tempfile
+import types
 import unittest
-from interogate.parse_gtf import parse_gff_gft
+from interogate.parse_gtf import parse_gff_gft, iter_gff_gft
 
 class TestParseGFFGFT(unittest.TestCase):
 
@@ -34,5 +38,30 @@ class TestParseGFFGFT(unittest.TestCase):
         example_feature = ('1', 'Araport11', 'gene', 3631, 5899, '.', '+', '.', 'ID=AT1G01010;Name=AT1G01010;Note=NAC domain containing protein 1;symbol=NAC001;full_name=NAC domain containing protein 1;computational_description=NAC domain containing protein 1;locus=2200935;locus_type=protein_coding')
         self.assertIn(example_feature, features, "Example feature is not in the parsed features")
 
+    def test_iter_gff_gft_is_generator(self):
+        """The streaming parser yields the same features as parse_gff_gft"""
+        features = iter_gff_gft(self.file_path)
+        self.assertIsInstance(features, types.GeneratorType)
+        self.assertEqual(list(features), parse_gff_gft(self.file_path))
+
+
+    def test_feature_type_filter(self):
+        """Only the requested feature types are returned"""
+        exons = list(iter_gff_gft(self.file_path, feature_types={'exon'}))
+        self.assertEqual(len(exons), 58)
+        self.assertTrue(all(feature[2] == 'exon' for feature in exons))
+
+
+    def test_gzip_input(self):
+        """A gzip compressed GTF gives the same features"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            gz_path = os.path.join(temp_dir, 'test.gtf.gz')
+            with open(self.file_path, 'rb') as plain, gzip.open(gz_path, 'wb') as compressed:
+                shutil.copyfileobj(plain, compressed)
+            self.assertEqual(parse_gff_gft(gz_path), parse_gff_gft(self.file_path))
+        finally:
+            shutil.rmtree(temp_dir)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""Tests of the streaming m6anet indiv proba read counts"""
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from interogate.parse_m6a_indiv_proba import count_modified_reads
+
+
+def count_reads_in_memory(data):
+    """The whole-file groupby statistical_analysis.py used before streaming."""
+    data['is_modified'] = data['probability_modified'] >= 0.9
+    summary = data.groupby(['transcript_id', 'is_modified']).size().unstack(fill_value=0).reset_index()
+    if True not in summary.columns:
+        summary[True] = 0
+    if False not in summary.columns:
+        summary[False] = 0
+    summary = summary.rename(columns={True: 'Modified', False: 'Non-Modified'})
+    return summary[['transcript_id', 'Modified', 'Non-Modified']]
+
+
+class TestCountModifiedReads(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        n_reads = 500
+        self.data = pd.DataFrame({
+            'transcript_id': rng.choice(['AT1G01100.2', 'AT1G01090.1', 'AT1G01020.4', 'TEST.1'], n_reads),
+            'transcript_position': rng.integers(1, 2000, n_reads),
+            'read_index': np.arange(n_reads),
+            'probability_modified': rng.random(n_reads)
+        })
+        # One read exactly on the threshold counts as modified
+        self.data.loc[0, 'probability_modified'] = 0.9
+        self.temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv')
+        self.temp_file.close()
+        self.data.to_csv(self.temp_file.name, index=False)
+
+    def tearDown(self):
+        os.remove(self.temp_file.name)
+
+    def test_chunks_match_whole_file(self):
+        """Counts folded chunk by chunk equal the counts of the whole file"""
+        expected = count_reads_in_memory(pd.read_csv(self.temp_file.name))
+        for chunksize in (7, 1000):
+            result = count_modified_reads(self.temp_file.name, chunksize=chunksize)
+            self.assertEqual(result.columns.tolist(), ['transcript_id', 'Modified', 'Non-Modified'])
+            np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
+
+    def test_missing_columns(self):
+        """A file without probability_modified is rejected"""
+        self.data.drop(columns='probability_modified').to_csv(self.temp_file.name, index=False)
+        with self.assertRaises(ValueError):
+            count_modified_reads(self.temp_file.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,11 @@
 
 import os
 import unittest
+import numpy as np
 import pandas as pd
 import tempfile
 import os
-from interogate.parse_m6a_site_proba import identify_methylated_sites
+from interogate.parse_m6a_site_proba import identify_methylated_sites, iter_methylated_sites
 
 
 # 3 exon 1, last exon and UTR
@@ -56,8 +57,8 @@ AT1G01090.1,1700,290,0.9626547265052795,AAACT,0.9455555555555556"""
     def test_identify_methylated_sites(self):
         threshold = 0.9
         expected_result = pd.DataFrame({
-            'transcript_id': ['AT1G01100.2', 'AT1G01100.2', 'AT1G01090.1', 'AT1G01090.1'],
-            'transcript_position': [475, 525, 1600, 1700]
+            'transcript_id': pd.Categorical(['AT1G01100.2', 'AT1G01100.2', 'AT1G01090.1', 'AT1G01090.1']),
+            'transcript_position': np.array([475, 525, 1600, 1700], dtype=np.int32)
         })
         
         result = identify_methylated_sites(self.temp_file.name, threshold)
@@ -66,6 +67,29 @@ AT1G01090.1,1700,290,0.9626547265052795,AAACT,0.9455555555555556"""
         print(result)
 
         pd.testing.assert_frame_equal(result.reset_index(drop=True), expected_result)
+    def test_identify_methylated_sites_chunked(self):
+        """Small chunks give the same sites as reading the file at once"""
+        whole = identify_methylated_sites(self.temp_file.name, 0.5)
+        chunked = identify_methylated_sites(self.temp_file.name, 0.5, chunksize=3)
+        pd.testing.assert_frame_equal(chunked, whole)
+        self.assertEqual(len(chunked), 7)
+
+    def test_iter_methylated_sites_dtypes(self):
+        """Only the needed columns are kept, with compact dtypes"""
+        chunks = list(iter_methylated_sites(self.temp_file.name, 0.9, chunksize=5))
+        self.assertEqual(len(chunks), 4)
+        for chunk in chunks:
+            self.assertEqual(list(chunk.columns), ['transcript_id', 'transcript_position', 'probability_modified'])
+            self.assertIsInstance(chunk['transcript_id'].dtype, pd.CategoricalDtype)
+            self.assertEqual(chunk['transcript_position'].dtype, np.int32)
+            self.assertEqual(chunk['probability_modified'].dtype, np.float32)
+
+    def test_missing_columns(self):
+        """A file without the required columns is rejected"""
+        with open(self.temp_file.name, 'w') as handle:
+            handle.write("transcript_id,n_reads\nAT1G01100.2,43\n")
+        with self.assertRaises(ValueError):
+            identify_methylated_sites(self.temp_file.name)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""Tests of the annotation server and its client"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import pandas as pd
+from interogate.index_cache import build_index
+from interogate.annotate import annotate_methylated_sites
+from interogate.server import AnnotationClient, make_server
+
+
+class TestAnnotationServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.transcript_dict, _, cls.gene_exon_counts, _ = build_index('data/test.gtf')
+        cls.sites = pd.read_csv('data/test.data.site_proba.csv')[['transcript_id', 'transcript_position']]
+
+    def serve(self, **kwargs):
+        server = make_server(self.transcript_dict, self.gene_exon_counts, **kwargs)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def assert_same_as_cli(self, client, sites):
+        expected = annotate_methylated_sites(sites, self.transcript_dict, self.gene_exon_counts)
+        result = client.annotate(sites['transcript_id'].tolist(), sites['transcript_position'].tolist())
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertEqual(result.to_csv(index=False, sep="\t"), expected.to_csv(index=False, sep="\t"))
+
+    def test_tcp(self):
+        """Batches annotated over localhost HTTP match annotate_methylated_sites"""
+        server = self.serve(port=0)
+        client = AnnotationClient(port=server.server_address[1])
+        self.assertEqual(client.health()['transcripts'], len(self.transcript_dict))
+        self.assert_same_as_cli(client, self.sites)
+        self.assert_same_as_cli(client, self.sites[self.sites['transcript_id'] == 'AT1G01100.2'])
+        with self.assertRaises(ValueError):
+            client._request("POST", "/annotate", '{"transcript_id": ["A.1"]}')
+
+    def test_internal_error(self):
+        """An unexpected error is returned as a 500 with a JSON error, and the server keeps serving"""
+        server = self.serve(port=0)
+        client = AnnotationClient(port=server.server_address[1])
+        server.annotation = (self.transcript_dict, None)
+        with self.assertLogs('interogate_m6anet', level='ERROR'):
+            with self.assertRaisesRegex(ValueError, "Internal server error"):
+                client.annotate(['AT1G01100.2'], [120])
+        server.annotation = (self.transcript_dict, self.gene_exon_counts)
+        self.assert_same_as_cli(client, self.sites)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Unix sockets need a POSIX system")
+    def test_unix_socket(self):
+        """Batches annotated over a Unix socket match annotate_methylated_sites"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        socket_path = os.path.join(temp_dir, 'annotate.sock')
+        self.serve(socket_path=socket_path)
+        self.assert_same_as_cli(AnnotationClient(socket_path=socket_path), self.sites)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Unix sockets need a POSIX system")
+    def test_socket_in_use(self):
+        """A running server's socket is not taken over, but a stale one is replaced"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        socket_path = os.path.join(temp_dir, 'annotate.sock')
+        server = make_server(self.transcript_dict, self.gene_exon_counts, socket_path=socket_path)
+        try:
+            with self.assertRaises(FileExistsError):
+                make_server(self.transcript_dict, self.gene_exon_counts, socket_path=socket_path)
+        finally:
+            # Closing the server leaves its socket file behind, as a crash would
+            server.server_close()
+        self.assertTrue(os.path.exists(socket_path))
+        self.serve(socket_path=socket_path)
+        self.assertEqual(AnnotationClient(socket_path=socket_path).health()['transcripts'],
+                         len(self.transcript_dict))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Unix sockets need a POSIX system")
+    def test_socket_path_not_a_socket(self):
+        """A file that is not a socket is left alone rather than replaced"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        socket_path = os.path.join(temp_dir, 'annotate.sock')
+        with open(socket_path, 'w') as handle:
+            handle.write("keep me\n")
+        with self.assertRaises(FileExistsError):
+            make_server(self.transcript_dict, self.gene_exon_counts, socket_path=socket_path)
+        with open(socket_path) as handle:
+            self.assertEqual(handle.read(), "keep me\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""Tests of the multi-sample site matrix"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+import numpy as np
+import pandas as pd
+from interogate.parse_m6a_site_proba import identify_methylated_sites
+from interogate.site_matrix import SiteMatrix
+from interogate.statistical_analysis import (align_site_counts, condition_read_counts,
+                                             site_read_counts)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestSiteMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        sites = pd.read_csv(os.path.join(REPO_DIR, 'data', 'test.data.site_proba.csv'))
+        rng = np.random.default_rng(5)
+        self.site_files = []
+        for name in ('rep1', 'rep2', 'rep3'):
+            # Each replicate has its own subset of the sites, in its own order
+            sample = sites.sample(frac=0.8, random_state=len(self.site_files))
+            sample = sample.assign(probability_modified=rng.random(len(sample)))
+            site_file = os.path.join(self.temp_dir, f'{name}.csv')
+            sample.to_csv(site_file, index=False)
+            self.site_files.append(site_file)
+        self.matrix_path = os.path.join(self.temp_dir, 'sites.m6amat')
+        SiteMatrix.from_site_files(self.site_files, ['rep1', 'rep2', 'rep3'],
+                                   chunksize=7).save(self.matrix_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_samples_read_back(self):
+        """Each sample's sites come back from the memory-mapped matrix as from its CSV"""
+        matrix = SiteMatrix.load(self.matrix_path)
+        self.assertIsInstance(matrix.entry_sites.base, np.memmap)
+        self.assertEqual(matrix.sample_names, ['rep1', 'rep2', 'rep3'])
+        for site_file in self.site_files:
+            self.assertTrue(matrix.is_current(site_file))
+            for threshold in (0.0, 0.5, 0.9):
+                pd.testing.assert_frame_equal(matrix.methylated_sites(site_file, threshold),
+                                              identify_methylated_sites(site_file, threshold))
+            pd.testing.assert_frame_equal(
+                matrix.methylated_sites(site_file, 0.5, keep_probability=True,
+                                        probability_dtype=np.float64),
+                identify_methylated_sites(site_file, 0.5, keep_probability=True,
+                                          probability_dtype=np.float64))
+        with self.assertRaises(KeyError):
+            matrix.sample_index('rep4')
+
+    def test_resave_keeps_loaded_version(self):
+        """Saving the matrix again swaps a link, leaving the version a reader has loaded"""
+        loaded = SiteMatrix.load(self.matrix_path)
+        loaded_version = os.path.realpath(self.matrix_path)
+        SiteMatrix.from_site_files(self.site_files[:2], ['rep1', 'rep2']).save(self.matrix_path)
+        self.assertTrue(os.path.islink(self.matrix_path))
+        self.assertNotEqual(os.path.realpath(self.matrix_path), loaded_version)
+        self.assertTrue(os.path.isdir(loaded_version))
+        self.assertEqual(loaded.sample_names, ['rep1', 'rep2', 'rep3'])
+        self.assertEqual(len(loaded.read_counts('rep3')[0]),
+                         loaded.sample_offsets[3] - loaded.sample_offsets[2])
+        self.assertEqual(SiteMatrix.load(self.matrix_path).sample_names, ['rep1', 'rep2'])
+
+    def test_concatenate(self):
+        """Matrices of one sample each merge into the matrix of all the samples"""
+        matrix = SiteMatrix.load(self.matrix_path)
+        parts = [SiteMatrix.from_site_files([site_file], [name], chunksize=5)
+                 for site_file, name in zip(self.site_files, ['rep1', 'rep2', 'rep3'])]
+        merged = SiteMatrix.concatenate(parts)
+        self.assertEqual(merged.transcript_ids, matrix.transcript_ids)
+        self.assertEqual(merged.samples, matrix.samples)
+        for name in ['site_transcripts', 'site_positions', 'sample_offsets', 'entry_sites',
+                     'probability_modified', 'n_reads', 'mod_ratio']:
+            np.testing.assert_array_equal(getattr(merged, name), getattr(matrix, name))
+
+    def test_read_counts(self):
+        """The matrix's read counts are the per-sample counts lined up by site"""
+        matrix = SiteMatrix.load(self.matrix_path)
+        sites, modified, unmodified = align_site_counts(
+            [site_read_counts(pd.read_csv(site_file)) for site_file in self.site_files])
+        pd.testing.assert_frame_equal(matrix.sites(), sites)
+        for column, name in enumerate(matrix.sample_names):
+            site_rows, sample_modified, sample_unmodified = matrix.read_counts(name)
+            self.assertTrue(np.shares_memory(site_rows, matrix.entry_sites))
+            np.testing.assert_array_equal(np.bincount(site_rows, sample_modified, len(matrix)),
+                                          modified[:, column])
+            np.testing.assert_array_equal(np.bincount(site_rows, sample_unmodified, len(matrix)),
+                                          unmodified[:, column])
+
+        samples = pd.DataFrame({'sample': ['rep1', 'rep2', 'rep3'],
+                                'condition': ['wt', 'mut', 'wt'],
+                                'site_proba': self.site_files})
+        conditions, pooled_modified, _ = condition_read_counts(matrix, samples)
+        self.assertEqual(conditions, ['wt', 'mut'])
+        np.testing.assert_array_equal(pooled_modified,
+                                      np.stack([modified[:, 0] + modified[:, 2], modified[:, 1]], 1))
+
+    def test_missing_source_is_stale(self):
+        """A sample whose CSV is gone can no longer be checked, so it is not current"""
+        matrix = SiteMatrix.load(self.matrix_path)
+        os.remove(self.site_files[0])
+        self.assertFalse(matrix.is_current('rep1'))
+        self.assertTrue(matrix.is_current('rep2'))
+
+    def test_command_line(self):
+        """interogate_m6anet.py --site-matrix writes the same annotation as reading the CSVs"""
+        script = os.path.join(REPO_DIR, 'interogate_m6anet.py')
+        result = subprocess.run([sys.executable, script, '--m6a'] + self.site_files +
+                                ['--no-plot', '--no-stats', '--no-index-cache',
+                                 '-l', os.path.join(self.temp_dir, 'csv.log')],
+                                cwd=REPO_DIR, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        expected = {}
+        for site_file in self.site_files:
+            annotated = os.path.splitext(site_file)[0] + '_exon_annotated.tab'
+            with open(annotated) as handle:
+                expected[annotated] = handle.read()
+            os.remove(annotated)
+
+        result = subprocess.run([sys.executable, script, '--site-matrix', self.matrix_path,
+                                 '--no-plot', '--no-stats', '--no-index-cache', '--force',
+                                 '-l', os.path.join(self.temp_dir, 'matrix.log')],
+                                cwd=REPO_DIR, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertNotIn("reading the CSV", result.stderr)
+        for annotated, text in expected.items():
+            with open(annotated) as handle:
+                self.assertEqual(handle.read(), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
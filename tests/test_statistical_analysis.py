@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""Tests of the sample sheet driven statistics stage"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2_contingency
+from interogate.site_matrix import SiteMatrix
+from interogate.statistical_analysis import (align_site_counts, benjamini_hochberg, chi2_2x2,
+                                             condition_read_counts,
+                                             filter_common_transcripts, load_samples,
+                                             pairwise_site_tests, process_site_proba,
+                                             read_sample_sheet, summarize_site_proba,
+                                             SAMPLE_SHEET_COLUMNS)
+
+
+class TestLoadSamples(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        sites = pd.read_csv('data/test.data.site_proba.csv')
+        rng = np.random.default_rng(3)
+        rows = []
+        for condition in ('vir1', 'VIRc'):
+            for replicate in (1, 2):
+                sample = f"{condition}_{replicate}"
+                os.makedirs(os.path.join(self.temp_dir, sample))
+                sample_sites = sites.assign(probability_modified=rng.random(len(sites)))
+                sample_sites.to_csv(os.path.join(self.temp_dir, sample, 'data.site_proba.csv'), index=False)
+                reads = pd.DataFrame({
+                    'transcript_id': np.repeat(sites['transcript_id'], 5),
+                    'transcript_position': np.repeat(sites['transcript_position'], 5),
+                    'read_index': np.arange(len(sites) * 5),
+                    'probability_modified': rng.random(len(sites) * 5)})
+                reads.to_csv(os.path.join(self.temp_dir, sample, 'data.indiv_proba.csv'), index=False)
+                rows.append([sample, condition, replicate, f"{sample}/data.site_proba.csv",
+                             f"{sample}/data.indiv_proba.csv"])
+        self.sheet = os.path.join(self.temp_dir, 'samples.tsv')
+        pd.DataFrame(rows, columns=SAMPLE_SHEET_COLUMNS).to_csv(self.sheet, sep='\t', index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_sample_sheet(self):
+        """Relative paths are resolved against the sample sheet's directory"""
+        samples = read_sample_sheet(self.sheet)
+        self.assertEqual(samples['sample'].tolist(), ['vir1_1', 'vir1_2', 'VIRc_1', 'VIRc_2'])
+        self.assertEqual(samples['replicate'].tolist(), [1, 2, 1, 2])
+        self.assertTrue(all(os.path.exists(path) for path in samples['indiv_proba']))
+
+        pd.DataFrame({'sample': ['a']}).to_csv(self.sheet, sep='\t', index=False)
+        with self.assertRaises(ValueError):
+            read_sample_sheet(self.sheet)
+
+    def test_parallel_matches_serial(self):
+        """Samples summarized in worker processes come back in sample sheet order"""
+        samples = read_sample_sheet(self.sheet)
+        site_serial, indiv_serial, matrix = load_samples(samples, threads=1, chunksize=7)
+        self.assertIsNone(matrix)
+        site_parallel, indiv_parallel, matrix = load_samples(samples, threads=3, chunksize=7,
+                                                             build_matrix=True)
+        pd.testing.assert_frame_equal(site_parallel, site_serial)
+        pd.testing.assert_frame_equal(indiv_parallel, indiv_serial)
+
+        # The matrix built in the workers matches one built from all the files at once
+        expected = SiteMatrix.from_site_files(samples['site_proba'], samples['sample'],
+                                              samples['condition'], samples['replicate'])
+        self.assertEqual(matrix.transcript_ids, expected.transcript_ids)
+        self.assertEqual(matrix.samples, expected.samples)
+        for name in ['site_transcripts', 'site_positions', 'sample_offsets', 'entry_sites',
+                     'probability_modified', 'n_reads', 'mod_ratio']:
+            np.testing.assert_array_equal(getattr(matrix, name), getattr(expected, name))
+        self.assertEqual(site_serial.groupby('condition', sort=False)['replicate'].unique()
+                         .apply(list).to_dict(), {'vir1': [1, 2], 'VIRc': [1, 2]})
+        self.assertTrue(((indiv_serial['Modified'] + indiv_serial['Non-Modified']) ==
+                         5 * site_serial['total_sites']).all())
+
+        site_common, indiv_common, label = filter_common_transcripts(site_serial, indiv_serial)
+        self.assertEqual(label, f"common_{site_serial['transcript_id'].nunique()}_genes")
+        self.assertEqual(len(indiv_common), len(indiv_serial))
+
+    def test_site_matrix(self):
+        """Site summaries taken from a site matrix match those read from the CSVs"""
+        samples = read_sample_sheet(self.sheet)
+        matrix_path = os.path.join(self.temp_dir, 'sites.m6amat')
+        SiteMatrix.from_site_files(samples['site_proba'], samples['sample'], samples['condition'],
+                                   samples['replicate']).save(matrix_path)
+        site_csv, indiv_csv, _ = load_samples(samples)
+        site_matrix, indiv_matrix, _ = load_samples(samples, threads=2, site_matrix=matrix_path)
+        pd.testing.assert_frame_equal(site_matrix, site_csv)
+        pd.testing.assert_frame_equal(indiv_matrix, indiv_csv)
+
+    def test_site_matrix_named_by_path(self):
+        """A matrix built from --m6a files is matched to the sample sheet by site_proba path"""
+        samples = read_sample_sheet(self.sheet)
+        matrix_path = os.path.join(self.temp_dir, 'sites.m6amat')
+        SiteMatrix.from_site_files(samples['site_proba']).save(matrix_path)
+        site_csv, _, _ = load_samples(samples)
+        site_matrix, _, _ = load_samples(samples, site_matrix=matrix_path)
+        pd.testing.assert_frame_equal(site_matrix, site_csv)
+        conditions, modified, _ = condition_read_counts(SiteMatrix.load(matrix_path), samples)
+        self.assertEqual(conditions, ['vir1', 'VIRc'])
+        self.assertEqual(modified.shape[1], 2)
+
+        # Samples in the matrix under neither name are listed
+        SiteMatrix.from_site_files(samples['site_proba'][:2]).save(matrix_path)
+        with self.assertRaisesRegex(ValueError, "VIRc_1, VIRc_2"):
+            load_samples(samples, site_matrix=matrix_path)
+        with self.assertRaisesRegex(ValueError, "VIRc_1, VIRc_2"):
+            condition_read_counts(SiteMatrix.load(matrix_path), samples)
+
+    def test_chunked_site_summary(self):
+        """Sites counted in chunks match the summary of the whole site_proba table"""
+        site_file = read_sample_sheet(self.sheet)['site_proba'].iloc[0]
+        whole = process_site_proba(pd.read_csv(site_file)[['transcript_id', 'probability_modified']],
+                                   'vir1', 1, threshold=0.5)
+        chunked = summarize_site_proba(site_file, 'vir1', 1, threshold=0.5, chunksize=3)
+        pd.testing.assert_frame_equal(chunked, whole)
+        self.assertEqual(chunked['total_sites'].sum(), len(pd.read_csv(site_file)))
+
+    def test_common_transcripts(self):
+        """Only transcripts with sites in every condition are kept, and counted in the label"""
+        site_data = pd.DataFrame({'transcript_id': ['A', 'B', 'A', 'C'],
+                                  'condition': ['vir1', 'vir1', 'VIRc', 'VIRc']})
+        indiv_data = site_data.copy()
+        site_common, indiv_common, label = filter_common_transcripts(site_data, indiv_data)
+        self.assertEqual(site_common['transcript_id'].tolist(), ['A', 'A'])
+        self.assertEqual(indiv_common['transcript_id'].tolist(), ['A', 'A'])
+        self.assertEqual(label, "common_1_genes")
+
+
+class TestPerSiteTests(unittest.TestCase):
+
+    def test_chi2_matches_scipy(self):
+        """Batched 2x2 statistics equal chi2_contingency table by table"""
+        rng = np.random.default_rng(11)
+        tables = rng.integers(0, 40, size=(300, 4))
+        tables[:5, 0] = 0
+        tables[:3, 2] = 0
+        tables[5] = [3, 0, 4, 0]
+        for correction in (True, False):
+            statistic, p_values = chi2_2x2(*tables.T, correction=correction)
+            for table, stat, p_value in zip(tables, statistic, p_values):
+                observed = table.reshape(2, 2)
+                if (observed.sum(axis=0) == 0).any() or (observed.sum(axis=1) == 0).any():
+                    self.assertTrue(np.isnan(stat))
+                    continue
+                expected = chi2_contingency(observed, correction=correction)
+                self.assertAlmostEqual(stat, expected[0])
+                self.assertAlmostEqual(p_value, expected[1])
+
+    def test_benjamini_hochberg(self):
+        """BH adjusted p-values, skipping untested sites"""
+        adjusted = benjamini_hochberg([0.01, np.nan, 0.04, 0.03, 0.5])
+        np.testing.assert_allclose(adjusted, [0.04, np.nan, 0.16 / 3, 0.16 / 3, 0.5])
+
+    def test_aligned_sites(self):
+        """Sites are lined up across samples and pooled per condition"""
+        samples = [pd.DataFrame({'transcript_id': ['B.1', 'A.1'], 'transcript_position': [5, 9],
+                                 'modified': [10, 1], 'unmodified': [0, 9]}),
+                   pd.DataFrame({'transcript_id': ['A.1'], 'transcript_position': [9],
+                                 'modified': [2], 'unmodified': [8]}),
+                   pd.DataFrame({'transcript_id': ['A.1', 'B.1'], 'transcript_position': [9, 5],
+                                 'modified': [9, 1], 'unmodified': [1, 9]})]
+        sites, modified, unmodified = align_site_counts(samples)
+        self.assertEqual(list(zip(sites['transcript_id'], sites['transcript_position'])),
+                         [('A.1', 9), ('B.1', 5)])
+        np.testing.assert_array_equal(modified, [[1, 2, 9], [10, 0, 1]])
+
+        tests = pairwise_site_tests(sites, modified, unmodified, ['wt', 'wt', 'mut'])
+        self.assertEqual(tests[['modified_a', 'unmodified_a', 'modified_b', 'unmodified_b']]
+                         .to_numpy().tolist(), [[3, 17, 9, 1], [10, 0, 1, 9]])
+        self.assertTrue((tests['fdr'] < 0.01).all())
+        self.assertLess(tests['log2_odds_ratio'].iloc[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
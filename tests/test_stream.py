@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""Tests of the streaming annotated-site writer"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+import pandas as pd
+from interogate.index_cache import build_index
+from interogate.annotate import annotate_methylated_sites
+from interogate.parse_m6a_site_proba import identify_methylated_sites
+from interogate.summary_stats import count_sites_per_transcript, SiteCountAccumulator
+from interogate.stream import AnnotatedSiteWriter, stream_annotate, tab_annotation
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestStreamAnnotate(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.file_path = 'data/test.data.site_proba.csv'
+        cls.transcript_dict, _, cls.gene_exon_counts, _ = build_index('data/test.gtf')
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_matches_whole_file(self):
+        """Small batches write the same TSV and counts as annotating the whole file"""
+        sites = identify_methylated_sites(self.file_path, 0.5)
+        results_df = annotate_methylated_sites(sites, self.transcript_dict, self.gene_exon_counts)
+        expected_file = os.path.join(self.temp_dir, 'whole.tab')
+        tab_annotation(results_df).to_csv(expected_file, index=False, sep="\t")
+
+        stream_file = os.path.join(self.temp_dir, 'stream.tab')
+        with AnnotatedSiteWriter(stream_file) as writer:
+            counts, n_sites = stream_annotate(self.file_path, self.transcript_dict,
+                                              self.gene_exon_counts, writer, 0.5, batch_size=4)
+        self.assertGreater(writer.batches, 1)
+        self.assertEqual(n_sites, len(results_df))
+        with open(expected_file) as expected, open(stream_file) as streamed:
+            self.assertEqual(streamed.read(), expected.read())
+        pd.testing.assert_frame_equal(counts.per_transcript(),
+                                      count_sites_per_transcript(results_df))
+
+    def test_same_as_cli(self):
+        """The streamed and whole-file runs write byte-identical tables, with or without UTR sites"""
+        for threshold in (0.0, 0.9):
+            run_dir = os.path.join(self.temp_dir, str(threshold))
+            outputs = []
+            for batch_args in ([], ['--batch-size', '3']):
+                out_dir = os.path.join(run_dir, 'stream' if batch_args else 'whole')
+                os.makedirs(out_dir)
+                m6a_file = os.path.join(out_dir, 'sites.csv')
+                shutil.copy(self.file_path, m6a_file)
+                subprocess.run([sys.executable, os.path.join(REPO_DIR, 'interogate_m6anet.py'),
+                                '--m6a', m6a_file, '--gtf', os.path.join(REPO_DIR, 'data', 'test.gtf'),
+                                '--threshold', str(threshold), '--no-plot', '--no-index-cache',
+                                '-l', os.path.join(out_dir, 'log')] + batch_args,
+                               check=True, cwd=REPO_DIR, capture_output=True)
+                with open(os.path.join(out_dir, 'sites_exon_annotated.tab')) as handle:
+                    outputs.append(handle.read())
+            self.assertEqual(outputs[1], outputs[0])
+            total_exons = [line.split('\t')[3] for line in outputs[0].splitlines()[1:]]
+            self.assertIn('3', total_exons)
+            self.assertFalse(any(value.endswith('.0') for value in total_exons))
+
+    def test_no_sites(self):
+        """A threshold no site passes still writes the header"""
+        stream_file = os.path.join(self.temp_dir, 'stream.tab')
+        with AnnotatedSiteWriter(stream_file) as writer:
+            counts, n_sites = stream_annotate(self.file_path, self.transcript_dict,
+                                              self.gene_exon_counts, writer, 1.0, batch_size=4)
+        self.assertEqual(n_sites, 0)
+        self.assertEqual(pd.read_csv(stream_file, sep="\t").columns.tolist(),
+                         ['transcript_id', 'position', 'exon_number', 'total_exons_in_transcript',
+                          'total_exons_in_gene', 'is_last_exon', 'region',
+                          'distance_upstream_junction', 'distance_downstream_junction',
+                          'distance_stop_codon'])
+        self.assertEqual(counts.category_counts(), {'non_last_exon': 0, 'last_exon': 0, 'UTR': 0})
+
+
+class TestSiteCountAccumulator(unittest.TestCase):
+
+    def test_batches_add_up(self):
+        """Counts added batch by batch equal the counts of all the sites"""
+        results_df = pd.DataFrame({
+            'transcript_id': ['B.1', 'A.1', 'A.1', 'B.1', 'A.1', 'C.1'],
+            'exon_number': [1, 3, 'UTR', 2, 1, 'UTR'],
+            'is_last_exon': [False, True, False, False, False, False]
+        })
+        counts = SiteCountAccumulator()
+        for start in range(0, len(results_df), 4):
+            counts.add(results_df.iloc[start:start + 4])
+        pd.testing.assert_frame_equal(counts.per_transcript(),
+                                      count_sites_per_transcript(results_df))
+        self.assertEqual(counts.category_counts(), {'non_last_exon': 3, 'last_exon': 1, 'UTR': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
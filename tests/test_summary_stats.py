@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""Tests of the per-transcript methylation summary"""
+
+import os
+import tempfile
+import unittest
+import pandas as pd
+from interogate.summary_stats import count_sites_per_transcript, summarize_methylation_sites
+
+
+class TestSummarizeMethylationSites(unittest.TestCase):
+
+    def setUp(self):
+        self.results_df = pd.DataFrame({
+            'transcript_id': ['B.1', 'A.1', 'A.1', 'B.1', 'A.1', 'C.1'],
+            'position': [5, 25, 52, 7, 3, 9],
+            'exon_number': [1, 3, 'UTR', 2, 1, 'UTR'],
+            'total_exons_in_transcript': [3, 3, None, 3, 3, None],
+            'total_exons_in_gene': [3, 3, 'Unknown', 3, 3, 'Unknown'],
+            'is_last_exon': [False, True, False, False, False, False]
+        })
+
+    def test_counts_match_per_group_lambda(self):
+        """The groupby-sum gives the same counts as the per-transcript lambda"""
+        expected = self.results_df.groupby('transcript_id').apply(lambda df: pd.Series({
+            'total_sites': len(df),
+            'non_last_exon_sites': len(df[(df['exon_number'] != 'UTR') & (df['is_last_exon'] == False)]),
+            'last_exon_sites': len(df[df['is_last_exon'] == True]),
+            'utr_sites': len(df[df['exon_number'] == 'UTR'])
+        })).reset_index()
+        pd.testing.assert_frame_equal(count_sites_per_transcript(self.results_df), expected)
+
+    def test_summary_file(self):
+        """The summary TSV keeps its columns and Overall row"""
+        temp_dir = tempfile.mkdtemp()
+        output_file = os.path.join(temp_dir, 'summary.tab')
+        try:
+            summarize_methylation_sites(self.results_df, output_file)
+            summary = pd.read_csv(output_file, sep="\t")
+        finally:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            os.rmdir(temp_dir)
+        self.assertEqual(list(summary.columns), ['transcript_id', 'total_sites', 'non_last_exon_sites',
+                                                 'last_exon_sites', 'utr_sites', 'chi2', 'p_value'])
+        self.assertEqual(summary['transcript_id'].tolist(), ['A.1', 'B.1', 'C.1', 'Overall'])
+        self.assertEqual(summary.iloc[-1][['total_sites', 'non_last_exon_sites',
+                                           'last_exon_sites', 'utr_sites']].tolist(), [6, 3, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""Tests of the synthetic benchmark data generators"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from benchmarks.synthetic import write_synthetic_gtf, write_synthetic_site_proba
+from interogate.index_cache import build_index
+from interogate.parse_gtf import parse_gff_gft
+
+
+class TestSyntheticData(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.gtf_path = os.path.join(cls.temp_dir, 'synthetic.gff3')
+        cls.site_path = os.path.join(cls.temp_dir, 'synthetic.site_proba.csv')
+        cls.transcript_lengths = write_synthetic_gtf(cls.gtf_path, n_genes=50)
+        write_synthetic_site_proba(cls.site_path, cls.transcript_lengths, n_rows=2000)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def test_gtf_index_lengths(self):
+        """Every transcript's exons add up to the length the generator reports"""
+        transcript_dict = build_index(self.gtf_path)[0]
+        self.assertEqual(set(transcript_dict), set(self.transcript_lengths))
+        for transcript_id, length in self.transcript_lengths.items():
+            exons = transcript_dict[transcript_id].values()
+            self.assertEqual(max(coordinates[-1] for coordinates in exons), length)
+
+    def test_both_strands_and_features(self):
+        """The annotation has both strands and UTR/CDS records"""
+        features = parse_gff_gft(self.gtf_path)
+        self.assertEqual({feature[6] for feature in features}, {'+', '-'})
+        self.assertTrue({'exon', 'CDS', 'five_prime_UTR', 'three_prime_UTR'}
+                        <= {feature[2] for feature in features})
+
+    def test_site_proba_layout(self):
+        """The site_proba file has the m6anet columns and row count"""
+        sites = pd.read_csv(self.site_path)
+        self.assertEqual(list(sites.columns), ['transcript_id', 'transcript_position', 'n_reads',
+                                               'probability_modified', 'kmer', 'mod_ratio'])
+        self.assertEqual(len(sites), 2000)
+        self.assertTrue(sites['probability_modified'].between(0, 1).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
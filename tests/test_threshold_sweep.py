@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""Tests of the threshold sweep mode"""
+
+import unittest
+import numpy as np
+from interogate.index_cache import build_index
+from interogate.annotate import annotate_methylated_sites
+from interogate.parse_m6a_site_proba import identify_methylated_sites
+from interogate.summary_stats import count_sites_per_transcript
+from interogate.threshold_sweep import parse_thresholds, sweep_thresholds
+
+
+class TestThresholdSweep(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.file_path = 'data/test.data.site_proba.csv'
+        cls.transcript_dict, _, cls.gene_exon_counts, _ = build_index('data/test.gtf')
+
+    def test_parse_thresholds(self):
+        """Thresholds are parsed, de-duplicated and sorted"""
+        self.assertEqual(parse_thresholds("0.9,0.5, 0.7,0.9"), [0.5, 0.7, 0.9])
+        with self.assertRaises(ValueError):
+            parse_thresholds("0.5,high")
+        with self.assertRaises(ValueError):
+            parse_thresholds("1.5")
+
+    def test_sweep_matches_separate_runs(self):
+        """Each threshold gives the same counts as filtering at that threshold"""
+        thresholds = [0.0, 0.5, 0.9, 0.95, 0.99]
+        sites = identify_methylated_sites(self.file_path, thresholds[0], keep_probability=True,
+                                          probability_dtype=np.float64)
+        results_df = annotate_methylated_sites(sites, self.transcript_dict, self.gene_exon_counts)
+        sweep_df = sweep_thresholds(results_df, sites['probability_modified'], thresholds)
+
+        self.assertEqual(sweep_df['threshold'].tolist(), thresholds)
+        for _, row in sweep_df.iterrows():
+            single = identify_methylated_sites(self.file_path, row['threshold'])
+            single_df = annotate_methylated_sites(single, self.transcript_dict, self.gene_exon_counts)
+            counts = count_sites_per_transcript(single_df)
+            self.assertEqual(row['total_sites'], len(single_df))
+            self.assertEqual(row['transcripts'], len(counts))
+            for column in ['non_last_exon_sites', 'last_exon_sites', 'utr_sites']:
+                self.assertEqual(row[column], counts[column].sum())
+
+    def test_threshold_above_all_sites(self):
+        """A threshold no site passes gives zero counts and no test"""
+        sites = identify_methylated_sites(self.file_path, 0.5, keep_probability=True,
+                                          probability_dtype=np.float64)
+        results_df = annotate_methylated_sites(sites, self.transcript_dict, self.gene_exon_counts)
+        row = sweep_thresholds(results_df, sites['probability_modified'], [1.0]).iloc[0]
+        self.assertEqual(row['total_sites'], 0)
+        self.assertEqual(row['transcripts'], 0)
+        self.assertTrue(np.isnan(row['chi2']))
+
+
+if __name__ == '__main__':
+    unittest.main()